@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import BaseUserManager
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import models
 from uuidfield import UUIDField
@@ -27,13 +28,39 @@ class APIKey(models.Model):
         return u'{}: {}'.format(unicode(self.user), self.key)
 
 
+def api_key_cache_key(user_pk, key):
+    """Return the key in the shared cache for what is cached about the API key
+    with the given user pk and key (see quark.events.views.ical).
+    """
+    return 'api_key_{}_{}'.format(user_pk, key)
+
+
 def create_api_key(sender, instance, created, **kwargs):
     """A receiver for a signal to automatically create an APIKey for users."""
     if created:
         APIKey.objects.create(user=instance)
 
 
+def api_key_pre_save(sender, instance, **kwargs):
+    """Remove the old key of an API key that is being changed from the cache,
+    so that the old key stops working right away.
+    """
+    if instance.pk is None:
+        return
+    old_values = APIKey.objects.filter(pk=instance.pk).values_list(
+        'user', 'key').first()
+    if old_values is not None:
+        cache.delete(api_key_cache_key(*old_values))
+
+
+def api_key_delete(sender, instance, **kwargs):
+    """Remove a deleted API key from the cache."""
+    cache.delete(api_key_cache_key(instance.user_id, instance.key))
+
+
 models.signals.post_save.connect(create_api_key, sender=get_user_model())
+models.signals.pre_save.connect(api_key_pre_save, sender=APIKey)
+models.signals.post_delete.connect(api_key_delete, sender=APIKey)
 
 
 class LDAPUserManager(BaseUserManager):
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
+from quark.achievements.evaluation import evaluate_achievements
 from quark.achievements.models import Achievement
+from quark.achievements.models import PendingAchievementEvaluation
 from quark.achievements.models import UserAchievement
 
 
@@ -21,5 +23,28 @@ class UserAchievementAdmin(admin.ModelAdmin):
     list_display = ('achievement', 'user', 'acquired', 'progress',
                     'assigner', 'term')
 
+
+class PendingAchievementEvaluationAdmin(admin.ModelAdmin):
+    search_fields = ('^user__first_name', '^user__last_name',
+                     '^user__username')
+    list_display = ('user', 'kind', 'term', 'created')
+    list_filter = ('kind', 'term')
+    list_select_related = True
+    actions = ('evaluate',)
+
+    def evaluate(self, request, queryset):
+        evaluations = list(queryset.select_related('user', 'term'))
+        for evaluation in evaluations:
+            evaluate_achievements(
+                evaluation.user, evaluation.kind, [evaluation.term])
+            evaluation.delete()
+        self.message_user(
+            request, 'Evaluated {} pending achievement evaluations.'.format(
+                len(evaluations)))
+    evaluate.short_description = 'Evaluate selected achievements now'
+
+
 admin.site.register(Achievement, AchievementAdmin)
 admin.site.register(UserAchievement, UserAchievementAdmin)
+admin.site.register(PendingAchievementEvaluation,
+                    PendingAchievementEvaluationAdmin)
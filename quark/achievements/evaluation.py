@@ -0,0 +1,120 @@
+import collections
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from quark.achievements.models import PendingAchievementEvaluation
+
+
+# The number of times that a pending evaluation is attempted before it is
+# removed from the queue
+MAX_EVALUATION_ATTEMPTS = 3
+
+
+def queue_evaluation(user, kind, term):
+    """Queue an evaluation of the given user's achievements of the given kind
+    (one of the kinds of PendingAchievementEvaluation) for the given term.
+
+    If the same evaluation is already pending, nothing is queued. If
+    settings.ACHIEVEMENT_QUEUE_SYNC is True, the achievements are evaluated
+    right away instead.
+    """
+    if settings.ACHIEVEMENT_QUEUE_SYNC:
+        evaluate_achievements(user, kind, [term])
+    elif not PendingAchievementEvaluation.objects.filter(
+            user=user, kind=kind, term=term).update(attempts=0):
+        # Updating a pending evaluation that is being processed waits until it
+        # has been processed and removed (see process_pending_evaluations),
+        # in which case it is queued again, since its evaluation might have
+        # missed the change that queued it
+        PendingAchievementEvaluation.objects.get_or_create(
+            user=user, kind=kind, term=term)
+
+
+def evaluate_achievements(user, kind, terms):
+    """Assign the achievements of the given kind that the given user has
+    earned in the given terms.
+    """
+    # Avoid circular dependency by importing here:
+    from quark.achievements.event_achievements import \
+        evaluate_event_achievements
+    from quark.achievements.officership_achievements import \
+        evaluate_officership_achievements
+    from quark.achievements.pr_achievements import \
+        evaluate_project_report_achievements
+
+    if kind == PendingAchievementEvaluation.EVENT:
+        evaluate_event_achievements(user, terms)
+    elif kind == PendingAchievementEvaluation.OFFICER:
+        evaluate_officership_achievements(user)
+    elif kind == PendingAchievementEvaluation.PROJECT_REPORT:
+        evaluate_project_report_achievements(user, terms)
+    else:
+        raise ValueError('Unknown kind of achievements: {}'.format(kind))
+
+
+def process_pending_evaluations(batch_size=100):
+    """Evaluate up to batch_size of the oldest pending evaluations, evaluating
+    each kind of achievement for each user only once (for all of the terms
+    queued for that user and kind).
+
+    The pending evaluations of each user and kind are locked while they are
+    evaluated, and are only removed from the queue once evaluating them
+    succeeds. If evaluating them fails, they are queued again (behind the
+    others), unless they have failed MAX_EVALUATION_ATTEMPTS times, in which
+    case they are removed.
+
+    Returns a tuple of the number of evaluations processed and a list of
+    descriptions of the evaluations that failed.
+    """
+    pending = list(PendingAchievementEvaluation.objects.select_related(
+        'user')[:batch_size])
+
+    # Map from each user to a map from each kind to the pks of the pending
+    # evaluations
+    evaluations = collections.OrderedDict()
+    for evaluation in pending:
+        user_evaluations = evaluations.setdefault(
+            evaluation.user, collections.OrderedDict())
+        user_evaluations.setdefault(evaluation.kind, []).append(evaluation.pk)
+
+    errors = []
+    for user, user_evaluations in evaluations.iteritems():
+        for kind, pks in user_evaluations.iteritems():
+            try:
+                with transaction.atomic():
+                    # Evaluations that another process has already removed
+                    # are skipped
+                    locked = list(PendingAchievementEvaluation.objects.filter(
+                        pk__in=pks).select_for_update().select_related(
+                        'term'))
+                    if locked:
+                        evaluate_achievements(
+                            user, kind,
+                            [evaluation.term for evaluation in locked])
+                        PendingAchievementEvaluation.objects.filter(
+                            pk__in=[evaluation.pk for evaluation in locked]
+                        ).delete()
+            except Exception:  # pylint: disable=W0703
+                errors.append(record_failed_evaluations(user, kind, pks))
+    return len(pending), errors
+
+
+def record_failed_evaluations(user, kind, pks):
+    """Queue the pending evaluations with the given pks, of the given user and
+    kind, again after evaluating them failed, or remove them if they have
+    failed MAX_EVALUATION_ATTEMPTS times.
+
+    Returns a description of the failure.
+    """
+    failed = PendingAchievementEvaluation.objects.filter(pk__in=pks)
+    failed.update(attempts=F('attempts') + 1, created=timezone.now())
+    dropped = failed.filter(attempts__gte=MAX_EVALUATION_ATTEMPTS)
+    error = u'Failed to evaluate {} achievements of {}'.format(
+        kind, user.get_full_name())
+    if dropped.exists():
+        dropped.delete()
+        error += u' {} times, so gave up'.format(MAX_EVALUATION_ATTEMPTS)
+    return error
@@ -1,141 +1,309 @@
+import collections
 import re
-import string
 
 from django.db import models
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import F
 
-from quark.achievements.models import Achievement
+from quark.achievements.evaluation import queue_evaluation
+from quark.achievements.models import AttendanceCounter
+from quark.achievements.models import EventTypeAttendanceCounter
+from quark.achievements.models import PendingAchievementEvaluation
+from quark.achievements.models import TermAttendanceCounter
+from quark.achievements.models import UserAchievement
+from quark.achievements.models import invalidate_user_achievements_cache
+from quark.achievements.registry import registry
 from quark.base.models import Term
 from quark.events.models import Event
 from quark.events.models import EventAttendance
+from quark.shortcuts import disable_for_loaddata
 from quark.shortcuts import get_object_or_none
 
 
+# A map from the name of an event type to the name of the corresponding
+# achievement for attending all events of that type in a term
+EVENT_TYPE_ACHIEVEMENTS = {
+    'Meeting': 'attend_all_meetings',
+    'Big Social': 'attend_all_big_socials',
+    'Bent Polishing': 'attend_all_bent_polishings',
+    'Infosession': 'attend_all_infosessions',
+    'Community Service': 'attend_all_service',
+    'E Futures': 'attend_all_efutures',
+    'Fun': 'attend_all_fun',
+    'Professional Development': 'attend_all_prodev'
+}
+
+# The number of events needed to get the lifetime attendance achievements
+LIFETIME_BENCHMARKS = [25, 50, 78, 100, 150, 200, 300]
+
+# A map from each benchmark to the name of its lifetime attendance achievement
+LIFETIME_ACHIEVEMENTS = dict(
+    (benchmark, 'attend{:03d}events'.format(benchmark))
+    for benchmark in LIFETIME_BENCHMARKS)
+
+# The names of all of the achievements for event attendance
+EVENT_ACHIEVEMENTS = (
+    EVENT_TYPE_ACHIEVEMENTS.values() + LIFETIME_ACHIEVEMENTS.values() +
+    ['alphabet_attendance', 'attend_each_type', 'attend_d15',
+     'attend_convention', 'berkeley_explosion'])
+
+# The letters bitmask of a term counter once all of the letters a-z are seen
+ALL_LETTERS = (1 << 26) - 1
+
+
+def get_letters_mask(name):
+    """Return a bitmask of the letters a-z (ignoring case) in the given name,
+    where bit 0 is 'a' and bit 25 is 'z'.
+    """
+    mask = 0
+    for letter in name.lower():
+        if 'a' <= letter <= 'z':
+            mask |= 1 << (ord(letter) - ord('a'))
+    return mask
+
+
+def rebuild_attendance_counters(user_pk):
+    """Recount all of the attendance counters of the given user from the
+    user's event attendance.
+
+    The counters are otherwise kept up to date incrementally, so this is only
+    needed to build the counters of a user whose attendance was recorded
+    before the counters existed, or to repair the counters.
+    """
+    attendances = EventAttendance.objects.filter(
+        user=user_pk, event__cancelled=False).values_list(
+        'event__term', 'event__event_type', 'event__name')
+
+    # Map term pks to [count, letters]
+    term_counts = {}
+    type_counts = collections.Counter()
+    for term_pk, event_type_pk, name in attendances:
+        term_count = term_counts.setdefault(term_pk, [0, 0])
+        term_count[0] += 1
+        term_count[1] |= get_letters_mask(name)
+        type_counts[(term_pk, event_type_pk)] += 1
+
+    with transaction.atomic():
+        AttendanceCounter.objects.filter(user=user_pk).delete()
+        TermAttendanceCounter.objects.filter(user=user_pk).delete()
+        EventTypeAttendanceCounter.objects.filter(user=user_pk).delete()
+        AttendanceCounter.objects.create(
+            user_id=user_pk, count=len(attendances))
+        TermAttendanceCounter.objects.bulk_create([
+            TermAttendanceCounter(user_id=user_pk, term_id=term_pk,
+                                  count=count, letters=letters)
+            for term_pk, (count, letters) in term_counts.iteritems()])
+        EventTypeAttendanceCounter.objects.bulk_create([
+            EventTypeAttendanceCounter(user_id=user_pk, term_id=term_pk,
+                                       event_type_id=event_type_pk,
+                                       count=count)
+            for (term_pk, event_type_pk), count in type_counts.iteritems()])
+
+
+def update_attendance_counters(user_pk, event, delta):
+    """Add delta (1 for recorded attendance or -1 for removed attendance) to
+    the attendance counters of the given user for the given event.
+
+    Return False without changing anything if the user has no counters yet.
+    """
+    with transaction.atomic():
+        # Updating the user's AttendanceCounter first locks it until the end of
+        # the transaction, so the user's other counters cannot be created
+        # concurrently below
+        if not AttendanceCounter.objects.filter(user=user_pk).update(
+                count=F('count') + delta):
+            return False
+
+        term_counters = TermAttendanceCounter.objects.filter(
+            user=user_pk, term=event.term_id)
+        type_counters = EventTypeAttendanceCounter.objects.filter(
+            user=user_pk, term=event.term_id, event_type=event.event_type_id)
+        if delta > 0:
+            letters = get_letters_mask(event.name)
+            if not term_counters.update(count=F('count') + delta,
+                                        letters=F('letters').bitor(letters)):
+                TermAttendanceCounter.objects.create(
+                    user_id=user_pk, term_id=event.term_id, count=delta,
+                    letters=letters)
+            if not type_counters.update(count=F('count') + delta):
+                EventTypeAttendanceCounter.objects.create(
+                    user_id=user_pk, term_id=event.term_id,
+                    event_type_id=event.event_type_id, count=delta)
+        else:
+            # Letters cannot be removed from the bitmask without knowing the
+            # names of the other events attended in the term
+            names = EventAttendance.objects.filter(
+                user=user_pk, event__term=event.term_id,
+                event__cancelled=False).values_list('event__name', flat=True)
+            letters = 0
+            for name in names:
+                letters |= get_letters_mask(name)
+            term_counters.update(count=F('count') + delta, letters=letters)
+            type_counters.update(count=F('count') + delta)
+    return True
+
+
 def event_achievements(sender, instance, created, **kwargs):
-    # obtain lifetime attendance for the user
-    total_attendance = EventAttendance.objects.select_related(
-        'event__term').filter(
-        user=instance.user, event__cancelled=False).order_by('event__term__pk')
-
-    # obtain the events in the term that the edited event is in
-    term_events = Event.objects.filter(
-        cancelled=False, term=instance.event.term)
-
-    # obtain the events that the user has attended in this term
-    term_attendance = total_attendance.filter(
-        event__term=instance.event.term).select_related(
-        'term', 'event__event_type')
-
-    # obtain the events in the term with the same type
-    type_events = term_events.filter(event_type=instance.event.event_type)
-
-    # sets of the event types attended and existing in the term to assign
-    # the achievement for attending 1 event of each type
-    types_attended = term_attendance.values('event__event_type').distinct()
-    types_existing = term_events.values('event_type').distinct()
-
-    # remaining letters to track the achievement for attending events with
-    # the letters a-z in their titles in a term
-    remaining_letters = set(string.lowercase)
-
-    for event_attendance in term_attendance:
-        remaining_letters.difference_update(
-            event_attendance.event.name.lower())
-        if len(remaining_letters) == 0:
-            break
-
-    assign_alphabet_achievement(instance, remaining_letters)
-    assign_event_type_achievements(instance, type_events)
-    assign_lifetime_achievements(instance, total_attendance)
-    assign_salad_bowl_achievement(instance, types_attended, types_existing)
-    assign_specific_event_achievements(instance)
-
-
-def assign_alphabet_achievement(instance, remaining_letters):
-    if len(remaining_letters) == 0:
-        achievement = get_object_or_none(Achievement,
-                                         short_name='alphabet_attendance')
-        if achievement:
-            achievement.assign(instance.user, term=instance.event.term)
-
-
-def assign_event_type_achievements(instance, type_events):
-    # obtain the user's attendance for events with the same type as instance
-    type_attendance = EventAttendance.objects.filter(
-        user=instance.user,
-        event__event_type=instance.event.event_type,
-        event__term=instance.event.term,
-        event__cancelled=False)
-
-    event_type = instance.event.event_type
-    # a map from the name of the event_type to the name of the corresponding
-    # achievement, for use in determining what achievement to update
-    event_type_map = {
-        'Meeting': 'meetings',
-        'Big Social': 'big_socials',
-        'Bent Polishing': 'bent_polishings',
-        'Infosession': 'infosessions',
-        'Community Service': 'service',
-        'E Futures': 'efutures',
-        'Fun': 'fun',
-        'Professional Development': 'prodev'
-        }
-
-    if event_type.name in event_type_map:
-        short_name = 'attend_all_{}'.format(
-            event_type_map[instance.event.event_type.name])
-        achievement = get_object_or_none(
-            Achievement, short_name=short_name)
-        if achievement and (type_events.count() == type_attendance.count()):
-            achievement.assign(instance.user, term=instance.event.term)
-
-
-def assign_lifetime_achievements(instance, total_attendance):
-    attendance_count = total_attendance.count()
-
-    # the number of events needed to get achievements
-    benchmarks = [25, 50, 78, 100, 150, 200, 300]
-
-    for benchmark in benchmarks:
-        short_name = 'attend{:03d}events'.format(benchmark)
-        achievement = get_object_or_none(Achievement, short_name=short_name)
-        if achievement:
-            if attendance_count < benchmark:
-                achievement.assign(
-                    instance.user, acquired=False, progress=attendance_count)
-            else:
-                achievement.assign(
-                    instance.user,
-                    term=total_attendance[benchmark - 1].event.term)
-
-
-def assign_salad_bowl_achievement(instance, types_attended, types_existing):
-    if types_attended.count() == types_existing.count():
-        achievement = get_object_or_none(
-            Achievement, short_name='attend_each_type')
-        if achievement:
-            achievement.assign(instance.user, term=instance.event.term)
-
-
-def assign_specific_event_achievements(instance):
+    """Update the attendance counters of the user for newly recorded attendance
+    and queue an evaluation of the user's event achievements.
+    """
+    event = instance.event
+    if created and not event.cancelled:
+        if not update_attendance_counters(instance.user_id, event, 1):
+            rebuild_attendance_counters(instance.user_id)
+    queue_evaluation(
+        instance.user, PendingAchievementEvaluation.EVENT, event.term)
+
+
+def event_achievements_delete(sender, instance, **kwargs):
+    """Update the attendance counters of the user and the progress towards the
+    lifetime attendance achievements for removed attendance.
+
+    Achievements are not assigned here, since attendance is also removed when
+    its user is deleted.
+    """
+    event = instance.event
+    if not event.cancelled and update_attendance_counters(
+            instance.user_id, event, -1):
+        attendance_count = AttendanceCounter.objects.get(
+            user=instance.user_id).count
+        UserAchievement.objects.filter(
+            user=instance.user_id, acquired=False,
+            achievement__short_name__in=LIFETIME_ACHIEVEMENTS.values()).update(
+            progress=attendance_count)
+        invalidate_user_achievements_cache([instance.user_id])
+
+
+def evaluate_event_achievements(user, terms):
+    """Assign the event achievements that the given user has earned in the
+    given terms, and update the user's progress towards the lifetime
+    attendance achievements.
+    """
+    achievements = registry.get_many(EVENT_ACHIEVEMENTS)
+    for term in terms:
+        term_counter = get_object_or_none(
+            TermAttendanceCounter, user=user, term=term)
+        if term_counter is not None:
+            assign_alphabet_achievement(
+                user, term, term_counter.letters, achievements)
+
+        # the number of events in the term with each type
+        type_events = dict(Event.objects.filter(
+            cancelled=False, term=term).order_by().values_list(
+            'event_type__name').annotate(count=Count('pk')))
+        # the user's attendance for events with each type in the term
+        type_attendance = dict(EventTypeAttendanceCounter.objects.filter(
+            user=user, term=term, count__gt=0).values_list(
+            'event_type__name', 'count'))
+        assign_event_type_achievements(
+            user, term, type_attendance, type_events, achievements)
+
+        names = EventAttendance.objects.filter(
+            user=user, event__term=term).values_list('event__name', flat=True)
+        assign_specific_event_achievements(user, term, names, achievements)
+
+    term_counts = [
+        (term_counter.term, term_counter.count) for term_counter in
+        TermAttendanceCounter.objects.filter(
+            user=user, count__gt=0).select_related('term').order_by('term')]
+    assign_lifetime_achievements(user, term_counts, achievements)
+
+
+def assign_alphabet_achievement(user, term, letters, achievements):
+    achievement = achievements.get('alphabet_attendance')
+    if achievement and letters == ALL_LETTERS:
+        achievement.assign(user, term=term)
+
+
+def assign_event_type_achievements(user, term, type_attendance, type_events,
+                                   achievements):
+    """Assign the achievements for attending all events of a type in the
+    given term and for attending an event of each type in the term, given
+    dictionaries mapping event type names to the number of (non-cancelled)
+    events of the type that the user attended and that took place in the
+    term.
+    """
+    for event_type, count in type_attendance.iteritems():
+        achievement = achievements.get(EVENT_TYPE_ACHIEVEMENTS.get(event_type))
+        if achievement and count and type_events.get(event_type) == count:
+            achievement.assign(user, term=term)
+
+    # the achievement for attending 1 event of each type in the term
+    types_attended = len([count for count in type_attendance.values()
+                          if count])
+    achievement = achievements.get('attend_each_type')
+    if achievement and types_attended and types_attended == len(type_events):
+        achievement.assign(user, term=term)
+
+
+def assign_lifetime_achievements(user, term_counts, achievements):
+    """Assign the lifetime attendance achievements, given a list of terms and
+    the number of (non-cancelled) events that the user attended in each term,
+    in chronological order.
+    """
+    attendance_count = sum(count for _, count in term_counts)
+
+    # the term in which each benchmark was reached, found by adding up the
+    # user's attendance in each term in order
+    benchmark_terms = {}
+    total = 0
+    for term, count in term_counts:
+        total += count
+        for benchmark in LIFETIME_BENCHMARKS:
+            if total >= benchmark and benchmark not in benchmark_terms:
+                benchmark_terms[benchmark] = term
+
+    for benchmark in LIFETIME_BENCHMARKS:
+        achievement = achievements.get(LIFETIME_ACHIEVEMENTS[benchmark])
+        if achievement is None:
+            continue
+        if benchmark in benchmark_terms:
+            achievement.assign(user, term=benchmark_terms[benchmark])
+        else:
+            achievement.assign(
+                user, acquired=False, progress=attendance_count)
+
+
+def assign_specific_event_achievements(user, term, names, achievements):
+    """Assign the achievements for attending specific events, given the names
+    of the events that the user attended in the given term.
+    """
     d15_regex = re.compile(r'.*D(istrict)?[\s]?15.*')
-    if d15_regex.match(instance.event.name):
-        d15_achievement = get_object_or_none(Achievement,
-                                             short_name='attend_d15')
-        if d15_achievement:
-            d15_achievement.assign(instance.user, term=instance.event.term)
-
-    if 'National Convention' in instance.event.name:
-        natl_achievement = get_object_or_none(Achievement,
-                                              short_name='attend_convention')
-        if natl_achievement:
-            natl_achievement.assign(instance.user, term=instance.event.term)
-
-    if instance.event.name == 'Candidate Meeting' and (
-            instance.event.term == Term(term=Term.FALL, year=2013)):
-        cm2013_achievement = get_object_or_none(
-            Achievement, short_name='berkeley_explosion')
-        if cm2013_achievement:
-            cm2013_achievement.assign(instance.user, term=instance.event.term)
+    for name in names:
+        d15_achievement = achievements.get('attend_d15')
+        if d15_achievement and d15_regex.match(name):
+            d15_achievement.assign(user, term=term)
+
+        natl_achievement = achievements.get('attend_convention')
+        if natl_achievement and 'National Convention' in name:
+            natl_achievement.assign(user, term=term)
+
+        cm2013_achievement = achievements.get('berkeley_explosion')
+        if cm2013_achievement and name == 'Candidate Meeting' and (
+                term == Term(term=Term.FALL, year=2013)):
+            cm2013_achievement.assign(user, term=term)
+
+
+@disable_for_loaddata
+def event_post_save(sender, instance, created, **kwargs):
+    """Rebuild the attendance counters of the users who attended an event if
+    any of the fields that its attendance is counted by (its term, type, name
+    and cancellation, as remembered by quark.events.models.event_pre_save)
+    changed.
+    """
+    old_fields = getattr(instance, 'old_fields', None)
+    if created or old_fields is None:
+        return
+    if instance.get_tracked_fields() == old_fields:
+        return
+    user_pks = AttendanceCounter.objects.filter(
+        user__eventattendance__event=instance).values_list('user', flat=True)
+    for user_pk in user_pks:
+        rebuild_attendance_counters(user_pk)
 
 
 models.signals.post_save.connect(event_achievements, sender=EventAttendance)
+models.signals.post_delete.connect(
+    event_achievements_delete, sender=EventAttendance)
+models.signals.post_save.connect(event_post_save, sender=Event)
@@ -24,8 +24,8 @@ class UserAchievementForm(ChosenTermMixin, forms.Form):
         }
 
     def save(self, assigner):
-        """For each user specified in the form, this calls the achievement's
-        assign method to give it to that user with any specified data.
+        """This calls the achievement's assign_many method to give it to each
+        user specified in the form with any specified data.
 
         The assigner argument is the user who is giving the achievement,
         usually self.request.user.
@@ -35,6 +35,5 @@ class UserAchievementForm(ChosenTermMixin, forms.Form):
         achievement = self.cleaned_data.get('achievement')
         data = self.cleaned_data.get('data')
 
-        for user in users:
-            achievement.assign(user, term=term, data=data,
-                               assigner=assigner)
+        achievement.assign_many(users, term=term, data=data,
+                                assigner=assigner)
@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from quark.achievements.evaluation import process_pending_evaluations
+
+
+class Command(BaseCommand):
+    help = ('Evaluate the achievements of the users in the queue of pending '
+            'achievement evaluations, until the queue is empty. Meant to be '
+            'run periodically (e.g., every minute by cron).')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-b', '--batch-size', dest='batch_size', type='int', default=100,
+            help='The number of pending evaluations to process at a time'),
+        )
+
+    def handle(self, *args, **kwargs):
+        total = 0
+        errors = []
+        while not errors:
+            processed, errors = process_pending_evaluations(
+                batch_size=kwargs['batch_size'])
+            total += processed
+            if processed < kwargs['batch_size']:
+                break
+
+        if int(kwargs.get('verbosity')) > 0:
+            self.stdout.write(
+                'Processed {} pending achievement evaluations'.format(total))
+        if errors:
+            # The failed evaluations were queued again (unless they failed
+            # too many times), so stop processing to avoid retrying them
+            # right away
+            for error in errors:
+                self.stderr.write(error)
+            raise CommandError(
+                '{} achievement evaluations failed'.format(len(errors)))
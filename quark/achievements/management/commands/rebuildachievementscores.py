@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from quark.achievements.models import AchievementScore
+from quark.achievements.models import UserAchievement
+from quark.achievements.models import update_achievement_ranks
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the achievement scores and leaderboard ranks of all '
+            'users. These are kept up to date when user achievements change, '
+            'so this is only needed to build them for existing achievements or '
+            'to repair them.')
+
+    def handle(self, *args, **kwargs):
+        num_scores = rebuild_achievement_scores()
+        if int(kwargs.get('verbosity')) > 0:
+            self.stdout.write(
+                'Stored {} achievement scores'.format(num_scores))
+
+
+def rebuild_achievement_scores():
+    """Replace the AchievementScores of all users with ones summed from their
+    acquired achievements, and rank them.
+
+    Returns the number of scores stored.
+    """
+    scores = UserAchievement.objects.filter(acquired=True).order_by(
+        ).values_list('user').annotate(score=Sum('achievement__points'))
+    with transaction.atomic():
+        AchievementScore.objects.all().delete()
+        AchievementScore.objects.bulk_create([
+            AchievementScore(user_id=user_pk, score=score)
+            for user_pk, score in scores])
+        update_achievement_ranks()
+    return len(scores)
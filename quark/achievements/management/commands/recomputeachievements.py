@@ -0,0 +1,357 @@
+import collections
+import itertools
+import multiprocessing
+from optparse import make_option
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import Q
+from django.utils import timezone
+
+from quark.achievements.event_achievements import EVENT_ACHIEVEMENTS
+from quark.achievements.event_achievements import \
+    assign_alphabet_achievement
+from quark.achievements.event_achievements import \
+    assign_event_type_achievements
+from quark.achievements.event_achievements import \
+    assign_lifetime_achievements
+from quark.achievements.event_achievements import \
+    assign_specific_event_achievements
+from quark.achievements.event_achievements import get_letters_mask
+from quark.achievements.models import UserAchievement
+from quark.achievements.models import invalidate_user_achievements_cache
+from quark.achievements.models import update_achievement_scores
+from quark.achievements.officership_achievements import EXCLUDED_POSITIONS
+from quark.achievements.officership_achievements import \
+    OFFICERSHIP_ACHIEVEMENTS
+from quark.achievements.officership_achievements import \
+    assign_officership_achievements
+from quark.achievements.pr_achievements import PROJECT_REPORT_ACHIEVEMENTS
+from quark.achievements.pr_achievements import \
+    assign_alphabet_pr_achievement
+from quark.achievements.pr_achievements import \
+    assign_lifetime_pr_achievements
+from quark.achievements.pr_achievements import \
+    assign_procrastination_achievement
+from quark.achievements.registry import registry
+from quark.base.models import Officer
+from quark.base.models import Term
+from quark.events.models import Event
+from quark.events.models import EventAttendance
+from quark.notifications.models import Notification
+from quark.project_reports.models import ProjectReport
+
+
+class Command(BaseCommand):
+    help = ('Recompute the event, officership and project report '
+            'achievements of all users from their event attendance, officer '
+            'positions and project reports, and save the differences.')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-u', '--users', dest='users', default='',
+            help='Only recompute the achievements of the users with the given '
+                 'comma-separated usernames'),
+        make_option(
+            '-n', '--dry-run', action='store_true', dest='dry_run',
+            default=False,
+            help='Only print the differences, without saving them'),
+        make_option(
+            '-p', '--processes', dest='processes', type='int',
+            default=multiprocessing.cpu_count(),
+            help='The number of worker processes (1 to work in this process)'),
+        make_option(
+            '-c', '--chunk-size', dest='chunk_size', type='int', default=200,
+            help='The number of users that a worker process handles at a time'),
+        )
+
+    def handle(self, *args, **kwargs):
+        users = get_user_model().objects.order_by('pk')
+        if kwargs.get('users'):
+            usernames = kwargs['users'].split(',')
+            users = users.filter(username__in=usernames)
+            unknown = set(usernames) - set(
+                users.values_list('username', flat=True))
+            if unknown:
+                raise CommandError('Unknown users: {}'.format(
+                    ', '.join(sorted(unknown))))
+        user_pks = list(users.values_list('pk', flat=True))
+        chunk_size = kwargs['chunk_size']
+        chunks = [(user_pks[i:i + chunk_size], kwargs['dry_run'])
+                  for i in range(0, len(user_pks), chunk_size)]
+        verbosity = int(kwargs.get('verbosity'))
+
+        if kwargs['processes'] > 1:
+            # Each worker process needs its own database connection, so make
+            # sure that they do not inherit this process's connection
+            connection.close()
+            pool = multiprocessing.Pool(kwargs['processes'])
+            results = pool.imap_unordered(recompute_chunk, chunks)
+        else:
+            pool = None
+            results = itertools.imap(recompute_chunk, chunks)
+
+        num_users = 0
+        num_changes = 0
+        for chunk_users, changes in results:
+            num_users += chunk_users
+            num_changes += len(changes)
+            if kwargs['dry_run'] or verbosity > 1:
+                for change in changes:
+                    self.stdout.write(change)
+            if verbosity > 0:
+                self.stdout.write(
+                    'Recomputed achievements of {}/{} users'.format(
+                        num_users, len(user_pks)))
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        if verbosity > 0:
+            self.stdout.write('{} {} user achievements'.format(
+                'Found differences in' if kwargs['dry_run'] else 'Updated',
+                num_changes))
+
+
+def recompute_chunk(args):
+    """Recompute the achievements of a list of users, for a worker process.
+
+    Takes a tuple of the list of user pks and whether to only compute the
+    differences (see recompute_achievements). Returns a tuple of the number
+    of users and the list of descriptions of the differences.
+    """
+    user_pks, dry_run = args
+    return len(user_pks), recompute_achievements(user_pks, dry_run=dry_run)
+
+
+class RecordedAchievement(object):
+    """Stands in for an Achievement in the achievement rules, recording the
+    assignments of the achievement in a dictionary of unsaved user
+    achievements (keyed by user pk and achievement pk) instead of saving them.
+    """
+    def __init__(self, achievement, user_achievements, current_term):
+        self.achievement = achievement
+        self.user_achievements = user_achievements
+        self.current_term = current_term
+
+    def assign(self, user, acquired=True, progress=0, term=None, data='',
+               assigner=None):
+        if term is None:
+            term = self.current_term
+        key = (user.pk, self.achievement.pk)
+        user_achievement = self.user_achievements.get(key)
+        if user_achievement is None:
+            user_achievement = UserAchievement(
+                user=user, achievement=self.achievement)
+            self.user_achievements[key] = user_achievement
+        user_achievement.update_assignment(
+            acquired=acquired, progress=progress, term=term, data=data,
+            assigner=assigner)
+        return True
+
+
+def compute_user_achievements(users, achievements):
+    """Apply the achievement rules to all of the attendance, officerships and
+    project reports of the given users, loaded with a few queries for all of
+    the users together.
+
+    Returns a dictionary mapping (user pk, achievement pk) to an unsaved
+    UserAchievement for each of the given achievements that the rules assign.
+    """
+    user_achievements = {}
+    current_term = Term.objects.get_current_term()
+    recorded = dict(
+        (short_name, RecordedAchievement(
+            achievement, user_achievements, current_term))
+        for short_name, achievement in achievements.iteritems())
+    terms = dict((term.pk, term) for term in Term.objects.all())
+
+    # Map from each term pk to a map from each event type name to the number
+    # of events of that type in the term
+    type_events = collections.defaultdict(dict)
+    for term_pk, event_type, count in Event.objects.filter(
+            cancelled=False).order_by().values_list(
+            'term', 'event_type__name').annotate(count=Count('pk')):
+        type_events[term_pk][event_type] = count
+
+    attendances = collections.defaultdict(list)
+    for attendance in EventAttendance.objects.filter(
+            user__in=users).values_list(
+            'user', 'event__term', 'event__event_type__name', 'event__name',
+            'event__cancelled'):
+        attendances[attendance[0]].append(attendance[1:])
+
+    officerships = collections.defaultdict(list)
+    for officership in Officer.objects.filter(user__in=users).exclude(
+            position__short_name__in=EXCLUDED_POSITIONS).order_by(
+            'term__year', '-term__term').select_related('position', 'term'):
+        officerships[officership.user_id].append(officership)
+
+    project_reports = collections.defaultdict(list)
+    for project_report in ProjectReport.objects.filter(
+            author__in=users, complete=True).select_related(
+            'author', 'term').order_by('event__term__pk'):
+        project_reports[project_report.author_id].append(project_report)
+
+    for user in users:
+        if attendances[user.pk]:
+            compute_event_achievements(
+                user, attendances[user.pk], terms, type_events, recorded)
+        if officerships[user.pk]:
+            assign_officership_achievements(
+                user, officerships[user.pk], recorded)
+        if project_reports[user.pk]:
+            for project_report in project_reports[user.pk]:
+                assign_alphabet_pr_achievement(project_report, recorded)
+                assign_procrastination_achievement(project_report, recorded)
+            assign_lifetime_pr_achievements(
+                user, project_reports[user.pk], recorded)
+    return user_achievements
+
+
+def compute_event_achievements(user, attendances, terms, type_events,
+                               achievements):
+    """Apply the event achievement rules to the given list of a user's
+    attendance, given as tuples of the term pk, event type name, name and
+    cancellation of the event attended.
+    """
+    names = collections.defaultdict(list)
+    counts = collections.Counter()
+    letters = collections.Counter()
+    type_attendance = collections.defaultdict(collections.Counter)
+    for term_pk, event_type, name, cancelled in attendances:
+        names[term_pk].append(name)
+        if not cancelled:
+            counts[term_pk] += 1
+            letters[term_pk] |= get_letters_mask(name)
+            type_attendance[term_pk][event_type] += 1
+
+    for term_pk in sorted(names):
+        term = terms[term_pk]
+        assign_alphabet_achievement(
+            user, term, letters[term_pk], achievements)
+        assign_event_type_achievements(
+            user, term, type_attendance[term_pk], type_events[term_pk],
+            achievements)
+        assign_specific_event_achievements(
+            user, term, names[term_pk], achievements)
+    assign_lifetime_achievements(
+        user, [(terms[term_pk], counts[term_pk]) for term_pk in sorted(counts)],
+        achievements)
+
+
+def describe_user_achievement(user_achievement):
+    if user_achievement.acquired:
+        return 'acquired in {}'.format(user_achievement.term)
+    return 'progress {}'.format(user_achievement.progress)
+
+
+def recompute_achievements(user_pks, dry_run=False):
+    """Recompute the event, officership and project report achievements of the
+    users with the given pks, and save the differences from their current
+    user achievements unless dry_run is True.
+
+    User achievements that the rules no longer assign are deleted, unless
+    they were assigned by a person. Notifications are created for the
+    achievements that are newly acquired.
+
+    Returns a list of descriptions of the differences.
+    """
+    users = get_user_model().objects.filter(pk__in=user_pks)
+    achievements = registry.get_many(
+        EVENT_ACHIEVEMENTS + OFFICERSHIP_ACHIEVEMENTS +
+        PROJECT_REPORT_ACHIEVEMENTS)
+    computed = compute_user_achievements(users, achievements)
+
+    existing = {}
+    for user_achievement in UserAchievement.objects.filter(
+            user__in=user_pks,
+            achievement__in=achievements.values()).select_related(
+            'user', 'achievement', 'term').order_by('pk'):
+        key = (user_achievement.user_id, user_achievement.achievement_id)
+        existing.setdefault(key, user_achievement)
+
+    changes = []
+    created = []
+    # Map from the new (acquired, progress, term pk) to the user achievements
+    # to update to them
+    updated = collections.defaultdict(list)
+    acquired = []
+    for key, user_achievement in sorted(computed.iteritems()):
+        old = existing.get(key)
+        if old is None:
+            created.append(user_achievement)
+            changes.append(u'+ {}: {} ({})'.format(
+                user_achievement.user.get_full_name(),
+                user_achievement.achievement.name,
+                describe_user_achievement(user_achievement)))
+        elif (old.acquired, old.progress, old.term_id) != (
+                user_achievement.acquired, user_achievement.progress,
+                user_achievement.term_id):
+            updated[(user_achievement.acquired, user_achievement.progress,
+                     user_achievement.term_id)].append(old.pk)
+            if user_achievement.acquired and not old.acquired:
+                acquired.append(old.pk)
+            changes.append(u'~ {}: {} ({} -> {})'.format(
+                old.user.get_full_name(), old.achievement.name,
+                describe_user_achievement(old),
+                describe_user_achievement(user_achievement)))
+    deleted = []
+    for key, old in sorted(existing.iteritems()):
+        if key not in computed and old.assigner_id is None:
+            deleted.append(old.pk)
+            changes.append(u'- {}: {} ({})'.format(
+                old.user.get_full_name(), old.achievement.name,
+                describe_user_achievement(old)))
+
+    if not dry_run:
+        save_user_achievements(created, updated, deleted, acquired)
+        invalidate_user_achievements_cache(user_pks)
+        update_achievement_scores(user_pks)
+    return changes
+
+
+def save_user_achievements(created, updated, deleted, acquired):
+    """Save recomputed user achievements with as few queries as possible.
+
+    Takes a list of unsaved UserAchievements to create, a dictionary mapping
+    (acquired, progress, term pk) to the pks of the UserAchievements to update
+    to those values, a list of the pks of the UserAchievements to delete and a
+    list of the pks of the updated UserAchievements that are newly acquired.
+    """
+    with transaction.atomic():
+        UserAchievement.objects.bulk_create(created)
+        now = timezone.now()
+        for (is_acquired, progress, term_pk), pks in updated.iteritems():
+            UserAchievement.objects.filter(pk__in=pks).update(
+                acquired=is_acquired, progress=progress, term=term_pk,
+                updated=now)
+        UserAchievement.objects.filter(pk__in=deleted).delete()
+
+        # Since bulk_create does not set the pks of the new user achievements,
+        # they are fetched again (along with the updated ones) for creating
+        # the notifications for the newly acquired ones
+        created_keys = set(
+            (user_achievement.user_id, user_achievement.achievement_id)
+            for user_achievement in created if user_achievement.acquired)
+        notified = Notification.objects.filter(
+            content_type=ContentType.objects.get_for_model(UserAchievement))
+        candidates = UserAchievement.objects.filter(
+            Q(pk__in=acquired) |
+            Q(user__in=set(user_pk for user_pk, _ in created_keys),
+              achievement__in=set(pk for _, pk in created_keys)),
+            acquired=True).exclude(
+            pk__in=notified.values('object_pk')).select_related(
+            'user', 'achievement')
+        acquired = set(acquired)
+        Notification.objects.bulk_create([
+            Notification(**user_achievement.get_notification_values())
+            for user_achievement in candidates
+            if user_achievement.pk in acquired or (
+                user_achievement.user_id,
+                user_achievement.achievement_id) in created_keys])
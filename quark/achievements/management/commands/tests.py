@@ -0,0 +1,153 @@
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from quark.achievements.management.commands.rebuildachievementscores import \
+    rebuild_achievement_scores
+from quark.achievements.management.commands.recomputeachievements import \
+    recompute_achievements
+from quark.achievements.models import Achievement
+from quark.achievements.models import AchievementScore
+from quark.achievements.models import PendingAchievementEvaluation
+from quark.achievements.models import UserAchievement
+from quark.base.models import Officer
+from quark.base.models import OfficerPosition
+from quark.base.models import Term
+from quark.events.models import Event
+from quark.events.models import EventAttendance
+from quark.events.models import EventType
+from quark.notifications.models import Notification
+from quark.project_reports.models import ProjectReport
+
+
+@override_settings(ACHIEVEMENT_QUEUE_SYNC=False)
+class ProcessAchievementQueueTest(TestCase):
+    fixtures = ['achievement.yaml', 'officer_position.yaml']
+
+    def test_process_queue(self):
+        user = get_user_model().objects.create_user(
+            username='test', password='test', email='test@tbp.berkeley.edu',
+            first_name='Test', last_name='Test')
+        term = Term.objects.create(term=Term.SPRING, year=2013, current=True)
+        ProjectReport.objects.create(
+            term=term, author=user, title='Report', date=timezone.now(),
+            committee=OfficerPosition.objects.first(), complete=True)
+        self.assertEqual(PendingAchievementEvaluation.objects.count(), 1)
+
+        call_command('processachievementqueue', batch_size=1, verbosity=0)
+        self.assertFalse(PendingAchievementEvaluation.objects.exists())
+        self.assertTrue(UserAchievement.objects.filter(
+            user=user, achievement__short_name='write_01_project_reports',
+            acquired=True).exists())
+
+
+class RecomputeAchievementsTest(TestCase):
+    fixtures = ['achievement.yaml',
+                'officer_position.yaml',
+                'test/term.yaml']
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='test', password='test', email='test@tbp.berkeley.edu',
+            first_name='Test', last_name='Test')
+        self.fa2012 = Term.objects.get(term=Term.FALL, year=2012)
+        self.sp2013 = Term.objects.get(term=Term.SPRING, year=2013)
+        fun = EventType.objects.create(name='Fun')
+        meeting = EventType.objects.create(name='Meeting')
+        committee = OfficerPosition.objects.get(short_name='historian')
+        for name, event_type, term in [
+                ('D15', fun, self.fa2012),
+                ('abcdefghijklm', meeting, self.sp2013),
+                ('nopqrstuvwxyz', meeting, self.sp2013),
+                ('National Convention', fun, self.sp2013)]:
+            event = Event.objects.create(
+                name=name, event_type=event_type, term=term, location='TBD',
+                contact=self.user, committee=committee,
+                start_datetime=timezone.now(), end_datetime=timezone.now())
+            EventAttendance.objects.create(event=event, user=self.user)
+        Officer.objects.create(user=self.user, position=committee,
+                               term=self.fa2012, is_chair=True)
+        Officer.objects.create(user=self.user, position=committee,
+                               term=self.sp2013)
+        ProjectReport.objects.create(
+            term=self.sp2013, author=self.user, title='Report',
+            date=timezone.now(), committee=committee, complete=True)
+
+        self.user_achievements = UserAchievement.objects.filter(
+            user=self.user).order_by('achievement')
+        self.expected = list(self.user_achievements.values_list(
+            'achievement__short_name', 'acquired', 'progress', 'term'))
+
+    def test_recompute_matches_incremental(self):
+        """Recomputing the achievements gives the same achievements as
+        assigning them as attendance, officers and project reports are saved.
+        """
+        self.assertTrue(self.user_achievements.filter(acquired=True).exists())
+        self.assertEqual(recompute_achievements([self.user.pk]), [])
+
+    def test_recompute(self):
+        self.user_achievements.filter(
+            achievement__short_name='attend_d15').delete()
+        self.user_achievements.filter(
+            achievement__short_name='attend025events').update(progress=0)
+        self.user_achievements.filter(
+            achievement__short_name='twice_same_position').update(
+            acquired=False)
+        UserAchievement.objects.create(
+            user=self.user, achievement=Achievement.objects.get(
+                short_name='attend_all_service'), acquired=True)
+        Notification.objects.all().delete()
+
+        changes = recompute_achievements([self.user.pk], dry_run=True)
+        self.assertItemsEqual([change[0] for change in changes],
+                              ['+', '~', '~', '-'])
+        self.assertEqual(len(changes), 4)
+        self.assertFalse(
+            self.user_achievements.filter(
+                achievement__short_name='attend_d15').exists())
+
+        call_command('recomputeachievements', users='test', processes=1,
+                     verbosity=0)
+        self.assertEqual(
+            list(self.user_achievements.values_list(
+                'achievement__short_name', 'acquired', 'progress', 'term')),
+            self.expected)
+        # Notifications are created for the newly acquired achievements
+        self.assertItemsEqual(
+            Notification.objects.values_list('subtitle', flat=True),
+            self.user_achievements.filter(
+                achievement__short_name__in=[
+                    'attend_d15', 'twice_same_position']).values_list(
+                'achievement__name', flat=True))
+
+    def test_unknown_users(self):
+        self.assertRaises(
+            CommandError, call_command, 'recomputeachievements',
+            users='test,nobody', processes=1, verbosity=0)
+
+
+class RebuildAchievementScoresTest(TestCase):
+    fixtures = ['achievement.yaml', 'test/term.yaml']
+
+    def test_rebuild_achievement_scores(self):
+        user_model = get_user_model()
+        users = [user_model.objects.create_user(
+            'user{}'.format(i), 'user{}@tbp.berkeley.edu'.format(i),
+            'password', first_name='First', last_name='Last{}'.format(i))
+            for i in range(3)]
+        achievement = Achievement.objects.get(short_name='attend025events')
+        UserAchievement.objects.bulk_create([
+            UserAchievement(user=user, achievement=achievement, acquired=True)
+            for user in users[:2]])
+        UserAchievement.objects.create(
+            user=users[2], achievement=achievement, acquired=False)
+        self.assertFalse(AchievementScore.objects.exists())
+
+        self.assertEqual(rebuild_achievement_scores(), 2)
+        self.assertEqual(
+            list(AchievementScore.objects.values_list(
+                'user', 'score', 'rank')),
+            [(user.pk, achievement.points, 1) for user in users[:2]])
@@ -1,13 +1,37 @@
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.db import models
+from django.db import transaction
+from django.db.models import Q
+from django.db.models import Sum
+from django.db.models.query import QuerySet
+from django.utils import timezone
 
 from quark.base.models import Term
+from quark.events.models import EventType
 from quark.notifications.models import Notification
+from quark.shortcuts import DeferredBatch
+from quark.shortcuts import disable_for_loaddata
 from quark.shortcuts import get_object_or_none
 
 
+class AchievementQuerySet(QuerySet):
+    def delete(self):
+        # Update the scores of the users who acquired the achievements once,
+        # rather than once for each of their deleted user achievements
+        with batch_score_updates():
+            super(AchievementQuerySet, self).delete()
+    delete.alters_data = True
+
+
+class AchievementManager(models.Manager):
+    def get_queryset(self):
+        return AchievementQuerySet(self.model, using=self._db)
+
+
 class Achievement(models.Model):
     """An achievement shows significant user accomplishment in some way."""
     # These are strings because they're easier to deal with in fixtures.
@@ -97,12 +121,20 @@ class Achievement(models.Model):
         settings.AUTH_USER_MODEL, blank=True, null=True,
         help_text='The creator of the icon used for this achievement.')
 
+    objects = AchievementManager()
+
     class Meta(object):
         ordering = ('rank',)
 
     def __unicode__(self):
         return self.name
 
+    def delete(self, *args, **kwargs):
+        # Update the scores of the users who acquired the achievement once,
+        # rather than once for each of their deleted user achievements
+        with batch_score_updates():
+            super(Achievement, self).delete(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('achievements:detail', args=(self.short_name,))
 
@@ -118,27 +150,79 @@ class Achievement(models.Model):
         user_achievement, _ = UserAchievement.objects.get_or_create(
             achievement=self, user=user)
 
-        if user_achievement.acquired is False:
-            # if the achievement has not already been acquired by this user, set
-            # the user achievement's progress, term, acquisition state, who the
-            # assigner is, and additional data provided by the assigner
-            user_achievement.acquired = acquired
-            user_achievement.progress = progress
-            user_achievement.term = term
-            user_achievement.data = data
-            user_achievement.assigner = assigner
-            user_achievement.save()
-        elif acquired is False and user_achievement.term == term:
-            # if the achievement has already been acquired but is being set
-            # to unacquired in the same term, it gets overridden
-            user_achievement.acquired = acquired
-            user_achievement.progress = progress
-            user_achievement.data = data
-            user_achievement.assigner = None
+        if user_achievement.update_assignment(
+                acquired=acquired, progress=progress, term=term, data=data,
+                assigner=assigner):
             user_achievement.save()
 
         return True
 
+    def assign_many(self, users, acquired=True, progress=0, term=None,
+                    data='', assigner=None):
+        """Assign this achievement to each of the given users, the same way as
+        assign, but with a constant number of queries.
+
+        The users' existing user achievements are fetched with one query, and
+        the new and changed ones are saved and notified in bulk, so no signals
+        are sent for them.
+
+        Returns the number of user achievements that were saved.
+        """
+        if term is None:
+            term = Term.objects.get_current_term()
+
+        users = dict((user.pk, user) for user in users)
+        with transaction.atomic():
+            # Use the first user achievement of each user, like get_or_create
+            existing = {}
+            for user_achievement in UserAchievement.objects.filter(
+                    achievement=self, user__in=users.keys()).order_by('pk'):
+                existing.setdefault(user_achievement.user_id, user_achievement)
+
+            created = []
+            # Map the field values of the updated user achievements to the pks
+            # of the user achievements to update to those values
+            updated = {}
+            for user_pk, user in users.iteritems():
+                user_achievement = existing.get(user_pk)
+                if user_achievement is None:
+                    user_achievement = UserAchievement(
+                        achievement=self, user=user)
+                    user_achievement.update_assignment(
+                        acquired=acquired, progress=progress, term=term,
+                        data=data, assigner=assigner)
+                    created.append(user_achievement)
+                elif user_achievement.update_assignment(
+                        acquired=acquired, progress=progress, term=term,
+                        data=data, assigner=assigner):
+                    values = (user_achievement.acquired,
+                              user_achievement.progress,
+                              user_achievement.term_id,
+                              user_achievement.data,
+                              user_achievement.assigner_id)
+                    updated.setdefault(values, []).append(user_achievement.pk)
+
+            UserAchievement.objects.bulk_create(created)
+            now = timezone.now()
+            for values, pks in updated.iteritems():
+                UserAchievement.objects.filter(pk__in=pks).update(
+                    updated=now, **dict(zip(
+                        ('acquired', 'progress', 'term', 'data', 'assigner'),
+                        values)))
+
+            # Since bulk_create does not set the pks of the new user
+            # achievements, the saved ones are fetched again to notify them
+            updated_pks = [pk for pks in updated.values() for pk in pks]
+            create_achievement_notifications(UserAchievement.objects.filter(
+                Q(pk__in=updated_pks) |
+                Q(user__in=[user_achievement.user_id
+                            for user_achievement in created]),
+                achievement=self))
+        invalidate_user_achievements_cache(users.keys())
+        update_achievement_scores(users.keys())
+
+        return len(created) + len(updated_pks)
+
 
 class UserAchievement(models.Model):
     """UserAchievement instances contain data about an acquired achievement.
@@ -184,21 +268,278 @@ class UserAchievement(models.Model):
         return '{} - {}'.format(self.user.get_full_name(),
                                 self.achievement.name)
 
+    def get_notification_values(self):
+        """Return the field values of the notification for acquiring this
+        achievement.
+        """
+        achievement = self.achievement
+        return {
+            'user': self.user,
+            'status': Notification.POSITIVE,
+            'content_type': ContentType.objects.get_for_model(UserAchievement),
+            'object_pk': self.pk,
+            'title': 'Achievement Unlocked',
+            'subtitle': achievement.name,
+            'description': achievement.description,
+            'image_url': unicode(achievement.icon_filename),
+            'url': achievement.get_absolute_url()
+        }
+
+    def update_assignment(self, acquired, progress, term, data, assigner):
+        """Update this user achievement for an assignment of its achievement
+        (see Achievement.assign), without saving it.
+
+        Returns True if the assignment applies, i.e., the user achievement
+        needs to be saved.
+        """
+        if self.acquired is False:
+            # if the achievement has not already been acquired by this user, set
+            # the user achievement's progress, term, acquisition state, who the
+            # assigner is, and additional data provided by the assigner
+            self.acquired = acquired
+            self.progress = progress
+            self.term = term
+            self.data = data
+            self.assigner = assigner
+            return True
+        elif acquired is False and self.term == term:
+            # if the achievement has already been acquired but is being set
+            # to unacquired in the same term, it gets overridden
+            self.acquired = acquired
+            self.progress = progress
+            self.data = data
+            self.assigner = None
+            return True
+        return False
+
+
+class AttendanceCounter(models.Model):
+    """The number of non-cancelled events that a user has attended in total.
+
+    Together with TermAttendanceCounter and EventTypeAttendanceCounter, this is
+    kept up to date incrementally as attendance is recorded and removed (see
+    quark.achievements.event_achievements), so that event achievements can be
+    evaluated without counting all of a user's attendance. A user without an
+    AttendanceCounter has no counters yet; they are built the next time the
+    user's attendance is recorded.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL)
+    count = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return '{} attended {} events'.format(
+            self.user.get_full_name(), self.count)
+
+
+class TermAttendanceCounter(models.Model):
+    """The number of non-cancelled events that a user has attended in a term,
+    and the letters seen in the names of those events.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+    term = models.ForeignKey(Term)
+    count = models.PositiveIntegerField(default=0)
+    letters = models.IntegerField(
+        default=0,
+        help_text=('Bitmask of the letters a-z (ignoring case) in the names of '
+                   'the events attended, where bit 0 is "a" and bit 25 is '
+                   '"z".'))
+
+    class Meta(object):
+        unique_together = ('user', 'term')
+
+    def __unicode__(self):
+        return '{} attended {} events in {}'.format(
+            self.user.get_full_name(), self.count, self.term)
+
+
+class EventTypeAttendanceCounter(models.Model):
+    """The number of non-cancelled events of a type that a user has attended in
+    a term.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+    term = models.ForeignKey(Term)
+    event_type = models.ForeignKey(EventType)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta(object):
+        unique_together = ('user', 'term', 'event_type')
+
+    def __unicode__(self):
+        return '{} attended {} {} events in {}'.format(
+            self.user.get_full_name(), self.count, self.event_type, self.term)
+
+
+class AchievementScore(models.Model):
+    """The total points of the achievements that a user has acquired, and the
+    user's rank on the achievements leaderboard.
+
+    Scores are kept up to date whenever user achievements change (see
+    update_achievement_scores), and only exist for users who have acquired
+    achievements.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL)
+    score = models.IntegerField(default=0, db_index=True)
+    rank = models.PositiveIntegerField(
+        default=0, db_index=True,
+        help_text=('The dense rank of the score (i.e., 1 for the highest '
+                   'score, and the same rank for equal scores).'))
+
+    class Meta(object):
+        ordering = ('rank', 'pk')
+
+    def __unicode__(self):
+        return '{}. {} with {} points'.format(
+            self.rank, self.user.get_full_name(), self.score)
+
+
+class PendingAchievementEvaluation(models.Model):
+    """A user whose achievements of some kind need to be evaluated, because
+    something that they depend on changed in the given term.
+
+    These are queued by the signal handlers of the achievement modules (see
+    quark.achievements.evaluation) and processed by the
+    processachievementqueue management command. There is at most one pending
+    evaluation for each user, kind and term.
+    """
+    EVENT = 'event'
+    OFFICER = 'officer'
+    PROJECT_REPORT = 'project_report'
+    KIND_CHOICES = (
+        (EVENT, 'Event'),
+        (OFFICER, 'Officer'),
+        (PROJECT_REPORT, 'Project Report'),
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    term = models.ForeignKey(Term)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    attempts = models.PositiveIntegerField(
+        default=0,
+        help_text='The number of times that evaluating this has failed.')
+
+    class Meta(object):
+        ordering = ('created',)
+        unique_together = ('user', 'kind', 'term')
+
+    def __unicode__(self):
+        return '{} achievements of {} for {}'.format(
+            self.get_kind_display(), self.user.get_full_name(), self.term)
+
 
 def achievement_notification(sender, instance, created, **kwargs):
     """Create a notification if the user achievement has been acquired."""
     if instance.acquired:
-        achievement = instance.achievement
         Notification.objects.get_or_create(
-            user=instance.user,
-            status=Notification.POSITIVE,
-            content_type=ContentType.objects.get_for_model(UserAchievement),
-            object_pk=instance.pk,
-            title='Achievement Unlocked',
-            subtitle=achievement.name,
-            description=achievement.description,
-            image_url=unicode(achievement.icon_filename),
-            url=achievement.get_absolute_url())
+            **instance.get_notification_values())
+
+
+def user_achievements_cache_key(user_pk):
+    return 'user_achievements_{}'.format(user_pk)
+
+
+def invalidate_user_achievements_cache(user_pks):
+    """Remove the cached summaries of the achievements of the users with the
+    given pks (see quark.achievements.views.get_user_achievements_summary).
+
+    This is done automatically when a UserAchievement is saved or deleted, but
+    must be done explicitly after changing UserAchievements in bulk.
+    """
+    cache.delete_many([user_achievements_cache_key(user_pk)
+                       for user_pk in user_pks])
+
+
+def update_achievement_scores(user_pks):
+    """Update the AchievementScores of the users with the given pks from the
+    points of their acquired achievements, and then rank all scores again if
+    any of them changed.
+
+    This is done automatically when a UserAchievement is acquired, unacquired
+    or deleted, but must be done explicitly after changing UserAchievements in
+    bulk.
+
+    Returns True if any scores changed.
+    """
+    user_pks = set(user_pks)
+    if not user_pks:
+        return False
+    scores = dict(UserAchievement.objects.filter(
+        user__in=user_pks, acquired=True).order_by().values_list(
+        'user').annotate(score=Sum('achievement__points')))
+    with transaction.atomic():
+        existing = dict(AchievementScore.objects.filter(
+            user__in=user_pks).values_list('user', 'score'))
+        deleted = [user_pk for user_pk in existing if user_pk not in scores]
+        if deleted:
+            AchievementScore.objects.filter(user__in=deleted).delete()
+        created = [AchievementScore(user_id=user_pk, score=score)
+                   for user_pk, score in scores.iteritems()
+                   if user_pk not in existing]
+        if created:
+            AchievementScore.objects.bulk_create(created)
+        # Map each changed score to the pks of the users with that score
+        score_users = {}
+        for user_pk, score in scores.iteritems():
+            if user_pk in existing and existing[user_pk] != score:
+                score_users.setdefault(score, []).append(user_pk)
+        for score, pks in score_users.iteritems():
+            AchievementScore.objects.filter(user__in=pks).update(score=score)
+
+        changed = bool(deleted or created or score_users)
+        if changed:
+            update_achievement_ranks()
+    return changed
+
+
+# The pks of the users whose scores are to be updated at the end of the
+# current batch of each thread (see batch_score_updates)
+_score_batch = DeferredBatch(update_achievement_scores)
+
+
+def batch_score_updates():
+    """Return a context manager that defers the score updates for the
+    UserAchievements saved or deleted within it, and updates the scores of all
+    of their users (ranking the scores at most once) at the end instead.
+
+    Nested batches are merged into the outermost one.
+    """
+    return _score_batch.collect()
+
+
+def queue_score_update(user_pk):
+    """Update the score of the user with the given pk, or at the end of the
+    current batch if there is one (see batch_score_updates).
+    """
+    _score_batch.add(user_pk)
+
+
+def update_achievement_ranks():
+    """Set the rank of every AchievementScore to the dense rank of its score
+    with a single statement.
+    """
+    quote_name = connection.ops.quote_name
+    # The distinct scores are selected in a derived table, since MySQL does
+    # not allow selecting directly from the table being updated
+    connection.cursor().execute(
+        'UPDATE {table} SET {rank} = 1 + ('
+        'SELECT COUNT(*) FROM (SELECT DISTINCT {score} FROM {table}) scores '
+        'WHERE scores.{score} > {table}.{score})'.format(
+            table=quote_name(AchievementScore._meta.db_table),
+            rank=quote_name('rank'), score=quote_name('score')))
+
+
+def create_achievement_notifications(user_achievements):
+    """Create the missing notifications of the acquired user achievements in
+    the given queryset in bulk.
+    """
+    notified = Notification.objects.filter(
+        content_type=ContentType.objects.get_for_model(UserAchievement))
+    acquired_achievements = user_achievements.filter(acquired=True).exclude(
+        pk__in=notified.values('object_pk')).select_related(
+        'user', 'achievement')
+    Notification.objects.bulk_create([
+        Notification(**user_achievement.get_notification_values())
+        for user_achievement in acquired_achievements])
 
 
 def achievement_notification_delete(sender, instance, **kwargs):
@@ -214,7 +555,66 @@ def achievement_notification_delete(sender, instance, **kwargs):
         notification.delete()
 
 
+def get_scored_achievement(user_achievement):
+    """Return the pk of the achievement whose points the given user
+    achievement adds to its user's score, or None if it is not acquired.
+    """
+    if user_achievement.acquired:
+        return user_achievement.achievement_id
+    return None
+
+
+def user_achievement_init(sender, instance, **kwargs):
+    """Remember what a user achievement adds to its user's score, so that the
+    score is only updated when that changes.
+    """
+    instance.scored_achievement = get_scored_achievement(instance)
+
+
+def user_achievement_saved(sender, instance, created, **kwargs):
+    """Update the user's score if the user achievement was acquired or
+    unacquired (but not if only its progress changed).
+    """
+    invalidate_user_achievements_cache([instance.user_id])
+    scored_achievement = get_scored_achievement(instance)
+    if created:
+        old_scored_achievement = None
+    else:
+        old_scored_achievement = getattr(instance, 'scored_achievement', None)
+    instance.scored_achievement = scored_achievement
+    if scored_achievement != old_scored_achievement:
+        queue_score_update(instance.user_id)
+
+
+def user_achievement_deleted(sender, instance, **kwargs):
+    """Update the user's score if the deleted user achievement was
+    acquired.
+    """
+    invalidate_user_achievements_cache([instance.user_id])
+    if getattr(instance, 'scored_achievement', None) is not None:
+        queue_score_update(instance.user_id)
+
+
+@disable_for_loaddata
+def achievement_points_changed(sender, instance, created, **kwargs):
+    """Update the scores of the users who have acquired an achievement when
+    it is saved, since its points may have changed.
+    """
+    if not created:
+        update_achievement_scores(UserAchievement.objects.filter(
+            achievement=instance, acquired=True).values_list(
+            'user', flat=True))
+
+
 models.signals.post_save.connect(
     achievement_notification, sender=UserAchievement)
 models.signals.post_delete.connect(
     achievement_notification_delete, sender=UserAchievement)
+models.signals.post_init.connect(
+    user_achievement_init, sender=UserAchievement)
+models.signals.post_save.connect(
+    user_achievement_saved, sender=UserAchievement)
+models.signals.post_delete.connect(
+    user_achievement_deleted, sender=UserAchievement)
+models.signals.post_save.connect(
+    achievement_points_changed, sender=Achievement)
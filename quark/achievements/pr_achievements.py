@@ -2,20 +2,48 @@ import string
 
 from django.db import models
 
-from quark.achievements.models import Achievement
+from quark.achievements.evaluation import queue_evaluation
+from quark.achievements.models import PendingAchievementEvaluation
+from quark.achievements.registry import registry
 from quark.project_reports.models import ProjectReport
-from quark.shortcuts import get_object_or_none
+
+
+# the number of project reports needed to get the lifetime achievements
+LIFETIME_BENCHMARKS = [1, 5, 15]
+
+# a map from each benchmark to the name of its lifetime achievement
+LIFETIME_ACHIEVEMENTS = dict(
+    (benchmark, 'write_{:02d}_project_reports'.format(benchmark))
+    for benchmark in LIFETIME_BENCHMARKS)
+
+# the names of all of the achievements for project reports
+PROJECT_REPORT_ACHIEVEMENTS = LIFETIME_ACHIEVEMENTS.values() + [
+    'alphabet_project_report', 'project_report_procrastination']
 
 
 def project_report_achievements(sender, instance, created, **kwargs):
     # only check the achievement assignment if the PR is complete
     if instance.complete:
-        assign_alphabet_pr_achievement(instance)
-        assign_lifetime_pr_achievements(instance)
-        assign_procrastination_achievement(instance)
+        queue_evaluation(instance.author,
+                         PendingAchievementEvaluation.PROJECT_REPORT,
+                         instance.term)
+
 
+def evaluate_project_report_achievements(user, terms):
+    achievements = registry.get_many(PROJECT_REPORT_ACHIEVEMENTS)
+    project_reports = ProjectReport.objects.filter(
+        author=user, term__in=terms, complete=True).select_related('term')
+    for project_report in project_reports:
+        assign_alphabet_pr_achievement(project_report, achievements)
+        assign_procrastination_achievement(project_report, achievements)
 
-def assign_alphabet_pr_achievement(instance):
+    # obtain all project reports authored by user
+    project_reports = ProjectReport.objects.select_related('term').filter(
+        author=user, complete=True).order_by('event__term__pk')
+    assign_lifetime_pr_achievements(user, project_reports, achievements)
+
+
+def assign_alphabet_pr_achievement(instance, achievements):
     # see if letters A-Z are in project report text
     project_report_text = ''.join([instance.title,
                                    instance.other_group,
@@ -29,38 +57,31 @@ def assign_alphabet_pr_achievement(instance):
     unused_letters.difference_update(project_report_text.lower())
 
     if len(unused_letters) == 0:
-        achievement = get_object_or_none(Achievement,
-                                         short_name='alphabet_project_report')
+        achievement = achievements.get('alphabet_project_report')
         if achievement:
             achievement.assign(instance.author, term=instance.term)
 
 
-def assign_lifetime_pr_achievements(instance):
-    # obtain all project reports authored by user
-    project_reports = ProjectReport.objects.select_related(
-        'event__term').filter(
-        author=instance.author, complete=True).order_by('event__term__pk')
-
-    project_report_count = project_reports.count()
-
-    # the number of project reports needed to get achievements
-    benchmarks = [1, 5, 15]
+def assign_lifetime_pr_achievements(user, project_reports, achievements):
+    """Assign the achievements for writing a number of project reports, given
+    all of the complete project reports that the user authored.
+    """
+    project_report_count = len(project_reports)
 
-    for benchmark in benchmarks:
-        short_name = 'write_{:02d}_project_reports'.format(benchmark)
-        achievement = get_object_or_none(Achievement, short_name=short_name)
+    for benchmark in LIFETIME_BENCHMARKS:
+        achievement = achievements.get(LIFETIME_ACHIEVEMENTS[benchmark])
         if achievement:
             if project_report_count < benchmark:
                 achievement.assign(
-                    instance.author, acquired=False,
+                    user, acquired=False,
                     progress=project_report_count)
             else:
                 achievement.assign(
-                    instance.author,
+                    user,
                     term=project_reports[benchmark - 1].term)
 
 
-def assign_procrastination_achievement(instance):
+def assign_procrastination_achievement(instance, achievements):
     # obtain the time taken to write the project report (the date between
     # the event date and the first completed date)
     event_date = instance.date
@@ -68,8 +89,7 @@ def assign_procrastination_achievement(instance):
     writing_time = completion_date - event_date
 
     if writing_time.days >= 60:
-        achievement = get_object_or_none(
-            Achievement, short_name='project_report_procrastination')
+        achievement = achievements.get('project_report_procrastination')
         if achievement:
             achievement.assign(instance.author, term=instance.term)
 
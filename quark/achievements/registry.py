@@ -0,0 +1,105 @@
+import collections
+import threading
+
+from django.conf import settings
+from django.db import models
+
+from quark.achievements.models import Achievement
+from quark.base.registry import get_cached_version
+from quark.base.registry import set_new_version
+
+
+# The key in the shared cache of the current version of the achievements,
+# which is changed whenever an achievement is saved or deleted
+VERSION_CACHE_KEY = 'achievements_version'
+
+
+class AchievementRegistry(object):
+    """A process-wide registry of all achievements, keyed by short name.
+
+    All achievements are loaded with one query, and reloaded only once the
+    version of the achievements in the shared cache changes (i.e., after any
+    process saves or deletes an achievement), so looking achievements up
+    needs no queries. The version is also assumed to have changed if it is
+    missing from the cache, and expires after settings.REGISTRY_VERSION_TIMEOUT
+    seconds.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._achievements = {}
+        self._ordered = []
+        self._sequences = collections.OrderedDict()
+
+    def _load(self):
+        version = get_cached_version(
+            VERSION_CACHE_KEY, settings.REGISTRY_VERSION_TIMEOUT)
+        if version == self._version:
+            return
+
+        achievements = list(Achievement.objects.order_by('rank'))
+        sequences = collections.OrderedDict()
+        for achievement in achievements:
+            if achievement.sequence:
+                sequences.setdefault(achievement.sequence, []).append(
+                    achievement)
+        with self._lock:
+            self._achievements = dict(
+                (achievement.short_name, achievement)
+                for achievement in achievements)
+            self._ordered = achievements
+            self._sequences = sequences
+            self._version = version
+
+    def get_version(self):
+        """Return the version of the achievements in the registry, which
+        changes whenever an achievement is saved or deleted.
+        """
+        self._load()
+        return self._version
+
+    def all(self):
+        """Return a list of all achievements, in order of rank."""
+        self._load()
+        return self._ordered
+
+    def get(self, short_name):
+        """Return the achievement with the given short name, or None if there
+        is no such achievement.
+        """
+        self._load()
+        return self._achievements.get(short_name)
+
+    def get_many(self, short_names):
+        """Return a dictionary mapping each of the given short names that
+        belongs to an achievement to the achievement.
+        """
+        self._load()
+        achievements = self._achievements
+        return dict((short_name, achievements[short_name])
+                    for short_name in short_names
+                    if short_name in achievements)
+
+    def by_sequence(self):
+        """Return an ordered dictionary mapping each achievement sequence to
+        the list of achievements in the sequence, in order of rank.
+        """
+        self._load()
+        return self._sequences
+
+    def invalidate(self):
+        """Make every process reload the achievements on their next lookup."""
+        with self._lock:
+            self._version = None
+        set_new_version(VERSION_CACHE_KEY, settings.REGISTRY_VERSION_TIMEOUT)
+
+
+registry = AchievementRegistry()
+
+
+def invalidate_registry(sender, **kwargs):
+    registry.invalidate()
+
+
+models.signals.post_save.connect(invalidate_registry, sender=Achievement)
+models.signals.post_delete.connect(invalidate_registry, sender=Achievement)
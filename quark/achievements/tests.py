@@ -3,18 +3,36 @@ import random
 import string
 
 from django.contrib.auth import get_user_model
+from django.core.cache.backends.locmem import LocMemCache
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.utils import timezone
 from freezegun import freeze_time
+from mock import patch
 
+from quark.achievements.event_achievements import ALL_LETTERS
+from quark.achievements.event_achievements import get_letters_mask
+from quark.achievements.evaluation import MAX_EVALUATION_ATTEMPTS
+from quark.achievements.evaluation import process_pending_evaluations
+from quark.achievements.event_achievements import rebuild_attendance_counters
 from quark.achievements.models import Achievement
+from quark.achievements.models import AchievementScore
+from quark.achievements.models import AttendanceCounter
+from quark.achievements.models import EventTypeAttendanceCounter
+from quark.achievements.models import PendingAchievementEvaluation
+from quark.achievements.models import TermAttendanceCounter
 from quark.achievements.models import UserAchievement
+from quark.achievements.models import update_achievement_ranks
+from quark.achievements.registry import AchievementRegistry
+from quark.achievements.registry import registry
+from quark.achievements.views import get_user_achievements_summary
 from quark.base.models import Officer
 from quark.base.models import OfficerPosition
 from quark.base.models import Term
 from quark.events.models import Event
 from quark.events.models import EventAttendance
 from quark.events.models import EventType
+from quark.notifications.models import Notification
 from quark.project_reports.models import ProjectReport
 
 
@@ -110,6 +128,258 @@ class AchievementAssignmentTest(TestCase):
         self.assertEqual(self.achievements.filter(term=self.sp2010).count(), 1)
         self.assertEqual(self.achievements.filter(acquired=True).count(), 1)
 
+    def test_assign_many(self):
+        # test to see that assigning the achievement to many users at once
+        # follows the same rules as assigning it to each user
+        other_user = get_user_model().objects.create_user(
+            username='other', password='other', email='other@tbp.berkeley.edu',
+            first_name='Other', last_name='Other')
+        third_user = get_user_model().objects.create_user(
+            username='third', password='third', email='third@tbp.berkeley.edu',
+            first_name='Third', last_name='Third')
+        self.achievement.assign(
+            self.sample_user, acquired=True, term=self.fa2009)
+        self.achievement.assign(
+            other_user, acquired=False, progress=1, term=self.fa2009)
+        users = [self.sample_user, other_user, third_user]
+
+        # 1 query to fetch the existing user achievements, 1 to create, 1 to
+        # update, 2 to create the notifications, 4 to create and rank the
+        # scores, and 4 for the savepoints
+        with self.assertNumQueries(13):
+            saved = self.achievement.assign_many(
+                users, term=self.sp2010, data='data',
+                assigner=self.sample_user)
+        # the achievement was already acquired by the sample user, so only the
+        # other users' user achievements are saved
+        self.assertEqual(saved, 2)
+        user_achievements = UserAchievement.objects.filter(
+            achievement=self.achievement)
+        self.assertEqual(user_achievements.count(), 3)
+        self.assertEqual(user_achievements.get(user=self.sample_user).term,
+                         self.fa2009)
+        for user in (other_user, third_user):
+            user_achievement = user_achievements.get(user=user)
+            self.assertTrue(user_achievement.acquired)
+            self.assertEqual(user_achievement.term, self.sp2010)
+            self.assertEqual(user_achievement.data, 'data')
+            self.assertEqual(user_achievement.assigner, self.sample_user)
+
+        # each user has exactly one notification for the achievement
+        notifications = Notification.objects.filter(
+            title='Achievement Unlocked', subtitle=self.achievement.name)
+        for user in users:
+            self.assertEqual(notifications.filter(user=user).count(), 1)
+
+        # unacquiring the achievement in the same term overrides it
+        self.assertEqual(self.achievement.assign_many(
+            users, acquired=False, progress=3, term=self.sp2010), 2)
+        self.assertEqual(user_achievements.filter(acquired=True).count(), 1)
+        self.assertEqual(
+            user_achievements.filter(progress=3, assigner=None).count(), 2)
+
+
+class AchievementRegistryTest(TestCase):
+    fixtures = ['achievement.yaml']
+
+    def setUp(self):
+        # Use a real cache for the version of the achievements, since the
+        # tests use a dummy cache
+        cache_patcher = patch('quark.base.registry.cache',
+                              LocMemCache('achievements', {}))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        registry.invalidate()
+
+    def test_get(self):
+        with self.assertNumQueries(1):
+            achievement = registry.get('attend025events')
+        self.assertEqual(achievement,
+                         Achievement.objects.get(short_name='attend025events'))
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.get('attend025events'), achievement)
+            self.assertIsNone(registry.get('nonexistent'))
+            self.assertItemsEqual(
+                registry.get_many(['attend025events', 'nonexistent']).keys(),
+                ['attend025events'])
+
+    def test_by_sequence(self):
+        sequences = registry.by_sequence()
+        self.assertNotIn('', sequences)
+        for sequence, achievements in sequences.iteritems():
+            self.assertEqual(
+                achievements,
+                list(Achievement.objects.filter(
+                    sequence=sequence).order_by('rank')))
+
+    def test_invalidation(self):
+        """Saving or deleting an achievement reloads the achievements in this
+        and other processes.
+        """
+        other_registry = AchievementRegistry()
+        self.assertEqual(other_registry.get('attend025events').name,
+                         registry.get('attend025events').name)
+
+        achievement = Achievement.objects.get(short_name='attend025events')
+        achievement.name = 'Renamed'
+        achievement.save()
+        self.assertEqual(registry.get('attend025events').name, 'Renamed')
+        self.assertEqual(other_registry.get('attend025events').name,
+                         'Renamed')
+
+        achievement.delete()
+        self.assertIsNone(registry.get('attend025events'))
+        self.assertIsNone(other_registry.get('attend025events'))
+
+
+@override_settings(USER_ACHIEVEMENTS_CACHE_TIMEOUT=60)
+class UserAchievementsSummaryTest(TestCase):
+    fixtures = ['achievement.yaml', 'test/term.yaml']
+
+    def setUp(self):
+        # Use a real cache, since the tests use a dummy cache
+        test_cache = LocMemCache('achievements', {})
+        for module in ('quark.achievements.models', 'quark.achievements.views',
+                       'quark.base.registry'):
+            cache_patcher = patch('{}.cache'.format(module), test_cache)
+            cache_patcher.start()
+            self.addCleanup(cache_patcher.stop)
+        registry.invalidate()
+
+        self.user = get_user_model().objects.create_user(
+            username='test', password='test', email='test@tbp.berkeley.edu',
+            first_name='Test', last_name='Test')
+        self.term = Term.objects.get(term=Term.FALL, year=2009)
+        self.achievement = Achievement.objects.get(short_name='attend025events')
+        self.achievement.assign(self.user, term=self.term)
+        Achievement.objects.get(short_name='attend050events').assign(
+            self.user, acquired=False, progress=30, term=self.term)
+
+    def test_summary(self):
+        registry.all()
+        with self.assertNumQueries(2):
+            summary = get_user_achievements_summary(self.user)
+        self.assertEqual(summary['unlocked'], [('attend025events', 0)])
+        self.assertEqual(summary['progress'], {'attend050events': 30})
+        self.assertEqual(summary['points'], self.achievement.points)
+        self.assertEqual(summary['count'], 1)
+
+        # the summary is cached until the user's achievements change
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_achievements_summary(self.user), summary)
+        Achievement.objects.get(short_name='attend050events').assign(
+            self.user, term=self.term)
+        summary = get_user_achievements_summary(self.user)
+        self.assertEqual(summary['count'], 2)
+        self.assertEqual(summary['progress'], {})
+
+        # or any achievement changes
+        self.achievement.points += 10
+        self.achievement.save()
+        self.assertEqual(get_user_achievements_summary(self.user)['points'],
+                         summary['points'] + 10)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_local_memory_cache(self):
+        """The summary is not cached in a local memory cache, since other
+        processes could not invalidate it.
+        """
+        registry.all()
+        get_user_achievements_summary(self.user)
+        with self.assertNumQueries(2):
+            get_user_achievements_summary(self.user)
+
+    def test_bulk_assignment(self):
+        summary = get_user_achievements_summary(self.user)
+        Achievement.objects.get(short_name='attend050events').assign_many(
+            [self.user], term=self.term)
+        self.assertEqual(get_user_achievements_summary(self.user)['count'],
+                         summary['count'] + 1)
+
+
+class AchievementScoreTest(TestCase):
+    fixtures = ['achievement.yaml', 'test/term.yaml']
+
+    def setUp(self):
+        user_model = get_user_model()
+        self.users = [user_model.objects.create_user(
+            'user{}'.format(i), 'user{}@tbp.berkeley.edu'.format(i),
+            'password', first_name='First', last_name='Last{}'.format(i))
+            for i in range(4)]
+        self.term = Term.objects.get(term=Term.FALL, year=2009)
+        self.achievement = Achievement.objects.get(short_name='attend025events')
+        self.other_achievement = Achievement.objects.get(
+            short_name='attend050events')
+
+    def assert_scores(self, expected):
+        """Assert that the scores and ranks of the users are the given list of
+        (user index, score, rank), in order of rank.
+        """
+        self.assertEqual(
+            list(AchievementScore.objects.values_list(
+                'user', 'score', 'rank')),
+            [(self.users[i].pk, score, rank) for i, score, rank in expected])
+
+    def test_scores(self):
+        points = self.achievement.points
+        other_points = self.other_achievement.points
+        self.achievement.assign(self.users[0], term=self.term)
+        self.other_achievement.assign(self.users[1], term=self.term)
+        self.achievement.assign_many(self.users[1:3], term=self.term)
+        # progress towards an achievement does not count
+        self.other_achievement.assign(
+            self.users[3], acquired=False, progress=1, term=self.term)
+        self.assert_scores([(1, points + other_points, 1),
+                            (0, points, 2),
+                            (2, points, 2)])
+
+        # unacquiring an achievement lowers the score
+        self.other_achievement.assign(
+            self.users[1], acquired=False, term=self.term)
+        self.assert_scores([(0, points, 1),
+                            (1, points, 1),
+                            (2, points, 1)])
+
+        # deleting a user's only achievement removes their score
+        UserAchievement.objects.get(
+            user=self.users[2], achievement=self.achievement).delete()
+        self.assert_scores([(0, points, 1), (1, points, 1)])
+
+        # changing the points of an achievement changes the scores
+        self.other_achievement.assign(self.users[0], term=self.term)
+        self.other_achievement.points = points + 10
+        self.other_achievement.save()
+        self.assert_scores([(0, 2 * points + 10, 1), (1, points, 2)])
+
+    def test_ranked_only_when_scores_change(self):
+        with patch('quark.achievements.models.update_achievement_ranks',
+                   wraps=update_achievement_ranks) as mock_rank:
+            # progress towards an achievement does not change any score
+            for progress in range(1, 4):
+                self.achievement.assign(self.users[0], acquired=False,
+                                        progress=progress, term=self.term)
+            self.assertEqual(mock_rank.call_count, 0)
+
+            self.achievement.assign(self.users[0], term=self.term)
+            self.assertEqual(mock_rank.call_count, 1)
+            # assigning an acquired achievement again changes nothing
+            self.achievement.assign(self.users[0], term=self.term)
+            self.assertEqual(mock_rank.call_count, 1)
+
+            # deleting an achievement ranks the scores once
+            self.other_achievement.assign_many(self.users, term=self.term)
+            mock_rank.reset_mock()
+            self.other_achievement.delete()
+            self.assertEqual(mock_rank.call_count, 1)
+        self.assert_scores([(0, self.achievement.points, 1)])
+
+    def test_deleted_user(self):
+        self.achievement.assign(self.users[0], term=self.term)
+        self.achievement.assign(self.users[1], term=self.term)
+        self.users[0].delete()
+        self.assert_scores([(1, self.achievement.points, 1)])
+
 
 class EventAchievementsTest(TestCase):
     fixtures = ['achievement.yaml',
@@ -555,6 +825,108 @@ class EventAchievementsTest(TestCase):
             achievement__short_name='alphabet_attendance',
             acquired=True).count(), 1)
 
+    def test_letters_mask(self):
+        self.assertEqual(get_letters_mask(''), 0)
+        self.assertEqual(get_letters_mask('aC c!'), 0b101)
+        self.assertEqual(get_letters_mask('Z 15'), 1 << 25)
+        self.assertEqual(
+            get_letters_mask(string.ascii_uppercase), ALL_LETTERS)
+
+    def test_attendance_counters(self):
+        """Attendance counters are updated as attendance is recorded and
+        removed.
+        """
+        fun = self.create_event(name='ab', event_type=self.fun)
+        self.create_event(name='bc', event_type=self.fun)
+        self.create_event(name='d', event_type=self.meeting, term=self.fa2013)
+        self.create_event(name='cancelled', event_type=self.meeting,
+                          attendance=False)
+
+        counter = AttendanceCounter.objects.get(user=self.sample_user)
+        self.assertEqual(counter.count, 3)
+        term_counter = TermAttendanceCounter.objects.get(
+            user=self.sample_user, term=self.sp2013)
+        self.assertEqual(term_counter.count, 2)
+        self.assertEqual(term_counter.letters, 0b111)
+        type_counter = EventTypeAttendanceCounter.objects.get(
+            user=self.sample_user, term=self.sp2013, event_type=self.fun)
+        self.assertEqual(type_counter.count, 2)
+
+        # Attendance at cancelled events is not counted
+        cancelled = Event.objects.get(name='cancelled')
+        cancelled.cancelled = True
+        cancelled.save()
+        EventAttendance.objects.create(event=cancelled, user=self.sample_user)
+        self.assertEqual(AttendanceCounter.objects.get(
+            user=self.sample_user).count, 3)
+
+        EventAttendance.objects.get(event=fun).delete()
+        self.assertEqual(AttendanceCounter.objects.get(
+            user=self.sample_user).count, 2)
+        term_counter = TermAttendanceCounter.objects.get(
+            user=self.sample_user, term=self.sp2013)
+        self.assertEqual(term_counter.count, 1)
+        self.assertEqual(term_counter.letters, 0b110)
+        type_counter = EventTypeAttendanceCounter.objects.get(
+            user=self.sample_user, term=self.sp2013, event_type=self.fun)
+        self.assertEqual(type_counter.count, 1)
+
+    def test_attendance_counters_event_changed(self):
+        """Attendance counters are rebuilt if an attended event is moved to
+        another term or cancelled.
+        """
+        event = self.create_event(name='a', event_type=self.fun)
+        self.create_event(name='b', event_type=self.fun)
+        event.term = self.fa2013
+        event.save()
+        self.assertEqual(TermAttendanceCounter.objects.get(
+            user=self.sample_user, term=self.sp2013).letters, 0b10)
+        self.assertEqual(TermAttendanceCounter.objects.get(
+            user=self.sample_user, term=self.fa2013).count, 1)
+
+        event.cancelled = True
+        event.save()
+        self.assertEqual(AttendanceCounter.objects.get(
+            user=self.sample_user).count, 1)
+        self.assertFalse(TermAttendanceCounter.objects.filter(
+            user=self.sample_user, term=self.fa2013).exists())
+
+    def test_rebuild_attendance_counters(self):
+        """Rebuilding the counters gives the same counts as updating them
+        incrementally.
+        """
+        self.create_event(name='ab', event_type=self.fun)
+        self.create_event(name='c', event_type=self.fun, term=self.fa2013)
+        self.create_event(name='d', event_type=self.meeting, term=self.fa2013)
+        EventAttendance.objects.get(event__name='c').delete()
+
+        def get_counts():
+            return (
+                list(AttendanceCounter.objects.filter(
+                    user=self.sample_user).values_list('count')),
+                list(TermAttendanceCounter.objects.filter(
+                    user=self.sample_user).order_by('term').values_list(
+                    'term', 'count', 'letters')),
+                list(EventTypeAttendanceCounter.objects.filter(
+                    user=self.sample_user, count__gt=0).order_by(
+                    'term', 'event_type').values_list(
+                    'term', 'event_type', 'count')))
+
+        counts = get_counts()
+        rebuild_attendance_counters(self.sample_user.pk)
+        self.assertEqual(get_counts(), counts)
+
+    def test_lifetime_progress_after_removal(self):
+        """Progress towards lifetime achievements goes down when attendance is
+        removed.
+        """
+        self.create_event(name='Fun1', event_type=self.fun)
+        self.create_event(name='Fun2', event_type=self.fun)
+        EventAttendance.objects.get(event__name='Fun1').delete()
+        achievement = UserAchievement.objects.get(
+            achievement__short_name='attend025events', user=self.sample_user)
+        self.assertEqual(achievement.progress, 1)
+
 
 class OfficerAchievementsTest(TestCase):
     fixtures = ['achievement.yaml',
@@ -1038,3 +1410,108 @@ class ProjectReportAchievementsTest(TestCase):
         self.assertEqual(self.achievements.filter(
             achievement__short_name='project_report_procrastination',
             acquired=True).count(), 1)
+
+
+@override_settings(ACHIEVEMENT_QUEUE_SYNC=False)
+class PendingAchievementEvaluationTest(TestCase):
+    fixtures = ['achievement.yaml',
+                'officer_position.yaml',
+                'test/term.yaml']
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='test', password='test', email='test@tbp.berkeley.edu',
+            first_name="Test", last_name="Test")
+        self.sp2013 = Term.objects.get(term=Term.SPRING, year='2013')
+        self.fa2013 = Term.objects.get(term=Term.FALL, year='2013')
+        self.fun, _ = EventType.objects.get_or_create(name='Fun')
+        self.achievements = UserAchievement.objects.filter(
+            user=self.user, acquired=True)
+
+    def attend_event(self, name, term):
+        event = Event.objects.create(
+            name=name, contact=self.user, term=term, location='TBD',
+            event_type=self.fun, start_datetime=timezone.now(),
+            end_datetime=timezone.now(),
+            committee=OfficerPosition.objects.first())
+        EventAttendance.objects.create(event=event, user=self.user)
+
+    def test_queue(self):
+        """Evaluations are queued once for each user, kind and term, and
+        achievements are only assigned when the queue is processed.
+        """
+        self.attend_event('D15', self.sp2013)
+        self.attend_event('Fun', self.sp2013)
+        self.attend_event('National Convention', self.fa2013)
+        Officer.objects.create(
+            user=self.user, term=self.fa2013,
+            position=OfficerPosition.objects.get(short_name='historian'))
+
+        self.assertItemsEqual(
+            PendingAchievementEvaluation.objects.values_list('kind', 'term'),
+            [(PendingAchievementEvaluation.EVENT, self.sp2013.pk),
+             (PendingAchievementEvaluation.EVENT, self.fa2013.pk),
+             (PendingAchievementEvaluation.OFFICER, self.fa2013.pk)])
+        self.assertFalse(self.achievements.exists())
+        # Attendance counters are still updated right away
+        self.assertEqual(
+            AttendanceCounter.objects.get(user=self.user).count, 3)
+
+        self.assertEqual(process_pending_evaluations(batch_size=2), (2, []))
+        self.assertEqual(PendingAchievementEvaluation.objects.count(), 1)
+        self.assertEqual(process_pending_evaluations(), (1, []))
+        self.assertFalse(PendingAchievementEvaluation.objects.exists())
+
+        self.assertItemsEqual(
+            self.achievements.values_list('achievement__short_name', 'term'),
+            [('attend_d15', self.sp2013.pk),
+             ('attend_convention', self.fa2013.pk),
+             ('attend_all_fun', self.sp2013.pk),
+             ('attend_each_type', self.sp2013.pk),
+             ('officersemester01', self.fa2013.pk)])
+
+    def test_failed_evaluation_queued_again(self):
+        """Failed evaluations are queued again, until they have failed
+        MAX_EVALUATION_ATTEMPTS times.
+        """
+        self.attend_event('D15', self.sp2013)
+        pending = PendingAchievementEvaluation.objects.filter(
+            user=self.user, term=self.sp2013)
+        with patch('quark.achievements.event_achievements.'
+                   'evaluate_event_achievements', side_effect=ValueError):
+            processed, errors = process_pending_evaluations()
+            self.assertEqual(processed, 1)
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(pending.get().attempts, 1)
+            self.assertFalse(self.achievements.exists())
+
+            for _ in range(MAX_EVALUATION_ATTEMPTS - 1):
+                processed, errors = process_pending_evaluations()
+        self.assertEqual(processed, 1)
+        self.assertIn('gave up', errors[0])
+        self.assertFalse(pending.exists())
+
+    def test_interrupted_evaluation(self):
+        """Evaluations stay queued until they have been evaluated, even if
+        processing them is interrupted.
+        """
+        self.attend_event('D15', self.sp2013)
+        with patch('quark.achievements.event_achievements.'
+                   'evaluate_event_achievements',
+                   side_effect=KeyboardInterrupt):
+            self.assertRaises(KeyboardInterrupt, process_pending_evaluations)
+        self.assertEqual(PendingAchievementEvaluation.objects.get(
+            user=self.user, term=self.sp2013).attempts, 0)
+
+        # Queueing an evaluation that is already pending resets its attempts
+        PendingAchievementEvaluation.objects.update(attempts=2)
+        self.attend_event('Fun', self.sp2013)
+        self.assertEqual(PendingAchievementEvaluation.objects.get().attempts,
+                         0)
+
+    @override_settings(ACHIEVEMENT_QUEUE_SYNC=True)
+    def test_sync(self):
+        self.attend_event('D15', self.sp2013)
+        self.assertFalse(PendingAchievementEvaluation.objects.exists())
+        self.assertTrue(self.achievements.filter(
+            achievement__short_name='attend_d15').exists())
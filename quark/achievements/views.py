@@ -1,9 +1,14 @@
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.decorators import permission_required
+from django.core.cache import cache
 from django.core.urlresolvers import reverse_lazy
+from django.db.models import Count
+from django.db.models import Max
 from django.db.models import Sum
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
 from django.views.generic import DetailView
@@ -12,7 +17,10 @@ from django.views.generic import ListView
 
 from quark.achievements.forms import UserAchievementForm
 from quark.achievements.models import Achievement
+from quark.achievements.models import AchievementScore
 from quark.achievements.models import UserAchievement
+from quark.achievements.models import user_achievements_cache_key
+from quark.achievements.registry import registry
 
 
 class AchievementDetailView(DetailView):
@@ -25,9 +33,10 @@ class AchievementDetailView(DetailView):
         return super(AchievementDetailView, self).dispatch(*args, **kwargs)
 
     def get_object(self, queryset=None):
-        return get_object_or_404(
-            Achievement,
-            short_name=self.kwargs['achievement_short_name'])
+        achievement = registry.get(self.kwargs['achievement_short_name'])
+        if achievement is None:
+            raise Http404
+        return achievement
 
     def get_context_data(self, **kwargs):
         context = super(AchievementDetailView, self).get_context_data(**kwargs)
@@ -49,9 +58,10 @@ class AchievementDetailView(DetailView):
             'last_name')
 
         # Find other achievements in same sequence to display related.
-        context['related_achievements'] = Achievement.objects.filter(
-            sequence=context['achievement'].sequence).exclude(
-            short_name=context['achievement'].short_name)
+        context['related_achievements'] = [
+            achievement for achievement in registry.by_sequence().get(
+                context['achievement'].sequence, [])
+            if achievement.short_name != context['achievement'].short_name]
 
         return context
 
@@ -62,51 +72,35 @@ class LeaderboardListView(ListView):
     context_object_name = 'leader_list'
     template_name = 'achievements/leaderboard.html'
     paginate_by = 35  # separates leaders into pages of 35 each
+    max_score = 0
 
     @method_decorator(login_required)
     def dispatch(self, *args, **kwargs):
         return super(LeaderboardListView, self).dispatch(*args, **kwargs)
 
     def get_queryset(self):
-        leaders = get_user_model().objects.filter(
-            userachievement__acquired=True).select_related(
-            'userprofile').annotate(score=Sum(
-            'userachievement__achievement__points')).filter(
-            score__gte=0).order_by('-score')
-
-        if len(leaders) > 0:
-            max_score = leaders[0].score or 0
-        else:
-            max_score = 0
-
-        # Create a list of "leader" entries, where each entry is a dictionary
-        # that includes the user, their rank on the leaderboard (1st, 2nd,
-        # etc.), and their leaderboard width "factor" (see below for details).
-        leader_list = []
-        if max_score > 0:
-
-            prev_value = -1
-            prev_rank = 1
-
-            for i, leader in enumerate(leaders, start=prev_rank):
-                # factor used for CSS width property (percentage). Use 70.0 as
-                # the maximum width (i.e. top scorer has width 70%), including
-                # adding 2.5 to every factor to make sure that there is enough
-                # room for text to be displayed.
-                factor = 2.5 + leader.score * 67.5 / max_score
-                if leader.score == prev_value:
-                    rank = prev_rank
-                else:
-                    rank = i
-
-                prev_rank = rank
-                prev_value = leader.score
-
-                # Add the leader entry to the list
-                leader_list.append({'user': leader,
-                                    'factor': factor,
-                                    'rank': rank})
-        return leader_list
+        leaders = AchievementScore.objects.filter(score__gte=0)
+        self.max_score = leaders.aggregate(
+            max_score=Max('score'))['max_score'] or 0
+        if self.max_score <= 0:
+            return leaders.none()
+        return leaders.select_related('user__userprofile')
+
+    def get_context_data(self, **kwargs):
+        context = super(LeaderboardListView, self).get_context_data(**kwargs)
+
+        # Give each "leader" entry on the page, which already includes the
+        # user and their rank on the leaderboard (1st, 2nd, etc.), their
+        # leaderboard width "factor" (see below for details).
+        leader_list = list(context['leader_list'])
+        for leader in leader_list:
+            # factor used for CSS width property (percentage). Use 70.0 as
+            # the maximum width (i.e. top scorer has width 70%), including
+            # adding 2.5 to every factor to make sure that there is enough
+            # room for text to be displayed.
+            leader.factor = 2.5 + leader.score * 67.5 / self.max_score
+        context['leader_list'] = leader_list
+        return context
 
 
 class UserAchievementAssignView(FormView):
@@ -138,56 +132,94 @@ class UserAchievementAssignView(FormView):
         return super(UserAchievementAssignView, self).form_valid(form)
 
 
+LOCMEM_CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+def get_user_achievements_summary(user):
+    """Return a summary of the given user's achievements, as a dictionary of:
+    unlocked: a list of the short names of the user's acquired achievements
+        and the progress of each, in order of rank
+    progress: a dictionary mapping the short names of the user's unacquired
+        achievements to the user's progress towards them
+    points and count: the total points and number of acquired achievements
+
+    The summary is cached for settings.USER_ACHIEVEMENTS_CACHE_TIMEOUT
+    seconds, until the user's achievements or any achievement changes. It is
+    removed from the cache by whichever process changes the achievements
+    (such as the processachievementqueue command), so it is not cached at
+    all if the default cache is a local memory cache, which is private to
+    each process.
+    """
+    timeout = settings.USER_ACHIEVEMENTS_CACHE_TIMEOUT
+    if settings.CACHES['default']['BACKEND'] == LOCMEM_CACHE_BACKEND:
+        timeout = 0
+    version = registry.get_version()
+    cache_key = user_achievements_cache_key(user.pk)
+    if timeout:
+        summary = cache.get(cache_key)
+        if summary is not None and summary['version'] == version:
+            return summary
+
+    user_achievements = user.userachievement_set.order_by('achievement__rank')
+    summary = {'version': version, 'unlocked': [], 'progress': {}}
+    for short_name, acquired, progress in user_achievements.values_list(
+            'achievement__short_name', 'acquired', 'progress'):
+        if acquired:
+            summary['unlocked'].append((short_name, progress))
+        else:
+            summary['progress'][short_name] = progress
+    totals = user_achievements.filter(acquired=True).order_by().aggregate(
+        points=Sum('achievement__points'), count=Count('pk'))
+    summary['points'] = totals['points'] or 0
+    summary['count'] = totals['count']
+
+    if timeout:
+        cache.set(cache_key, summary, timeout)
+    return summary
+
+
 class UserAchievementListView(ListView):
     context_object_name = 'unlocked_list'
     template_name = 'achievements/user.html'
     display_user = None
-    user_achievements = None
-    user_points = 0
+    summary = None
 
     @method_decorator(login_required)
     def dispatch(self, *args, **kwargs):
         self.display_user = get_object_or_404(get_user_model(),
                                               id=self.kwargs['user_id'])
-        self.user_achievements = self.display_user.userachievement_set.exclude(
-            acquired=False).order_by('achievement__rank')
+        self.summary = get_user_achievements_summary(self.display_user)
         return super(UserAchievementListView, self).dispatch(*args, **kwargs)
 
     def get_queryset(self):
-        queryset = self.user_achievements
-
-        for userachievement in queryset:
-            self.user_points += userachievement.achievement.points
-
-        if self.request.user != self.display_user:
-            queryset = queryset.exclude(achievement__privacy='private')
-
-        return queryset
+        unlocked_list = []
+        for short_name, progress in self.summary['unlocked']:
+            achievement = registry.get(short_name)
+            if achievement is None or (
+                    achievement.privacy == Achievement.PRIVACY_PRIVATE and
+                    self.request.user != self.display_user):
+                continue
+            unlocked_list.append(
+                {'achievement': achievement, 'progress': progress})
+        return unlocked_list
 
     def get_context_data(self, **kwargs):
         context = super(UserAchievementListView, self).get_context_data(
             **kwargs)
         context['display_user'] = self.display_user
-        context['user_points'] = self.user_points
-        context['user_num_achievements'] = self.user_achievements.count()
-
-        # Select achievements that have ids not found in the list of obtained
-        # user achievements (i.e. they have not been acquired yet or don't
-        # exist), and obtain goals and progresses.
-        locked_achievements = Achievement.objects.exclude(
-            userachievement__in=self.user_achievements).exclude(
-            privacy='private').order_by('rank')
-        progresses = []
-        for achievement in locked_achievements:
-            try:
-                user_achievement = UserAchievement.objects.get(
-                    user=self.display_user, achievement=achievement)
-                progresses.append(user_achievement.progress)
-            except UserAchievement.DoesNotExist:
-                progresses.append(0)
-        locked_list = [{'achievement': t[0], 'progress': t[1]}
-                       for t in zip(locked_achievements, progresses)]
-        context['locked_list'] = locked_list
+        context['user_points'] = self.summary['points']
+        context['user_num_achievements'] = self.summary['count']
+
+        # Select the achievements that the user has not acquired yet, along
+        # with the user's progress towards them
+        unlocked = set(short_name for short_name, _ in self.summary['unlocked'])
+        context['locked_list'] = [
+            {'achievement': achievement,
+             'progress': self.summary['progress'].get(
+                 achievement.short_name, 0)}
+            for achievement in registry.all()
+            if achievement.short_name not in unlocked and
+            achievement.privacy != Achievement.PRIVACY_PRIVATE]
 
         # Select hidden achievements the viewer has unlocked so that they are
         # visible in other users' pages.
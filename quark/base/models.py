@@ -1,8 +1,9 @@
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from django.core.cache import cache
 from django.db import models
 from django.db import transaction
+from django.dispatch import Signal
 from django.utils import timezone
 
 
@@ -46,19 +47,22 @@ class Major(models.Model):
         unique_together = ('university', 'short_name')
 
 
+# Sent by Term.save, once its transaction is over, when a term that was not the
+# current term is saved as the current term (e.g., at term rollover)
+term_became_current = Signal(providing_args=['instance'])
+
+
 class TermManager(models.Manager):
     def get_current_term(self):
         """Return the term with current set to True, or None if no current term
         exists.
+
+        The term is looked up in the term registry, so it is usually found
+        without querying.
         """
-        term = cache.get('current_term')
-        if not term:
-            try:
-                term = self.get(current=True)
-                cache.set('current_term', term, None)
-            except Term.DoesNotExist:
-                pass
-        return term
+        # Avoid circular dependency by importing here:
+        from quark.base.registry import term_registry
+        return term_registry.get_current()
 
     def get_terms(self, include_future=False, include_summer=False,
                   include_unknown=False, reverse=False):
@@ -89,16 +93,16 @@ class TermManager(models.Manager):
         """
         The url param is generated by the get_url_name function. It takes the
         form of "fa2012".
+
+        The term is looked up in the term registry, so it is usually found
+        without querying.
         """
-        if not isinstance(name, basestring):
-            return None
+        # Avoid circular dependency by importing here:
+        from quark.base.registry import term_registry
 
-        try:
-            return self.get(term=name[0:2], year=name[2:])
-        except Term.DoesNotExist:
-            return None
-        except ValueError:
+        if not isinstance(name, basestring):
             return None
+        return term_registry.get_by_url_name(name)
 
     def get_by_natural_key(self, term, year):
         try:
@@ -166,14 +170,34 @@ class Term(models.Model):
         # pylint: disable=W0201
         self.id = self._calculate_pk()
 
+        became_current = self.current and not Term.objects.filter(
+            id=self.id, current=True).exists()
+
         # Failed transactions will be rolled back, but will not catch errors
-        with transaction.atomic():
-            if self.current:
-                Term.objects.filter(current=True).exclude(
-                    id=self.id).update(current=False)
-            super(Term, self).save(*args, **kwargs)
-            self.update_term_officer_groups()
-            cache.set('current_term', self, None)  # Update the cache
+        try:
+            with transaction.atomic():
+                if self.current:
+                    Term.objects.filter(current=True).exclude(
+                        id=self.id).update(current=False)
+                super(Term, self).save(*args, **kwargs)
+                self.update_term_officer_groups()
+        finally:
+            # The term registry is invalidated when the term is saved, but
+            # another process could reload it before the transaction commits
+            # (or this process could keep changes that are rolled back), so
+            # invalidate it again now that the transaction is over
+            invalidate_term_registry(Term)
+
+        if became_current:
+            term_became_current.send(sender=Term, instance=self)
+
+    def delete(self, *args, **kwargs):
+        try:
+            super(Term, self).delete(*args, **kwargs)
+        finally:
+            # Invalidate the term registry again now that the transaction is
+            # over, as in save
+            invalidate_term_registry(Term)
 
     def verbose_name(self):
         """Returns the verbose name of this object in this form: Fall 2012."""
@@ -243,18 +267,64 @@ class Term(models.Model):
     def update_term_officer_groups(self):
         """Ensure that if the term being saved is set as the "current" term,
         all groups that are specific to the current term are updated.
+
+        The group memberships that the officers of this term should have are
+        compared with the memberships in the database as sets, so that the
+        "Current" groups are rebuilt with one bulk delete and one bulk insert,
+        no matter how many officers there are.
+
+        The groups are looked up in the database rather than in the group
+        registry, since a stale registry could miss a "Current" group that
+        needs clearing, or have the pk of a deleted group.
         """
-        if self.current:
-            # Clear out all existing "current term" groups, since the new
-            # current term is being saved here.
-            groups = Group.objects.filter(name__contains='Current')
-            for group in groups:
-                group.user_set.clear()
+        if not self.current:
+            return
 
-            # Update groups for all officers from this new current term
-            officers = Officer.objects.filter(term=self)
-            for officer in officers:
-                officer._add_user_to_officer_groups()
+        # The pks of the users to add to each group, by group name
+        group_users = {}
+        officers = Officer.objects.filter(term=self).select_related(
+            'position')
+        for officer in officers:
+            for group_name in officer.position.get_corresponding_group_names(
+                    term=self):
+                group_users.setdefault(group_name, set()).add(officer.user_id)
+
+        all_group_pks = dict(Group.objects.filter(
+            models.Q(name__in=group_users.keys()) |
+            models.Q(name__contains='Current')).values_list('name', 'pk'))
+        for group_name in group_users:
+            if group_name not in all_group_pks:
+                all_group_pks[group_name] = Group.objects.get_or_create(
+                    name=group_name)[0].pk
+        group_pks = dict((group_name, all_group_pks[group_name])
+                         for group_name in group_users)
+        memberships = set(
+            (user_pk, group_pks[group_name])
+            for group_name, user_pks in group_users.iteritems()
+            for user_pk in user_pks)
+
+        # Members of the "current term" groups who are not officers of this
+        # term are removed from the groups, and officers of this term are
+        # added to any of their groups that they are not in yet
+        current_group_pks = set(
+            group_pk for group_name, group_pk in all_group_pks.iteritems()
+            if 'Current' in group_name)
+        membership_model = get_user_model().groups.through
+        existing = dict(
+            ((user_pk, group_pk), pk)
+            for pk, user_pk, group_pk in membership_model.objects.filter(
+                models.Q(group__in=current_group_pks) |
+                models.Q(user__in=[user_pk for user_pk, _ in memberships],
+                         group__in=group_pks.values())).values_list(
+                'pk', 'user', 'group'))
+        membership_model.objects.filter(pk__in=[
+            pk for membership, pk in existing.iteritems()
+            if membership[1] in current_group_pks and
+            membership not in memberships]).delete()
+        membership_model.objects.bulk_create([
+            membership_model(user_id=user_pk, group_id=group_pk)
+            for user_pk, group_pk in memberships
+            if (user_pk, group_pk) not in existing])
 
     class Meta(object):
         ordering = ('id',)
@@ -312,30 +382,40 @@ class OfficerPosition(models.Model):
         This method includes the "Current" groups in the result only if the
         term given is the current term.
         """
+        # Avoid circular dependency by importing here:
+        from quark.base.registry import group_registry
+
+        group_names = self.get_corresponding_group_names(term=term)
+        group_pks = group_registry.get_pks(group_names)
+        groups = Group.objects.in_bulk(group_pks.values())
+        return [groups[group_pks[group_name]] for group_name in group_names]
+
+    def get_corresponding_group_names(self, term=None):
+        """Return a list of the names of the Django Auth Groups corresponding
+        to this officer position and the term provided.
+
+        See get_corresponding_groups.
+        """
         is_current_term = term.current if term else False
 
         # Initialize the list of group names with the current officer position
         # name:
-        group_names = [self.long_name]
+        base_names = [self.long_name]
 
         # This position is part of the Officer group, unless it is an auxiliary
         # position:
         if not self.auxiliary:
-            group_names.append('Officer')
+            base_names.append('Officer')
 
         if self.executive:
-            group_names.append('Executive')
+            base_names.append('Executive')
 
-        groups = []  # List of Group objects to return
-        for group_name in group_names:
-            group, _ = Group.objects.get_or_create(name=group_name)
-            groups.append(group)
+        group_names = []
+        for group_name in base_names:
+            group_names.append(group_name)
             if is_current_term:
-                current_group_name = 'Current {}'.format(group_name)
-                group, _ = Group.objects.get_or_create(name=current_group_name)
-                groups.append(group)
-
-        return groups
+                group_names.append('Current {}'.format(group_name))
+        return group_names
 
 
 class Officer(models.Model):
@@ -366,8 +446,12 @@ class Officer(models.Model):
         """Add this Officer user to the corresponding officer position auth
         groups.
         """
-        groups = self.position.get_corresponding_groups(term=self.term)
-        self.user.groups.add(*groups)
+        # Avoid circular dependency by importing here:
+        from quark.base.registry import group_registry
+
+        group_pks = group_registry.get_pks(
+            self.position.get_corresponding_group_names(term=self.term))
+        add_user_to_groups(self.user_id, group_pks.values())
 
     def _remove_user_from_officer_groups(self):
         """Remove this Officer user from the corresponding officer position auth
@@ -379,23 +463,45 @@ class Officer(models.Model):
         specific Officer object. Otherwise, this method would remove groups
         that the user should remain a part of.
         """
-        stale_groups = set(
-            self.position.get_corresponding_groups(term=self.term))
+        # Avoid circular dependency by importing here:
+        from quark.base.registry import group_registry
 
-        # Get a set of the officer groups the user should still be a part of:
-        groups = set()
-        officers = Officer.objects.filter(user=self.user).select_related(
-            'position')
-        for officer in officers:
-            groups.update(officer.position.get_corresponding_groups(
-                term=officer.term))
+        stale_group_names = set(
+            self.position.get_corresponding_group_names(term=self.term))
 
-        # Get the set of officer groups that should be removed but subtracting
-        # out the ones that are still needed:
-        stale_groups = stale_groups.difference(groups)
+        # Subtract out the names of the officer groups the user should still
+        # be a part of:
+        officers = Officer.objects.filter(user=self.user_id).select_related(
+            'position', 'term')
+        for officer in officers:
+            stale_group_names.difference_update(
+                officer.position.get_corresponding_group_names(
+                    term=officer.term))
 
         # Remove the user from these "stale" groups:
-        self.user.groups.remove(*stale_groups)
+        group_pks = group_registry.get_pks(stale_group_names)
+        remove_user_from_groups(self.user_id, group_pks.values())
+
+
+def add_user_to_groups(user_pk, group_pks):
+    """Add the user with the given pk to the auth groups with the given pks
+    that the user is not in yet, with one query for the user's memberships and
+    one bulk insert into the user/group through table.
+    """
+    membership_model = get_user_model().groups.through
+    existing = set(membership_model.objects.filter(
+        user=user_pk, group__in=group_pks).values_list('group', flat=True))
+    membership_model.objects.bulk_create([
+        membership_model(user_id=user_pk, group_id=group_pk)
+        for group_pk in set(group_pks) if group_pk not in existing])
+
+
+def remove_user_from_groups(user_pk, group_pks):
+    """Remove the user with the given pk from the auth groups with the given
+    pks, with one delete from the user/group through table.
+    """
+    get_user_model().groups.through.objects.filter(
+        user=user_pk, group__in=group_pks).delete()
 
 
 def officer_post_save(sender, instance, *args, **kwargs):
@@ -412,5 +518,27 @@ def officer_post_delete(sender, instance, *args, **kwargs):
     instance._remove_user_from_officer_groups()
 
 
+def invalidate_term_registry(sender, **kwargs):
+    """Make every process reload its term registry when a term is saved or
+    deleted.
+    """
+    # Avoid circular dependency by importing here:
+    from quark.base.registry import term_registry
+    term_registry.invalidate()
+
+
+def invalidate_group_registry(sender, **kwargs):
+    """Make every process reload its group registry when an auth group is
+    saved or deleted.
+    """
+    # Avoid circular dependency by importing here:
+    from quark.base.registry import group_registry
+    group_registry.invalidate()
+
+
+models.signals.post_save.connect(invalidate_term_registry, sender=Term)
+models.signals.post_delete.connect(invalidate_term_registry, sender=Term)
+models.signals.post_save.connect(invalidate_group_registry, sender=Group)
+models.signals.post_delete.connect(invalidate_group_registry, sender=Group)
 models.signals.post_save.connect(officer_post_save, sender=Officer)
 models.signals.post_delete.connect(officer_post_delete, sender=Officer)
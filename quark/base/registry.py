@@ -0,0 +1,198 @@
+import threading
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+
+from quark.base.models import Term
+
+
+# The key in the shared cache of the current version of the terms, which is
+# changed whenever a term is saved or deleted
+VERSION_CACHE_KEY = 'terms_version'
+
+# The key in the shared cache of the current version of the auth groups, which
+# is changed whenever a group is saved or deleted
+GROUPS_VERSION_CACHE_KEY = 'groups_version'
+
+
+def get_cached_version(cache_key, timeout=None):
+    """Return the version stored in the shared cache with the given key,
+    storing a new version (which expires after the given number of seconds,
+    or never if timeout is None) if there is none.
+    """
+    version = cache.get(cache_key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(cache_key, version, timeout):
+            version = cache.get(cache_key) or version
+    return version
+
+
+def set_new_version(cache_key, timeout=None):
+    """Store a new version in the shared cache with the given key, which
+    expires after the given number of seconds, or never if timeout is None.
+    """
+    cache.set(cache_key, uuid.uuid4().hex, timeout)
+
+
+class TermRegistry(object):
+    """A process-wide registry of all terms.
+
+    All terms are loaded with one query, and reloaded only once the version
+    of the terms in the shared cache changes (i.e., after any process saves or
+    deletes a term), so looking terms up needs no queries. The version is
+    also assumed to have changed if it is missing from the cache, and expires
+    after settings.REGISTRY_VERSION_TIMEOUT seconds.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._terms = {}
+        self._url_names = {}
+        self._natural_keys = {}
+        self._ordered = []
+        self._selectable = []
+        self._current = None
+
+    def _load(self):
+        version = get_cached_version(
+            VERSION_CACHE_KEY, settings.REGISTRY_VERSION_TIMEOUT)
+        if version == self._version:
+            return
+
+        terms = list(Term.objects.order_by('id'))
+        current = None
+        for term in terms:
+            if term.current:
+                current = term
+
+        # The terms shown in term selectors, as in
+        # Term.objects.get_terms(reverse=True)
+        excluded = [Term.UNKNOWN, Term.SUMMER]
+        if getattr(settings, 'TERM_TYPE', 'quarter') == 'semester':
+            excluded.append(Term.WINTER)
+        selectable = [
+            term for term in reversed(terms) if term.term not in excluded and
+            (current is None or term.id <= current.id)]
+
+        with self._lock:
+            self._terms = dict((term.id, term) for term in terms)
+            self._url_names = dict(
+                (term.get_url_name(), term) for term in terms)
+            self._natural_keys = dict(
+                (term.natural_key(), term) for term in terms)
+            self._ordered = terms
+            self._selectable = selectable
+            self._current = current
+            self._version = version
+
+    def all(self):
+        """Return a list of all terms, in chronological order."""
+        self._load()
+        return self._ordered
+
+    def get(self, pk):
+        """Return the term with the given primary key, or None if there is no
+        such term.
+        """
+        self._load()
+        return self._terms.get(pk)
+
+    def get_by_url_name(self, name):
+        """Return the term with the given URL name (see Term.get_url_name), or
+        None if there is no such term.
+        """
+        self._load()
+        return self._url_names.get(name)
+
+    def get_by_natural_key(self, term, year):
+        """Return the term with the given term (e.g., Term.FALL) and year, or
+        None if there is no such term.
+        """
+        self._load()
+        return self._natural_keys.get((term, year))
+
+    def get_current(self):
+        """Return the current term, or None if there is no current term."""
+        self._load()
+        return self._current
+
+    def get_selectable(self):
+        """Return a list of the terms to choose from in term selectors, which
+        are the terms up to and including the current term (not including
+        summer, unknown and, for semester systems, winter terms), ordered from
+        current to oldest.
+        """
+        self._load()
+        return self._selectable
+
+    def invalidate(self):
+        """Make every process reload the terms on their next lookup."""
+        with self._lock:
+            self._version = None
+        set_new_version(VERSION_CACHE_KEY, settings.REGISTRY_VERSION_TIMEOUT)
+
+
+term_registry = TermRegistry()
+
+
+class GroupRegistry(object):
+    """A process-wide registry of the pks of all auth groups, keyed by name.
+
+    Like the TermRegistry, the groups are loaded with one query and reloaded
+    only once the version of the groups in the shared cache changes (i.e.,
+    after any process saves or deletes a group) or expires.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._pks = {}
+
+    def _load(self):
+        version = get_cached_version(
+            GROUPS_VERSION_CACHE_KEY, settings.REGISTRY_VERSION_TIMEOUT)
+        if version == self._version:
+            return
+
+        pks = dict(Group.objects.values_list('name', 'pk'))
+        with self._lock:
+            self._pks = pks
+            self._version = version
+
+    def all(self):
+        """Return a dictionary mapping the names of all groups to their pks."""
+        self._load()
+        return self._pks
+
+    def get_pk(self, name):
+        """Return the pk of the group with the given name, creating the group
+        if it does not exist.
+        """
+        return self.get_pks([name])[name]
+
+    def get_pks(self, names):
+        """Return a dictionary mapping each of the given group names to the pk
+        of the group, creating the groups that do not exist.
+        """
+        self._load()
+        pks = self._pks
+        group_pks = {}
+        for name in names:
+            if name in pks:
+                group_pks[name] = pks[name]
+            else:
+                group, _ = Group.objects.get_or_create(name=name)
+                group_pks[name] = group.pk
+        return group_pks
+
+    def invalidate(self):
+        """Make every process reload the groups on their next lookup."""
+        with self._lock:
+            self._version = None
+        set_new_version(
+            GROUPS_VERSION_CACHE_KEY, settings.REGISTRY_VERSION_TIMEOUT)
+
+
+group_registry = GroupRegistry()
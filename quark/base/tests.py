@@ -6,11 +6,16 @@ from django.contrib.auth.models import AnonymousUser
 from django.db import IntegrityError
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.core.cache.backends.locmem import LocMemCache
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.template import Context
 from django.template import Template
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.test.utils import override_settings
+from mock import ANY
+from mock import patch
 
 from quark.base import fields
 from quark.base.models import Major
@@ -18,6 +23,13 @@ from quark.base.models import Officer
 from quark.base.models import OfficerPosition
 from quark.base.models import Term
 from quark.base.models import University
+from quark.base.models import add_user_to_groups
+from quark.base.models import remove_user_from_groups
+from quark.base.registry import GroupRegistry
+from quark.base.registry import TermRegistry
+from quark.base.registry import VERSION_CACHE_KEY
+from quark.base.registry import group_registry
+from quark.base.registry import term_registry
 from quark.settings.dev import DATABASES as DEV_DB
 from quark.settings.production import DATABASES as PROD_DB
 from quark.settings.staging import DATABASES as STAGING_DB
@@ -215,6 +227,148 @@ class TermManagerTest(TestCase):
         self.assertIsNone(term)
 
 
+class TermRegistryTest(TestCase):
+    def setUp(self):
+        # Use a real cache for the version of the terms, since the tests use a
+        # dummy cache
+        cache_patcher = patch('quark.base.registry.cache',
+                              LocMemCache('terms', {}))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        term_registry.invalidate()
+
+        self.spring = Term.objects.create(term=Term.SPRING, year=2012)
+        self.summer = Term.objects.create(term=Term.SUMMER, year=2012)
+        self.fall = Term.objects.create(term=Term.FALL, year=2012,
+                                        current=True)
+        self.future = Term.objects.create(term=Term.SPRING, year=2013)
+
+    def test_lookups(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(term_registry.get_current(), self.fall)
+        with self.assertNumQueries(0):
+            self.assertEqual(term_registry.get(self.spring.pk), self.spring)
+            self.assertIsNone(term_registry.get(20111))
+            self.assertEqual(term_registry.get_by_url_name('sp2012'),
+                             self.spring)
+            self.assertIsNone(term_registry.get_by_url_name('sp2011'))
+            self.assertEqual(
+                term_registry.get_by_natural_key(Term.SPRING, 2012),
+                self.spring)
+            self.assertEqual(
+                term_registry.all(),
+                [self.spring, self.summer, self.fall, self.future])
+            self.assertEqual(Term.objects.get_current_term(), self.fall)
+            self.assertEqual(Term.objects.get_by_url_name('fa2012'),
+                             self.fall)
+
+    def test_get_selectable(self):
+        self.assertEqual(term_registry.get_selectable(),
+                         list(Term.objects.get_terms(reverse=True)))
+        self.assertEqual(term_registry.get_selectable(),
+                         [self.fall, self.spring])
+
+    def test_invalidation(self):
+        """Saving or deleting a term reloads the terms in this and other
+        processes.
+        """
+        other_registry = TermRegistry()
+        self.assertEqual(other_registry.get_current(), self.fall)
+
+        self.future.current = True
+        self.future.save()
+        self.assertEqual(term_registry.get_current(), self.future)
+        self.assertEqual(other_registry.get_current(), self.future)
+        self.assertFalse(other_registry.get(self.fall.pk).current)
+
+        self.spring.delete()
+        self.assertIsNone(term_registry.get_by_url_name('sp2012'))
+        self.assertIsNone(other_registry.get_by_url_name('sp2012'))
+
+    def test_invalidation_after_rollback(self):
+        """Terms loaded while a term is being saved are reloaded once the
+        save's transaction is over, so rolled back changes are not kept.
+        """
+        def load_and_fail():
+            self.assertEqual(term_registry.get_current(), self.future)
+            raise ValueError
+
+        self.future.current = True
+        with patch.object(self.future, 'update_term_officer_groups',
+                          side_effect=load_and_fail):
+            self.assertRaises(ValueError, self.future.save)
+        self.assertEqual(term_registry.get_current(), self.fall)
+
+    @override_settings(REGISTRY_VERSION_TIMEOUT=60)
+    def test_version_timeout(self):
+        """The version of the terms expires, so the terms are reloaded
+        even if a change to them was missed.
+        """
+        with patch('quark.base.registry.cache') as mock_cache:
+            mock_cache.get.return_value = None
+            term_registry.invalidate()
+            term_registry.get_current()
+        mock_cache.set.assert_called_once_with(
+            VERSION_CACHE_KEY, ANY, 60)
+        mock_cache.add.assert_called_once_with(VERSION_CACHE_KEY, ANY, 60)
+
+
+class GroupRegistryTest(TestCase):
+    def setUp(self):
+        # Use a real cache for the version of the groups, since the tests use
+        # a dummy cache
+        cache_patcher = patch('quark.base.registry.cache',
+                              LocMemCache('groups', {}))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        group_registry.invalidate()
+
+        self.group = Group.objects.create(name='Member')
+        self.user = get_user_model().objects.create_user(
+            username='member',
+            email='member@tbp.berkeley.edu',
+            password='memberpw',
+            first_name='Mem',
+            last_name='Ber')
+
+    def test_get_pks(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(group_registry.get_pk('Member'), self.group.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(group_registry.get_pks(['Member']),
+                             {'Member': self.group.pk})
+            self.assertEqual(group_registry.all(), {'Member': self.group.pk})
+
+        # Missing groups are created
+        group_pk = group_registry.get_pk('Officer')
+        self.assertEqual(Group.objects.get(name='Officer').pk, group_pk)
+        self.assertEqual(group_registry.get_pk('Officer'), group_pk)
+
+    def test_invalidation(self):
+        """Saving or deleting a group reloads the groups in this and other
+        processes.
+        """
+        other_registry = GroupRegistry()
+        self.assertIn('Member', other_registry.all())
+        self.group.name = 'Members'
+        self.group.save()
+        self.assertNotIn('Member', group_registry.all())
+        self.assertEqual(other_registry.all(), {'Members': self.group.pk})
+        self.group.delete()
+        self.assertEqual(other_registry.all(), {})
+
+    def test_add_and_remove_user(self):
+        other_group = Group.objects.create(name='Officer')
+        with self.assertNumQueries(2):
+            add_user_to_groups(self.user.pk, [self.group.pk])
+        with self.assertNumQueries(2):
+            add_user_to_groups(self.user.pk, [self.group.pk, other_group.pk])
+        self.assertItemsEqual(self.user.groups.all(),
+                              [self.group, other_group])
+        remove_user_from_groups(self.user.pk, [self.group.pk])
+        self.assertItemsEqual(self.user.groups.all(), [other_group])
+
+
 class TermTest(TestCase):
     def test_save(self):
         spring = Term(term=Term.SPRING, year=2012, current=False)
@@ -698,6 +852,56 @@ class OfficerGroupsTest(TestCase):
         self.assertIn(self.officer_group_curr, groups)
         self.assertIn(self.pos_reg_group_curr, groups)
 
+    def test_term_post_save_queries(self):
+        """Test that the "Current" groups are rebuilt with the same number of
+        queries no matter how many officers the new current term has.
+        """
+        term_new = Term.objects.create(term=Term.FALL, year=2012)
+        Officer.objects.create(user=self.user, position=self.position_exec,
+                               term=term_new)
+        with CaptureQueriesContext(connection) as one_officer:
+            term_new.current = True
+            term_new.save()
+
+        for i in range(3):
+            user = get_user_model().objects.create_user(
+                username='officer{}'.format(i),
+                email='officer{}@tbp.berkeley.edu'.format(i),
+                password='officerpw',
+                first_name='Off',
+                last_name='Icer')
+            Officer.objects.create(user=user, position=self.position_regular,
+                                   term=self.term)
+        with CaptureQueriesContext(connection) as four_officers:
+            self.term.current = True
+            self.term.save()
+        self.assertEqual(len(four_officers), len(one_officer))
+
+        self.assertNotIn(self.exec_group_curr, self.user.groups.all())
+        self.assertIn(self.exec_group, self.user.groups.all())
+        self.assertItemsEqual(
+            self.pos_reg_group_curr.user_set.values_list(
+                'username', flat=True),
+            ['officer0', 'officer1', 'officer2'])
+
+    def test_term_post_save_unregistered_group(self):
+        """The "Current" groups are cleared even if the group registry does
+        not know about them.
+        """
+        cache_patcher = patch('quark.base.registry.cache',
+                              LocMemCache('groups', {}))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        group_registry.invalidate()
+        group_registry.all()
+        # bulk_create sends no signals, so the registry is not invalidated
+        Group.objects.bulk_create([Group(name='Current Webmaster')])
+        stale_group = Group.objects.get(name='Current Webmaster')
+        self.user.groups.add(stale_group)
+
+        self.term.save()
+        self.assertNotIn(stale_group, self.user.groups.all())
+
 
 class SettingsTest(TestCase):
     def setUp(self):
@@ -3,7 +3,7 @@ from django.shortcuts import render
 from django.views.generic.base import TemplateView
 
 from quark.base.models import Officer
-from quark.base.models import Term
+from quark.base.registry import term_registry
 from quark.events.models import Event
 from quark.newsreel.models import News
 
@@ -39,11 +39,11 @@ class TermParameterMixin(object):
 
     def dispatch(self, request, *args, **kwargs):
         term = request.GET.get('term', '')
-        current_term = Term.objects.get_current_term()
+        current_term = term_registry.get_current()
         if not term:
             self.display_term = current_term
         else:
-            self.display_term = Term.objects.get_by_url_name(term)
+            self.display_term = term_registry.get_by_url_name(term)
             if self.display_term is None:
                 # Bad request, since their term URL parameter doesn't match a
                 # term of ours
@@ -62,9 +62,9 @@ class TermParameterMixin(object):
         context['display_term_url_name'] = self.display_term.get_url_name()
         context['is_current'] = self.is_current
 
-        # Add queryset of all Terms up to and including the current term,
+        # Add a list of all Terms up to and including the current term,
         # ordered from current to oldest
-        context['terms'] = Term.objects.get_terms(reverse=True)
+        context['terms'] = term_registry.get_selectable()
         return context
 
 
@@ -0,0 +1,108 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import transaction
+
+from quark.base.models import Term
+from quark.candidates.models import CandidateProgressRecord
+from quark.candidates.progress import CandidateProgressMatrix
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the stored progress of candidates from scratch and verify '
+            'it against the progress computed from events, challenges, exams, '
+            'resumes and manual adjustments.')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-t', '--term', dest='term', default='',
+            help='Only rebuild the given term (e.g., sp2012) instead of all '
+                 'terms with candidates'),
+        make_option(
+            '--verify-only', action='store_true', dest='verify_only',
+            default=False,
+            help='Only verify the stored progress, without rebuilding it')
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs.get('term'):
+            term = Term.objects.get_by_url_name(kwargs['term'])
+            if term is None:
+                raise CommandError('Unknown term {}'.format(kwargs['term']))
+            terms = [term]
+        else:
+            terms = Term.objects.filter(candidate__isnull=False).distinct()
+        verbose = int(kwargs.get('verbosity')) > 0
+
+        errors = []
+        for term in terms:
+            if not kwargs.get('verify_only'):
+                num_records = rebuild_progress_records(term)
+                if verbose:
+                    self.stdout.write(
+                        'Stored {} progress records for {}'.format(
+                            num_records, term))
+            errors.extend(verify_progress_records(term))
+
+        if errors:
+            for error in errors:
+                self.stderr.write(error)
+            raise CommandError(
+                '{} stored progress records are incorrect'.format(len(errors)))
+        if verbose:
+            self.stdout.write('All stored progress records are correct')
+
+
+def rebuild_progress_records(term):
+    """Replace all CandidateProgressRecords for candidates in the given term
+    with freshly computed ones.
+
+    Returns the number of records stored.
+    """
+    matrix = CandidateProgressMatrix(term)
+    records = [CandidateProgressRecord(
+        candidate=candidate, requirement=req, **progress.get(req))
+        for candidate, progress in matrix for req in matrix.requirements]
+    with transaction.atomic():
+        CandidateProgressRecord.objects.filter(
+            candidate__term=term).delete()
+        CandidateProgressRecord.objects.bulk_create(records)
+    return len(records)
+
+
+def verify_progress_records(term):
+    """Compare the CandidateProgressRecords for candidates in the given term
+    with the progress computed from scratch.
+
+    Returns a list of descriptions of the missing, incorrect and extra
+    records.
+    """
+    matrix = CandidateProgressMatrix(term)
+    # Map from (candidate id, requirement id) to (completed, required)
+    stored = dict(
+        [((candidate_id, requirement_id), (completed, required))
+         for candidate_id, requirement_id, completed, required in
+         CandidateProgressRecord.objects.filter(
+             candidate__term=term).values_list(
+             'candidate', 'requirement', 'completed', 'required')])
+
+    errors = []
+    for candidate, progress in matrix:
+        for req in matrix.requirements:
+            expected = progress.get(req)
+            expected = (expected['completed'], expected['required'])
+            actual = stored.pop((candidate.pk, req.pk), None)
+            if actual is None:
+                errors.append(u'Missing record for {} ({})'.format(
+                    candidate, req))
+            elif actual != expected:
+                errors.append(
+                    u'Record for {} ({}) is {}/{} instead of {}/{}'.format(
+                        candidate, req, actual[0], actual[1], expected[0],
+                        expected[1]))
+    for candidate_id, requirement_id in stored:
+        errors.append(
+            u'Extra record for candidate {} and requirement {}'.format(
+                candidate_id, requirement_id))
+    return errors
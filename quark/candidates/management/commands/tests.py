@@ -0,0 +1,75 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+
+from quark.base.models import Term
+from quark.candidates.management.commands.rebuildcandidateprogress import \
+    rebuild_progress_records
+from quark.candidates.management.commands.rebuildcandidateprogress import \
+    verify_progress_records
+from quark.candidates.models import Candidate
+from quark.candidates.models import CandidateProgressRecord
+from quark.candidates.models import EventCandidateRequirement
+from quark.events.models import Event
+from quark.events.models import EventAttendance
+from quark.events.models import EventType
+
+
+class RebuildCandidateProgressTest(TestCase):
+    def setUp(self):
+        Group.objects.create(name='Current Candidate')
+        Group.objects.create(name='Member')
+        self.user = get_user_model().objects.create_user(
+            username='luser',
+            email='test@tbp.berkeley.edu',
+            password='password',
+            first_name='Random',
+            last_name='Candidate')
+        self.term = Term.objects.create(term=Term.SPRING, year=2012,
+                                        current=True)
+        self.candidate = Candidate.objects.create(user=self.user,
+                                                  term=self.term)
+        event_type = EventType.objects.create(name='Fun')
+        self.event_req = EventCandidateRequirement.objects.create(
+            event_type=event_type, credits_needed=2, term=self.term)
+        event = Event.objects.create(
+            name='Fun Event', event_type=event_type,
+            start_datetime=timezone.now(), end_datetime=timezone.now(),
+            term=self.term, location='A test location', contact=self.user)
+        EventAttendance.objects.create(event=event, user=self.user)
+
+    def test_verify(self):
+        self.assertEqual(verify_progress_records(self.term), [])
+
+        record = CandidateProgressRecord.objects.get(
+            candidate=self.candidate, requirement=self.event_req)
+        self.assertEqual(record.completed, 1)
+        record.completed = 2
+        record.save()
+        self.assertEqual(len(verify_progress_records(self.term)), 1)
+        record.delete()
+        self.assertEqual(len(verify_progress_records(self.term)), 1)
+
+    def test_rebuild(self):
+        CandidateProgressRecord.objects.all().delete()
+        self.assertEqual(rebuild_progress_records(self.term), 1)
+        self.assertEqual(verify_progress_records(self.term), [])
+        record = CandidateProgressRecord.objects.get(
+            candidate=self.candidate, requirement=self.event_req)
+        self.assertEqual((record.completed, record.required), (1, 2))
+
+    def test_command(self):
+        CandidateProgressRecord.objects.filter(
+            candidate=self.candidate).update(completed=5)
+        self.assertRaises(CommandError, call_command,
+                          'rebuildcandidateprogress', verify_only=True,
+                          verbosity=0)
+        call_command('rebuildcandidateprogress', verbosity=0)
+        call_command('rebuildcandidateprogress', term='sp2012',
+                     verify_only=True, verbosity=0)
+        self.assertRaises(CommandError, call_command,
+                          'rebuildcandidateprogress', term='sp1900',
+                          verbosity=0)
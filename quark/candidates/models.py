@@ -1,15 +1,20 @@
 import os
 
 from django.conf import settings
-from django.contrib.auth.models import Group
 from django.db import models
 from django.db.models import Sum
 
 from quark.base.models import Term
+from quark.base.models import add_user_to_groups
+from quark.base.models import remove_user_from_groups
+from quark.base.registry import group_registry
 from quark.events.models import Event
+from quark.events.models import EventAttendance
 from quark.events.models import EventType
 from quark.exams.models import Exam
+from quark.exams.models import InstructorPermission
 from quark.resumes.models import Resume
+from quark.shortcuts import disable_for_loaddata
 
 
 class Candidate(models.Model):
@@ -60,43 +65,29 @@ class Candidate(models.Model):
         for all requirements. If requirement is specified, only progress for
         the specific requirement type is returned.
 
-        Useful for summary info, progress bars, and other visualizations.
+        Useful for summary info, progress bars, and other visualizations. To
+        get progress for several requirement types, use CandidateProgress
+        instead.
         """
-        if requirement_type is None:
-            requirements = CandidateRequirement.objects.filter(term=self.term)
-        else:
-            requirements = CandidateRequirement.objects.filter(
-                term=self.term, requirement_type=requirement_type)
-
-        # Select-related to improve performance, fetching data for requirements
-        # from multiple tables
-        requirements.select_related(
-            'eventcandidaterequirement',
-            'eventcandidaterequirement__event_type',
-            'challengecandidaterequirement',
-            'challengecandidaterequirement__challenge_type',
-            'examfilecandidaterequirement')
-
-        # TODO(sjdemartini): Figure out a way to optimize fetching the progress
-        # for event requirements and fetching CandidateRequirementProgress
-        # objects in order to minimize number of queries
-
-        progress = [req.get_progress(self) for req in requirements]
-        completed = sum([x['completed'] for x in progress])
-        required = sum([x['required'] for x in progress])
-        return {'completed': completed, 'required': required}
+        # Avoid circular dependency by importing here:
+        from quark.candidates.progress import CandidateProgress
+        from quark.candidates.progress import get_requirements
+
+        requirements = get_requirements(self.term)
+        if requirement_type is not None:
+            requirements = requirements.filter(
+                requirement_type=requirement_type)
+        return CandidateProgress(self, requirements).get_total()
 
     def are_electives_required(self):
         """Return true if elective events are required; false otherwise."""
-        event_reqs = CandidateRequirement.objects.filter(
-            term=self.term,
+        # Avoid circular dependency by importing here:
+        from quark.candidates.progress import CandidateProgress
+        from quark.candidates.progress import get_requirements
+
+        requirements = get_requirements(self.term).filter(
             requirement_type=CandidateRequirement.EVENT)
-        try:
-            elective_req = event_reqs.get(
-                eventcandidaterequirement__event_type__name='Elective')
-        except self.DoesNotExist:
-            return False
-        return elective_req.get_progress(self)['required'] > 0
+        return CandidateProgress(self, requirements).are_electives_required()
 
     def __unicode__(self):
         return '{user} ({term})'.format(user=self.user, term=self.term)
@@ -130,23 +121,24 @@ def candidate_post_save(sender, instance, created, **kwargs):
     student_org_profile, _ = StudentOrgUserProfile.objects.get_or_create(
         user=instance.user)
 
-    candidate_group = Group.objects.get(name='Current Candidate')
-    member_group = Group.objects.get(name='Member')
+    group_pks = group_registry.get_pks(['Current Candidate', 'Member'])
+    candidate_group_pk = group_pks['Current Candidate']
+    member_group_pk = group_pks['Member']
 
     if instance.initiated:
         student_org_profile.initiation_term = instance.term
         student_org_profile.save()
-        instance.user.groups.add(member_group)
-        instance.user.groups.remove(candidate_group)
+        add_user_to_groups(instance.user_id, [member_group_pk])
+        remove_user_from_groups(instance.user_id, [candidate_group_pk])
     else:
         if student_org_profile.initiation_term == instance.term:
             student_org_profile.initiation_term = None
             student_org_profile.save()
-        instance.user.groups.remove(member_group)
+        remove_user_from_groups(instance.user_id, [member_group_pk])
         if instance.term == Term.objects.get_current_term():
-            instance.user.groups.add(candidate_group)
+            add_user_to_groups(instance.user_id, [candidate_group_pk])
         else:
-            instance.user.groups.remove(candidate_group)
+            remove_user_from_groups(instance.user_id, [candidate_group_pk])
 
 models.signals.post_save.connect(candidate_post_save, sender=Candidate)
 
@@ -236,36 +228,14 @@ class CandidateRequirement(models.Model):
         """Return a dictionary with keys "completed" and "required", which
         map to the number of completed requirements and the number that were
         required, respectively, for the given candidate.
-        """
-        required = self.credits_needed
-
-        if self.requirement_type == CandidateRequirement.EVENT:
-            completed = self.eventcandidaterequirement.get_completed(candidate)
-        elif self.requirement_type == CandidateRequirement.CHALLENGE:
-            completed = self.challengecandidaterequirement.get_completed(
-                candidate)
-        elif self.requirement_type == CandidateRequirement.EXAM_FILE:
-            completed = self.examfilecandidaterequirement.get_completed(
-                candidate)
-        elif self.requirement_type == CandidateRequirement.RESUME:
-            completed = self.resumecandidaterequirement.get_completed(candidate)
-        elif self.requirement_type == CandidateRequirement.MANUAL:
-            # Actual credits earned is read from CandidateProgress below
-            completed = 0
-        else:
-            raise NotImplementedError(
-                'Unknown type {}'.format(self.requirement_type))
 
-        # Check per-candidate overrides and exemptions
-        try:
-            progress = CandidateRequirementProgress.objects.get(
-                candidate=candidate, requirement=self)
-            completed += progress.manually_recorded_credits
-            required = progress.alternate_credits_needed
-        except CandidateRequirementProgress.DoesNotExist:
-            pass
+        To get progress for several requirements, use CandidateProgress
+        instead.
+        """
+        # Avoid circular dependency by importing here:
+        from quark.candidates.progress import CandidateProgress
 
-        return {'completed': completed, 'required': required}
+        return CandidateProgress(candidate, [self]).get(self)
 
     def get_name(self):
         """Return a name for the requirement based on the requirement type."""
@@ -412,3 +382,181 @@ class CandidateRequirementProgress(models.Model):
     class Meta(object):
         ordering = ('requirement', 'candidate')
         verbose_name_plural = 'candidate requirement progresses'
+
+
+class CandidateProgressRecord(models.Model):
+    """The stored progress of one candidate towards one requirement, as
+    computed by quark.candidates.progress.CandidateProgress (i.e., including
+    the adjustments in CandidateRequirementProgress).
+
+    Records are kept up to date by the signal handlers below whenever anything
+    that progress depends on changes, so that progress can be read with a
+    single query. The rebuildcandidateprogress management command recreates
+    the records from scratch and verifies them.
+    """
+    candidate = models.ForeignKey(Candidate)
+    requirement = models.ForeignKey(CandidateRequirement)
+    completed = models.IntegerField(default=0)
+    required = models.IntegerField(default=0)
+
+    updated = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return '{candidate}: {completed}/{required} for {req}'.format(
+            candidate=self.candidate, completed=self.completed,
+            required=self.required, req=self.requirement)
+
+    class Meta(object):
+        unique_together = ('candidate', 'requirement')
+
+
+def _update_progress(candidates, create=True, **kwargs):
+    """Update the CandidateProgressRecords of the given candidates for the
+    requirements matching the given filter keyword arguments.
+
+    If create is False, missing records are not created. Handlers for delete
+    signals must not create records, since the delete may be cascading from
+    the candidate or the requirement.
+    """
+    # Avoid circular dependency by importing here:
+    from quark.candidates.progress import update_progress_records
+
+    update_progress_records(candidates, create=create, **kwargs)
+
+
+@disable_for_loaddata
+def candidate_progress_post_save(sender, instance, created, **kwargs):
+    """Create the progress records of a new candidate."""
+    if created:
+        _update_progress([instance])
+
+
+@disable_for_loaddata
+def requirement_post_save(sender, instance, **kwargs):
+    """Update the progress of all candidates in the term towards a requirement
+    that was created or changed.
+    """
+    _update_progress(
+        Candidate.objects.filter(term=instance.term_id), pk=instance.pk)
+
+
+@disable_for_loaddata
+def event_post_save(sender, instance, created, **kwargs):
+    """Update the progress of the candidates who attended an event whose type
+    or credit may have changed, in both the event's old and new terms (in case
+    the event was moved to another term).
+    """
+    if not created:
+        term_pks = set([instance.term_id])
+        # The event's old fields are remembered by
+        # quark.events.models.event_pre_save
+        old_fields = getattr(instance, 'old_fields', None)
+        if old_fields is not None:
+            term_pks.add(old_fields['term'])
+        _update_progress(
+            Candidate.objects.filter(
+                term__in=term_pks,
+                user__eventattendance__event=instance).distinct(),
+            requirement_type=CandidateRequirement.EVENT)
+
+
+@disable_for_loaddata
+def instructor_permission_post_save(sender, instance, **kwargs):
+    """Update the progress of the submitters of an instructor's exams, since
+    a change in permission may blacklist the exams without saving each one
+    (see quark.exams.models.update_exam_blacklist).
+    """
+    _update_progress(
+        Candidate.objects.filter(
+            user__exam__course_instance__instructors=instance.instructor_id
+        ).distinct(),
+        requirement_type=CandidateRequirement.EXAM_FILE)
+
+
+# The following handlers are used for both post_save and post_delete signals.
+# They ignore saves while loading fixtures, like disable_for_loaddata.
+
+def update_requirement_progress(sender, instance, signal, **kwargs):
+    """Update the progress of a candidate towards a requirement when its
+    CandidateRequirementProgress (manual adjustments) changes.
+    """
+    if not kwargs.get('raw'):
+        _update_progress([instance.candidate],
+                         create=signal == models.signals.post_save,
+                         pk=instance.requirement_id)
+
+
+def update_attendance_progress(sender, instance, signal, **kwargs):
+    """Update the progress of the attendee towards requirements for the type of
+    event attended.
+    """
+    if not kwargs.get('raw'):
+        _update_progress(
+            Candidate.objects.filter(user=instance.user_id,
+                                     term=instance.event.term_id),
+            create=signal == models.signals.post_save,
+            eventcandidaterequirement__event_type=instance.event.event_type_id)
+
+
+def update_challenge_progress(sender, instance, signal, **kwargs):
+    """Update the progress of a candidate towards requirements for the type of
+    challenge, which count only verified challenges.
+    """
+    if not kwargs.get('raw'):
+        _update_progress(
+            [instance.candidate],
+            create=signal == models.signals.post_save,
+            challengecandidaterequirement__challenge_type=(
+                instance.challenge_type_id))
+
+
+def update_exam_progress(sender, instance, signal, **kwargs):
+    """Update the progress of the submitter of an exam, since the exam may
+    have been approved or unapproved.
+    """
+    if not kwargs.get('raw') and instance.submitter_id is not None:
+        _update_progress(
+            Candidate.objects.filter(user=instance.submitter_id),
+            create=signal == models.signals.post_save,
+            requirement_type=CandidateRequirement.EXAM_FILE)
+
+
+def update_resume_progress(sender, instance, signal, **kwargs):
+    """Update the progress of the owner of a resume, which counts only if it
+    is verified.
+    """
+    if not kwargs.get('raw'):
+        _update_progress(
+            Candidate.objects.filter(user=instance.user_id),
+            create=signal == models.signals.post_save,
+            requirement_type=CandidateRequirement.RESUME)
+
+
+models.signals.post_save.connect(candidate_progress_post_save, sender=Candidate)
+models.signals.post_save.connect(requirement_post_save,
+                                 sender=EventCandidateRequirement)
+models.signals.post_save.connect(requirement_post_save,
+                                 sender=ChallengeCandidateRequirement)
+models.signals.post_save.connect(requirement_post_save,
+                                 sender=ExamFileCandidateRequirement)
+models.signals.post_save.connect(requirement_post_save,
+                                 sender=ResumeCandidateRequirement)
+models.signals.post_save.connect(requirement_post_save,
+                                 sender=ManualCandidateRequirement)
+models.signals.post_save.connect(event_post_save, sender=Event)
+models.signals.post_save.connect(instructor_permission_post_save,
+                                 sender=InstructorPermission)
+models.signals.post_save.connect(update_requirement_progress,
+                                 sender=CandidateRequirementProgress)
+models.signals.post_delete.connect(update_requirement_progress,
+                                   sender=CandidateRequirementProgress)
+models.signals.post_save.connect(update_attendance_progress,
+                                 sender=EventAttendance)
+models.signals.post_delete.connect(update_attendance_progress,
+                                   sender=EventAttendance)
+models.signals.post_save.connect(update_challenge_progress, sender=Challenge)
+models.signals.post_delete.connect(update_challenge_progress, sender=Challenge)
+models.signals.post_save.connect(update_exam_progress, sender=Exam)
+models.signals.post_delete.connect(update_exam_progress, sender=Exam)
+models.signals.post_save.connect(update_resume_progress, sender=Resume)
+models.signals.post_delete.connect(update_resume_progress, sender=Resume)
@@ -0,0 +1,410 @@
+from collections import defaultdict
+
+from django.db import IntegrityError
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import Sum
+
+from quark.candidates.models import Candidate
+from quark.candidates.models import CandidateProgressRecord
+from quark.candidates.models import CandidateRequirement
+from quark.candidates.models import CandidateRequirementProgress
+from quark.candidates.models import Challenge
+from quark.events.models import Event
+from quark.events.models import EventAttendance
+from quark.exams.models import Exam
+from quark.resumes.models import Resume
+
+
+def get_requirements(term):
+    """Return the requirements for the given term, along with the data from
+    the requirement subclasses needed to compute progress and names.
+    """
+    return CandidateRequirement.objects.filter(term=term).select_related(
+        'eventcandidaterequirement__event_type',
+        'challengecandidaterequirement__challenge_type',
+        'examfilecandidaterequirement',
+        'resumecandidaterequirement',
+        'manualcandidaterequirement')
+
+
+class EarnedCredits(object):
+    """The credits a candidate has earned automatically (i.e., not counting
+    manually recorded credits), by kind of requirement.
+    """
+    def __init__(self):
+        # Map from event type id to credits earned by attending events:
+        self.events = {}
+        # Map from challenge type id to number of verified challenges:
+        self.challenges = {}
+        self.exams = 0
+        self.resumes = 0
+
+
+class CandidateProgress(object):
+    """The progress of one candidate towards the requirements of the
+    candidate's term.
+
+    All progress is computed up front with a small, fixed number of queries,
+    regardless of the number of requirements: one for the requirements
+    (unless they are given), one for the candidate's
+    CandidateRequirementProgress objects, and one for each kind of
+    automatically counted requirement present (event credits grouped by event
+    type, verified challenges grouped by challenge type, approved exams and
+    verified resumes).
+
+    If earned (an EarnedCredits object) and requirement_progresses (a
+    dictionary mapping requirement id to CandidateRequirementProgress) are
+    given, as they are by CandidateProgressMatrix, no queries are made.
+    """
+    def __init__(self, candidate, requirements=None, earned=None,
+                 requirement_progresses=None):
+        self.candidate = candidate
+        if requirements is None:
+            requirements = get_requirements(candidate.term_id)
+        self.requirements = list(requirements)
+
+        # Map from requirement id to CandidateRequirementProgress object
+        if requirement_progresses is None:
+            requirement_progresses = dict(
+                [(progress.requirement_id, progress) for progress in
+                 CandidateRequirementProgress.objects.filter(
+                     candidate=candidate)])
+        self.requirement_progresses = requirement_progresses
+
+        if earned is None:
+            earned = self._get_earned_credits()
+        self.earned = earned
+
+        # Map from requirement id to progress dictionary
+        self.progress = {}
+        for req in self.requirements:
+            completed = self._get_completed(req)
+            required = req.credits_needed
+
+            # Check per-candidate overrides and exemptions
+            progress = self.requirement_progresses.get(req.pk)
+            if progress:
+                completed += progress.manually_recorded_credits
+                required = progress.alternate_credits_needed
+
+            self.progress[req.pk] = {'completed': completed,
+                                     'required': required}
+
+    def _get_earned_credits(self):
+        """Return the EarnedCredits for the candidate, only querying for the
+        kinds of requirements that are present.
+        """
+        candidate = self.candidate
+        req_types = set([req.requirement_type for req in self.requirements])
+        earned = EarnedCredits()
+        if CandidateRequirement.EVENT in req_types:
+            # Clear the default ordering, which would be added to the GROUP BY
+            earned.events = dict(Event.objects.filter(
+                eventattendance__user=candidate.user_id,
+                term=candidate.term_id).order_by().values_list(
+                'event_type').annotate(Sum('requirements_credit')))
+        if CandidateRequirement.CHALLENGE in req_types:
+            earned.challenges = dict(Challenge.objects.filter(
+                candidate=candidate, verified=True).order_by().values_list(
+                'challenge_type').annotate(Count('id')))
+        if CandidateRequirement.EXAM_FILE in req_types:
+            earned.exams = Exam.objects.get_approved().filter(
+                submitter=candidate.user_id).count()
+        if CandidateRequirement.RESUME in req_types:
+            earned.resumes = Resume.objects.filter(
+                user=candidate.user_id, verified=True).count()
+        return earned
+
+    def _get_completed(self, req):
+        """Return the number of credits completed for the requirement, not
+        including manually recorded credits.
+        """
+        if req.requirement_type == CandidateRequirement.EVENT:
+            return self.earned.events.get(
+                req.eventcandidaterequirement.event_type_id, 0)
+        elif req.requirement_type == CandidateRequirement.CHALLENGE:
+            return self.earned.challenges.get(
+                req.challengecandidaterequirement.challenge_type_id, 0)
+        elif req.requirement_type == CandidateRequirement.EXAM_FILE:
+            return self.earned.exams
+        elif req.requirement_type == CandidateRequirement.RESUME:
+            return self.earned.resumes
+        elif req.requirement_type == CandidateRequirement.MANUAL:
+            # Actual credits earned is read from CandidateRequirementProgress
+            return 0
+        else:
+            raise NotImplementedError(
+                'Unknown type {}'.format(req.requirement_type))
+
+    def get(self, requirement):
+        """Return a dictionary with keys "completed" and "required" for the
+        given requirement, like CandidateRequirement.get_progress.
+        """
+        return self.progress[requirement.pk]
+
+    def get_requirement_progress(self, requirement):
+        """Return the candidate's CandidateRequirementProgress object for the
+        given requirement, or None if there is none.
+        """
+        return self.requirement_progresses.get(requirement.pk)
+
+    def get_total(self, requirement_type=None):
+        """Return a dictionary with keys "completed" and "required", summed
+        over all requirements, or over the requirements of the given type.
+        """
+        progress = [self.progress[req.pk] for req in self.requirements
+                    if requirement_type is None or
+                    req.requirement_type == requirement_type]
+        return {'completed': sum([x['completed'] for x in progress]),
+                'required': sum([x['required'] for x in progress])}
+
+    def get_elective_requirement(self):
+        """Return the event requirement for elective events, or None if there
+        is no such requirement.
+        """
+        for req in self.requirements:
+            if (req.requirement_type == CandidateRequirement.EVENT and
+                    req.eventcandidaterequirement.event_type.name ==
+                    'Elective'):
+                return req
+        return None
+
+    def are_electives_required(self):
+        """Return true if elective events are required; false otherwise."""
+        elective_req = self.get_elective_requirement()
+        return elective_req is not None and self.get(elective_req)[
+            'required'] > 0
+
+
+class StoredCandidateProgress(CandidateProgress):
+    """The progress of one candidate, read from the candidate's
+    CandidateProgressRecord objects with one query (plus one for the
+    requirements, unless they are given) rather than computed.
+
+    Progress towards any requirement without a record is computed instead.
+    The candidate's CandidateRequirementProgress objects are only fetched if
+    get_requirement_progress is called.
+    """
+    # pylint: disable=W0231
+    def __init__(self, candidate, requirements=None, records=None):
+        self.candidate = candidate
+        if requirements is None:
+            requirements = get_requirements(candidate.term_id)
+        self.requirements = list(requirements)
+        self.requirement_progresses = None
+
+        if records is None:
+            records = CandidateProgressRecord.objects.filter(
+                candidate=candidate)
+        self.progress = dict(
+            [(record.requirement_id, {'completed': record.completed,
+                                      'required': record.required})
+             for record in records])
+
+        missing = [req for req in self.requirements
+                   if req.pk not in self.progress]
+        if missing:
+            self.progress.update(
+                CandidateProgress(candidate, missing).progress)
+
+    def get_requirement_progress(self, requirement):
+        if self.requirement_progresses is None:
+            self.requirement_progresses = dict(
+                [(progress.requirement_id, progress) for progress in
+                 CandidateRequirementProgress.objects.filter(
+                     candidate=self.candidate)])
+        return super(StoredCandidateProgress, self).get_requirement_progress(
+            requirement)
+
+
+class CandidateProgressMatrix(object):
+    """The progress of every candidate in a term towards every requirement of
+    the term.
+
+    The number of queries does not depend on the number of candidates or
+    requirements: the requirements, the candidates (unless they are given),
+    all CandidateRequirementProgress objects for the term, and the credits
+    earned through events, challenges, exams and resumes, each grouped by
+    candidate, are fetched with one query each.
+
+    Iterating over the matrix yields a (candidate, CandidateProgress) tuple
+    for each candidate.
+
+    If stored is True, progress is read from the CandidateProgressRecords of
+    the candidates with one query instead (see StoredCandidateProgress).
+    """
+    def __init__(self, term, candidates=None, requirements=None,
+                 stored=False):
+        self.term = term
+        if requirements is None:
+            requirements = get_requirements(term)
+        self.requirements = list(requirements)
+        if candidates is None:
+            candidates = Candidate.objects.filter(term=term).select_related(
+                'user')
+        self.candidates = list(candidates)
+
+        # Map from candidate id to CandidateProgress
+        if stored:
+            self.progress = self._get_stored_progress()
+        else:
+            self.progress = self._get_computed_progress()
+
+    def _get_stored_progress(self):
+        # Map from candidate id to list of CandidateProgressRecords
+        records = dict([(candidate.pk, []) for candidate in self.candidates])
+        for record in CandidateProgressRecord.objects.filter(
+                candidate__term=self.term,
+                requirement__in=self.requirements):
+            if record.candidate_id in records:
+                records[record.candidate_id].append(record)
+        return dict(
+            [(candidate.pk, StoredCandidateProgress(
+                candidate, self.requirements, records[candidate.pk]))
+             for candidate in self.candidates])
+
+    def _get_computed_progress(self):
+        # Map from candidate id to EarnedCredits
+        earned = self._get_earned_credits()
+
+        # Map from candidate id to a map from requirement id to
+        # CandidateRequirementProgress object
+        requirement_progresses = dict(
+            [(candidate.pk, {}) for candidate in self.candidates])
+        for progress in CandidateRequirementProgress.objects.filter(
+                candidate__term=self.term):
+            if progress.candidate_id in requirement_progresses:
+                requirement_progresses[progress.candidate_id][
+                    progress.requirement_id] = progress
+
+        return dict(
+            [(candidate.pk, CandidateProgress(
+                candidate, self.requirements, earned[candidate.pk],
+                requirement_progresses[candidate.pk]))
+             for candidate in self.candidates])
+
+    def _get_earned_credits(self):
+        """Return a dictionary mapping candidate id to the EarnedCredits for
+        that candidate, with one grouped query for each kind of automatically
+        counted requirement present.
+        """
+        term = self.term
+        earned = dict([(candidate.pk, EarnedCredits())
+                       for candidate in self.candidates])
+        # Map from user id to candidate id
+        user_candidates = dict([(candidate.user_id, candidate.pk)
+                                for candidate in self.candidates])
+
+        req_types = set([req.requirement_type for req in self.requirements])
+        if CandidateRequirement.EVENT in req_types:
+            attendances = EventAttendance.objects.filter(
+                event__term=term, user__candidate__term=term).order_by(
+                ).values_list('user', 'event__event_type').annotate(
+                Sum('event__requirements_credit'))
+            for user_id, event_type_id, total in attendances:
+                if user_id in user_candidates:
+                    earned[user_candidates[user_id]].events[
+                        event_type_id] = total
+        if CandidateRequirement.CHALLENGE in req_types:
+            challenges = Challenge.objects.filter(
+                candidate__term=term, verified=True).order_by().values_list(
+                'candidate', 'challenge_type').annotate(Count('id'))
+            for candidate_id, challenge_type_id, count in challenges:
+                if candidate_id in earned:
+                    earned[candidate_id].challenges[challenge_type_id] = count
+        if CandidateRequirement.EXAM_FILE in req_types:
+            exams = Exam.objects.get_approved().filter(
+                submitter__candidate__term=term).order_by().values_list(
+                'submitter').annotate(Count('id'))
+            for user_id, count in exams:
+                if user_id in user_candidates:
+                    earned[user_candidates[user_id]].exams = count
+        if CandidateRequirement.RESUME in req_types:
+            resumes = Resume.objects.filter(
+                user__candidate__term=term, verified=True).order_by(
+                ).values_list('user').annotate(Count('id'))
+            for user_id, count in resumes:
+                if user_id in user_candidates:
+                    earned[user_candidates[user_id]].resumes = count
+        return earned
+
+    def __iter__(self):
+        for candidate in self.candidates:
+            yield candidate, self.progress[candidate.pk]
+
+    def get(self, candidate):
+        """Return the CandidateProgress for the given candidate."""
+        return self.progress[candidate.pk]
+
+
+def save_progress_records(progresses, create=True):
+    """Store the progress in the given CandidateProgress objects as
+    CandidateProgressRecords, replacing any existing records.
+
+    If create is False, only existing records are updated, with one query for
+    the records and one update for each distinct progress value.
+    """
+    progresses = list(progresses)
+    candidate_pks = set([progress.candidate.pk for progress in progresses])
+    requirement_pks = set([req.pk for progress in progresses
+                           for req in progress.requirements])
+    if not create:
+        new_progress = dict(
+            ((progress.candidate.pk, req.pk), progress.get(req))
+            for progress in progresses for req in progress.requirements)
+        if not new_progress:
+            return
+        with transaction.atomic():
+            records = CandidateProgressRecord.objects.filter(
+                candidate__in=candidate_pks,
+                requirement__in=requirement_pks).values_list(
+                'pk', 'candidate', 'requirement')
+            # Group the records by their new progress, so that records with
+            # the same progress are updated together
+            record_pks = defaultdict(list)
+            for pk, candidate_pk, requirement_pk in records:
+                progress = new_progress.get((candidate_pk, requirement_pk))
+                if progress is not None:
+                    record_pks[tuple(sorted(progress.items()))].append(pk)
+            for progress, pks in record_pks.iteritems():
+                CandidateProgressRecord.objects.filter(pk__in=pks).update(
+                    **dict(progress))
+        return
+
+    records = [CandidateProgressRecord(
+        candidate=progress.candidate, requirement=req, **progress.get(req))
+        for progress in progresses for req in progress.requirements]
+    if not records:
+        return
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                # Every candidate's requirements are in the candidate's term,
+                # so this only deletes the records that are replaced
+                CandidateProgressRecord.objects.filter(
+                    candidate__in=candidate_pks,
+                    requirement__in=requirement_pks).delete()
+                CandidateProgressRecord.objects.bulk_create(records)
+            return
+        except IntegrityError:  # pylint: disable=E0712
+            # Another process inserted some of the records between the delete
+            # and the insert. Try once more, replacing its records as well.
+            if attempt > 0:
+                raise
+
+
+def update_progress_records(candidates, create=True, **kwargs):
+    """Recompute and store the progress of the given candidates towards the
+    requirements of their terms that match the given filter keyword arguments
+    (for CandidateRequirement.objects.filter).
+
+    If create is False, only existing records are updated.
+    """
+    progresses = []
+    for candidate in candidates:
+        requirements = list(get_requirements(candidate.term_id).filter(
+            **kwargs))
+        if requirements:
+            progresses.append(CandidateProgress(candidate, requirements))
+    save_progress_records(progresses, create=create)
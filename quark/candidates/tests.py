@@ -3,16 +3,21 @@ import shutil
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.contrib.auth.models import Permission
 from django.conf import settings
 from django.core.files import File
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError
 from django.test import TestCase
 from django.test.utils import override_settings
 from django.utils import timezone
+from mock import patch
 
 from quark.base.models import Officer
 from quark.base.models import OfficerPosition
 from quark.base.models import Term
 from quark.candidates.models import Candidate
+from quark.candidates.models import CandidateProgressRecord
 from quark.candidates.models import CandidateRequirement
 from quark.candidates.models import CandidateRequirementProgress
 from quark.candidates.models import Challenge
@@ -21,11 +26,17 @@ from quark.candidates.models import ChallengeType
 from quark.candidates.models import EventCandidateRequirement
 from quark.candidates.models import ExamFileCandidateRequirement
 from quark.candidates.models import ManualCandidateRequirement
+from quark.candidates.models import ResumeCandidateRequirement
+from quark.candidates.progress import CandidateProgress
+from quark.candidates.progress import CandidateProgressMatrix
+from quark.candidates.progress import StoredCandidateProgress
+from quark.candidates.progress import save_progress_records
 from quark.courses.models import CourseInstance
 from quark.events.models import Event
 from quark.events.models import EventAttendance
 from quark.events.models import EventType
 from quark.exams.models import Exam
+from quark.resumes.models import Resume
 from quark.shortcuts import get_object_or_none
 from quark.user_profiles.models import StudentOrgUserProfile
 
@@ -326,3 +337,312 @@ class CandidateTest(TestCase):
         progress = self.candidate.get_progress()
         self.assertEqual(progress['required'], num_required)
         self.assertEqual(progress['completed'], total_completed)
+
+    def test_candidate_progress(self):
+        """Test that CandidateProgress matches the progress of each
+        requirement, using one query for each kind of requirement.
+        """
+        EventAttendance(event=self.fun_event2, user=self.user).save()
+        EventAttendance(event=self.notfun_event, user=self.user).save()
+        Challenge(candidate=self.candidate, description='Hello kitty',
+                  verifying_user=self.officer.user,
+                  verified=True,
+                  challenge_type=self.individual_challenge_type).save()
+        self.test_exam1.submitter = self.user
+        self.test_exam1.save()
+        CandidateRequirementProgress(
+            candidate=self.candidate,
+            requirement=self.manual_req1,
+            manually_recorded_credits=1,
+            alternate_credits_needed=3).save()
+
+        # Queries for requirements, CandidateRequirementProgress objects,
+        # events, challenges and exams
+        with self.assertNumQueries(5):
+            progress = CandidateProgress(self.candidate)
+            for requirement in progress.requirements:
+                progress.get(requirement)
+        self.assertEqual(progress.get(self.event_req),
+                         {'completed': 2, 'required': 4})
+        self.assertEqual(progress.get(self.challenge_req),
+                         {'completed': 1, 'required': 3})
+        self.assertEqual(progress.get(self.exam_req),
+                         {'completed': 1, 'required': 2})
+        self.assertEqual(progress.get(self.manual_req1),
+                         {'completed': 1, 'required': 3})
+        for requirement in progress.requirements:
+            self.assertEqual(progress.get(requirement),
+                             requirement.get_progress(self.candidate))
+        self.assertEqual(progress.get_total(), self.candidate.get_progress())
+        self.assertEqual(progress.get_total(CandidateRequirement.MANUAL),
+                         {'completed': 1, 'required': 8})
+
+    def test_candidate_progress_matrix(self):
+        """Test that CandidateProgressMatrix matches CandidateProgress for
+        every candidate, using a number of queries that does not depend on the
+        number of candidates.
+        """
+        EventAttendance(event=self.fun_event2, user=self.user).save()
+        Challenge(candidate=self.candidate, description='Hello kitty',
+                  verifying_user=self.officer.user,
+                  verified=True,
+                  challenge_type=self.individual_challenge_type).save()
+        self.test_exam1.submitter = self.user
+        self.test_exam1.save()
+        CandidateRequirementProgress(
+            candidate=self.candidate,
+            requirement=self.manual_req1,
+            manually_recorded_credits=1,
+            alternate_credits_needed=3).save()
+
+        # Queries for requirements, candidates, CandidateRequirementProgress
+        # objects, events, challenges and exams
+        with self.assertNumQueries(6):
+            CandidateProgressMatrix(self.term)
+
+        # Add more candidates with some progress
+        user_model = get_user_model()
+        for i in range(5):
+            user = user_model.objects.create_user(
+                username='candidate{}'.format(i),
+                email='candidate{}@tbp.berkeley.edu'.format(i),
+                password='password',
+                first_name='Candidate',
+                last_name=str(i))
+            candidate = Candidate.objects.create(user=user, term=self.term)
+            EventAttendance(event=self.fun_event1, user=user).save()
+            if i % 2:
+                EventAttendance(event=self.notfun_event, user=user).save()
+                CandidateRequirementProgress(
+                    candidate=candidate,
+                    requirement=self.event_req,
+                    manually_recorded_credits=i).save()
+
+        # A candidate in another term does not appear in the matrix
+        other_term = Term.objects.create(term=Term.FALL, year=2012)
+        other_candidate = Candidate.objects.create(
+            user=self.officer.user, term=other_term)
+        EventAttendance(event=self.fun_event1, user=self.officer.user).save()
+
+        with self.assertNumQueries(6):
+            matrix = CandidateProgressMatrix(self.term)
+        self.assertEqual(len(matrix.candidates), 6)
+        self.assertNotIn(other_candidate, matrix.candidates)
+        for candidate, progress in matrix:
+            expected = CandidateProgress(candidate)
+            for requirement in matrix.requirements:
+                self.assertEqual(progress.get(requirement),
+                                 expected.get(requirement))
+            self.assertEqual(progress.get_total(), candidate.get_progress())
+        self.assertEqual(matrix.get(self.candidate).get(self.event_req),
+                         {'completed': 2, 'required': 4})
+
+    def test_candidate_progress_csv(self):
+        EventAttendance(event=self.fun_event2, user=self.user).save()
+        self.officer.user.user_permissions.add(
+            Permission.objects.get(codename='change_candidate'))
+        self.assertTrue(self.client.login(
+            username='officer', password='password'))
+        response = self.client.get(reverse('candidates:progress-csv'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = ''.join(
+            response.streaming_content).splitlines()  # pylint: disable=E1103
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[0].startswith(
+            'First Name,Last Name,Username,Email,Initiated'))
+        self.assertIn('Event: Fun Completed,Event: Fun Required', rows[0])
+        self.assertTrue(rows[1].startswith(
+            'Random,Candidate,luser,test@tbp.berkeley.edu,False'))
+
+    def assert_stored_progress_correct(self, candidate):
+        """Assert that the stored progress of the candidate matches the
+        computed progress, and that there is a record for every requirement.
+        """
+        computed = CandidateProgress(candidate)
+        self.assertEqual(
+            CandidateProgressRecord.objects.filter(
+                candidate=candidate).count(),
+            len(computed.requirements))
+        self.assertEqual(StoredCandidateProgress(candidate).progress,
+                         computed.progress)
+
+    def test_stored_progress(self):
+        """Test that the stored progress is updated by every change that
+        affects progress.
+        """
+        self.assert_stored_progress_correct(self.candidate)
+
+        # Events
+        attendance = EventAttendance(event=self.fun_event2, user=self.user)
+        attendance.save()
+        EventAttendance(event=self.notfun_event, user=self.user).save()
+        self.assert_stored_progress_correct(self.candidate)
+        self.fun_event2.requirements_credit = 3
+        self.fun_event2.save()
+        self.assert_stored_progress_correct(self.candidate)
+        # Moving an event to another term updates the old term's candidates
+        self.fun_event2.term = Term.objects.create(term=Term.FALL, year=2012)
+        self.fun_event2.save()
+        self.assert_stored_progress_correct(self.candidate)
+        self.fun_event2.term = self.term
+        self.fun_event2.save()
+        self.assert_stored_progress_correct(self.candidate)
+        attendance.delete()
+        self.assert_stored_progress_correct(self.candidate)
+
+        # Challenges
+        challenge = Challenge(
+            candidate=self.candidate, description='Hello kitty',
+            verifying_user=self.officer.user,
+            challenge_type=self.individual_challenge_type)
+        challenge.save()
+        challenge.verified = True
+        challenge.save()
+        self.assertEqual(
+            StoredCandidateProgress(self.candidate).get(self.challenge_req),
+            {'completed': 1, 'required': 3})
+        challenge.delete()
+        self.assert_stored_progress_correct(self.candidate)
+
+        # Exams
+        self.test_exam1.submitter = self.user
+        self.test_exam1.save()
+        self.assertEqual(
+            StoredCandidateProgress(self.candidate).get(self.exam_req),
+            {'completed': 1, 'required': 2})
+        self.test_exam1.verified = False
+        self.test_exam1.save()
+        self.assert_stored_progress_correct(self.candidate)
+
+        # Resumes
+        resume_req = ResumeCandidateRequirement(credits_needed=1,
+                                                term=self.term)
+        resume_req.save()
+        resume = Resume(user=self.user, gpa='3.500', full_text='Resume',
+                        resume_file='resumes/luser.pdf', verified=True)
+        resume.save()
+        self.assertEqual(
+            StoredCandidateProgress(self.candidate).get(resume_req),
+            {'completed': 1, 'required': 1})
+        resume.delete()
+        self.assert_stored_progress_correct(self.candidate)
+
+        # Manual adjustments
+        requirement_progress = CandidateRequirementProgress(
+            candidate=self.candidate,
+            requirement=self.event_req,
+            manually_recorded_credits=2,
+            alternate_credits_needed=5)
+        requirement_progress.save()
+        self.assertEqual(
+            StoredCandidateProgress(self.candidate).get(self.event_req),
+            {'completed': 2, 'required': 5})
+        requirement_progress.delete()
+        self.assert_stored_progress_correct(self.candidate)
+
+        # New candidates
+        user = get_user_model().objects.create_user(
+            username='newcandidate', email='new@tbp.berkeley.edu',
+            password='password', first_name='New', last_name='Candidate')
+        candidate = Candidate.objects.create(user=user, term=self.term)
+        self.assert_stored_progress_correct(candidate)
+
+        # Deleting requirements and candidates deletes their records
+        self.manual_req2.delete()
+        self.assert_stored_progress_correct(self.candidate)
+        candidate.delete()
+        self.assertFalse(CandidateProgressRecord.objects.filter(
+            candidate=candidate).exists())
+
+    def test_update_progress_records(self):
+        """Test that updating existing records takes one query for the
+        records and one update for each distinct progress value.
+        """
+        user = get_user_model().objects.create_user(
+            username='newcandidate', email='new@tbp.berkeley.edu',
+            password='password', first_name='New', last_name='Candidate')
+        candidate = Candidate.objects.create(user=user, term=self.term)
+        EventAttendance(event=self.fun_event2, user=self.user).save()
+        EventAttendance(event=self.fun_event2, user=user).save()
+        CandidateProgressRecord.objects.update(completed=0, required=0)
+
+        progresses = [CandidateProgress(self.candidate),
+                      CandidateProgress(candidate)]
+        num_values = len(set([
+            tuple(sorted(progress.get(req).items()))
+            for progress in progresses for req in progress.requirements]))
+        # The transaction adds a savepoint and its release
+        with self.assertNumQueries(3 + num_values):
+            save_progress_records(progresses, create=False)
+        self.assert_stored_progress_correct(self.candidate)
+        self.assert_stored_progress_correct(candidate)
+
+        # Missing records are not created
+        CandidateProgressRecord.objects.filter(candidate=candidate).delete()
+        save_progress_records(progresses, create=False)
+        self.assertFalse(CandidateProgressRecord.objects.filter(
+            candidate=candidate).exists())
+
+    def test_save_progress_records_conflict(self):
+        """Test that the records are replaced once more if another process
+        inserts some of them at the same time, and that a second conflict is
+        raised.
+        """
+        CandidateProgressRecord.objects.all().delete()
+        progresses = [CandidateProgress(self.candidate)]
+        bulk_create = CandidateProgressRecord.objects.bulk_create
+
+        calls = []
+
+        def insert_concurrently(records):
+            # Another process inserts one of the records the first time
+            calls.append(len(records))
+            if len(calls) == 1:
+                CandidateProgressRecord.objects.create(
+                    candidate=self.candidate, requirement=self.event_req)
+            return bulk_create(records)
+
+        with patch.object(CandidateProgressRecord.objects, 'bulk_create',
+                          side_effect=insert_concurrently):
+            save_progress_records(progresses)
+        self.assertEqual(len(calls), 2)
+        self.assert_stored_progress_correct(self.candidate)
+
+        with patch.object(CandidateProgressRecord.objects, 'bulk_create',
+                          side_effect=IntegrityError('Duplicate record')):
+            self.assertRaises(IntegrityError, save_progress_records,
+                              progresses)
+        self.assert_stored_progress_correct(self.candidate)
+
+    def test_stored_progress_matrix(self):
+        EventAttendance(event=self.fun_event2, user=self.user).save()
+        # Queries for requirements, candidates and stored progress
+        with self.assertNumQueries(3):
+            matrix = CandidateProgressMatrix(self.term, stored=True)
+        self.assertEqual(matrix.get(self.candidate).get(self.event_req),
+                         {'completed': 2, 'required': 4})
+
+        # Progress without a record is computed instead
+        CandidateProgressRecord.objects.all().delete()
+        matrix = CandidateProgressMatrix(self.term, stored=True)
+        self.assertEqual(matrix.get(self.candidate).get(self.event_req),
+                         {'completed': 2, 'required': 4})
+
+    def test_are_electives_required(self):
+        self.assertFalse(self.candidate.are_electives_required())
+        elective_req = EventCandidateRequirement(
+            event_type=EventType.objects.create(name='Elective'),
+            credits_needed=2,
+            term=self.term)
+        elective_req.save()
+        self.assertTrue(self.candidate.are_electives_required())
+        self.assertTrue(
+            CandidateProgress(self.candidate).are_electives_required())
+
+        # The candidate is exempt from elective events
+        CandidateRequirementProgress(
+            candidate=self.candidate,
+            requirement=elective_req,
+            alternate_credits_needed=0).save()
+        self.assertFalse(self.candidate.are_electives_required())
@@ -6,6 +6,7 @@ from quark.candidates.views import CandidateInitiationView
 from quark.candidates.views import CandidateListView
 from quark.candidates.views import CandidatePhotoView
 from quark.candidates.views import CandidatePortalView
+from quark.candidates.views import CandidateProgressCSVView
 from quark.candidates.views import CandidateRequirementsEditView
 from quark.candidates.views import ChallengeVerifyView
 from quark.candidates.views import ManualCandidateRequirementCreateView
@@ -15,6 +16,8 @@ from quark.candidates.views import update_candidate_initiation_status
 urlpatterns = patterns(
     '',
     url(r'^$', CandidateListView.as_view(), name='list'),
+    url(r'^progress\.csv$', CandidateProgressCSVView.as_view(),
+        name='progress-csv'),
     url(r'^(?P<candidate_pk>\d+)/$', CandidateEditView.as_view(),
         name='edit'),
     url(r'^(?P<candidate_pk>\d+)/photo$', CandidatePhotoView.as_view(),
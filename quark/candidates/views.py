@@ -1,16 +1,21 @@
+import csv
 import json
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.decorators import permission_required
 from django.core.urlresolvers import reverse
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.decorators import method_decorator
+from django.utils.encoding import smart_str
 from django.views.decorators.http import require_POST
 from django.views.generic import CreateView
 from django.views.generic import ListView
 from django.views.generic import UpdateView
+from django.views.generic import View
 from django.views.generic.base import ContextMixin
 from django.views.generic.edit import FormView
 
@@ -18,7 +23,6 @@ from quark.base.models import Term
 from quark.base.views import TermParameterMixin
 from quark.candidates.models import Candidate
 from quark.candidates.models import CandidateRequirement
-from quark.candidates.models import CandidateRequirementProgress
 from quark.candidates.models import Challenge
 from quark.candidates.models import ChallengeType
 from quark.candidates.models import ChallengeCandidateRequirement
@@ -32,10 +36,15 @@ from quark.candidates.forms import CandidateRequirementFormSet
 from quark.candidates.forms import ChallengeForm
 from quark.candidates.forms import ChallengeVerifyFormSet
 from quark.candidates.forms import ManualCandidateRequirementForm
+from quark.candidates.progress import CandidateProgress
+from quark.candidates.progress import CandidateProgressMatrix
+from quark.candidates.progress import StoredCandidateProgress
 from quark.events.models import EventAttendance
 from quark.events.models import EventSignUp
 from quark.events.models import EventType
 from quark.exams.models import Exam
+from quark.qldap.sync import mail_sync_errors
+from quark.qldap.sync import sync_user_ldap_groups
 from quark.shortcuts import get_object_or_none
 from quark.utils.ajax import json_response
 
@@ -44,6 +53,17 @@ class CandidateContextMixin(ContextMixin):
     """Mixin for getting the candidate, events, challenges, and exams for
     the context dictionary. Used in candidate management and candidate portal.
     """
+    candidate = None
+    candidate_progress = None
+
+    def get_candidate_progress(self):
+        """Return the CandidateProgress for the view's candidate, which is
+        computed only once per request.
+        """
+        if self.candidate_progress is None:
+            self.candidate_progress = CandidateProgress(self.candidate)
+        return self.candidate_progress
+
     def get_context_data(self, **kwargs):
         # pylint: disable=R0914
         context = super(CandidateContextMixin, self).get_context_data(**kwargs)
@@ -85,21 +105,15 @@ class CandidateContextMixin(ContextMixin):
             future_signed_up_events[
                 signup.event.event_type.name].append(signup.event)
 
-        event_reqs = CandidateRequirement.objects.filter(
-            term=candidate.term,
-            requirement_type=CandidateRequirement.EVENT)
-        try:
-            elective_req = event_reqs.get(
-                eventcandidaterequirement__event_type__name='Elective')
-        except CandidateRequirement.DoesNotExist:
-            elective_req = None
+        progress = self.get_candidate_progress()
 
         # If at least 1 elective event is required, extra events from other
         # event types will count as elective events.
-        if (elective_req and
-                elective_req.get_progress(self.candidate)['required'] > 0):
+        if progress.are_electives_required():
+            event_reqs = [req for req in progress.requirements if
+                          req.requirement_type == CandidateRequirement.EVENT]
             for event_req in event_reqs:
-                req_progress = event_req.get_progress(self.candidate)
+                req_progress = progress.get(event_req)
                 event_type = event_req.eventcandidaterequirement.event_type
                 extra = req_progress['completed'] - req_progress['required']
                 if extra > 0 and event_type.eligible_elective:
@@ -154,6 +168,81 @@ class CandidateListView(TermParameterMixin, ListView):
             'user__userprofile', 'user__collegestudentinfo').prefetch_related(
             'user__collegestudentinfo__major')
 
+    def get_context_data(self, **kwargs):
+        context = super(CandidateListView, self).get_context_data(**kwargs)
+        # Read the stored progress of all candidates together, rather than
+        # separately for each candidate, and attach it to each candidate
+        matrix = CandidateProgressMatrix(
+            self.display_term, context['candidates'], stored=True)
+        for candidate, progress in matrix:
+            candidate.progress = progress
+        context['candidates'] = matrix.candidates
+        context['object_list'] = matrix.candidates
+        return context
+
+
+class PseudoBuffer(object):
+    """An object with only the write method of the file-like interface, which
+    returns the value written rather than storing it, so that a csv.writer
+    can be used to produce the rows of a streamed response.
+    """
+    def write(self, value):
+        return value
+
+
+class CandidateProgressCSVView(TermParameterMixin, View):
+    """Export the progress of all candidates in a term towards every
+    requirement as a CSV file.
+
+    The rows are streamed, since the file has a row for every candidate. All
+    progress is computed beforehand with a fixed number of queries.
+    """
+    @method_decorator(login_required)
+    @method_decorator(permission_required(
+        'candidates.change_candidate', raise_exception=True))
+    def dispatch(self, *args, **kwargs):
+        return super(CandidateProgressCSVView, self).dispatch(*args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        candidates = Candidate.objects.filter(
+            term=self.display_term).select_related('user').order_by(
+            'user__last_name', 'user__first_name')
+        matrix = CandidateProgressMatrix(self.display_term, candidates)
+        writer = csv.writer(PseudoBuffer())
+        response = StreamingHttpResponse(
+            (writer.writerow([smart_str(value) for value in row])
+             for row in self.get_rows(matrix)),
+            content_type='text/csv')
+        filename = 'candidate-progress-{}.csv'.format(
+            self.display_term.get_url_name())
+        response['Content-Disposition'] = 'attachment; filename={}'.format(
+            filename)
+        return response
+
+    def get_rows(self, matrix):
+        """Generate the header row and then a row for each candidate, with
+        the completed and required credits for each requirement and in total.
+        """
+        header = ['First Name', 'Last Name', 'Username', 'Email', 'Initiated']
+        for req in matrix.requirements:
+            name = u'{}: {}'.format(req.get_requirement_type_display(),
+                                    req.get_name())
+            header.extend([name + u' Completed', name + u' Required'])
+        header.extend(['Total Completed', 'Total Required'])
+        yield header
+
+        for candidate, progress in matrix:
+            user = candidate.user
+            row = [user.first_name, user.last_name, user.get_username(),
+                   user.email, candidate.initiated]
+            for req in matrix.requirements:
+                req_progress = progress.get(req)
+                row.extend([req_progress['completed'],
+                            req_progress['required']])
+            total = progress.get_total()
+            row.extend([total['completed'], total['required']])
+            yield row
+
 
 class CandidatePhotoView(UpdateView):
     context_object_name = 'candidate'
@@ -180,7 +269,6 @@ class CandidatePhotoView(UpdateView):
 class CandidateEditView(FormView, CandidateContextMixin):
     form_class = CandidateRequirementProgressFormSet
     template_name = 'candidates/edit.html'
-    candidate = None
     progress_list = None
     requirements = None
 
@@ -189,34 +277,17 @@ class CandidateEditView(FormView, CandidateContextMixin):
         'candidates.change_candidate', raise_exception=True))
     def dispatch(self, *args, **kwargs):
         self.candidate = get_object_or_404(
-            Candidate, pk=self.kwargs['candidate_pk'])
-        self.requirements = CandidateRequirement.objects.filter(
-            term=self.candidate.term).select_related(
-            'eventcandidaterequirement',
-            'eventcandidaterequirement__event_type',
-            'challengecandidaterequirement',
-            'challengecandidaterequirement__challenge_type',
-            'examfilecandidaterequirement')
+            Candidate.objects.select_related('user', 'term'),
+            pk=self.kwargs['candidate_pk'])
+        candidate_progress = self.get_candidate_progress()
+        self.requirements = candidate_progress.requirements
 
         # Create a list of progresses that at each index contains either a
         # progress corresponding to a requirement or None if there is no
         # progress for the corresponding requirement
-        self.progress_list = []
-        progress_index = 0
-        progresses = CandidateRequirementProgress.objects.filter(
-            candidate=self.candidate)
-        num_progresses = progresses.count()
-
-        for req in self.requirements:
-            # Progresses are ordered the same way as requirements,
-            # so all progresses will be correctly checked in the loop
-            if progress_index < num_progresses:
-                progress = progresses[progress_index]
-                if progress.requirement == req:
-                    self.progress_list.append(progress)
-                    progress_index += 1
-                    continue
-            self.progress_list.append(None)
+        self.progress_list = [
+            candidate_progress.get_requirement_progress(req)
+            for req in self.requirements]
 
         return super(CandidateEditView, self).dispatch(*args, **kwargs)
 
@@ -236,12 +307,13 @@ class CandidateEditView(FormView, CandidateContextMixin):
         for req in CandidateRequirement.REQUIREMENT_TYPE_CHOICES:
             req_types[req[0]] = []
 
-        electives_required = Candidate.are_electives_required(self.candidate)
+        candidate_progress = self.get_candidate_progress()
+        electives_required = candidate_progress.are_electives_required()
 
         for i, req in enumerate(self.requirements):
             progress = self.progress_list[i]
             form = formset[i]
-            req_progress = req.get_progress(self.candidate)
+            req_progress = candidate_progress.get(req)
             completed = req_progress['completed']
             credits_needed = req_progress['required']
 
@@ -615,7 +687,6 @@ class CandidatePortalView(CreateView, CandidateContextMixin):
     """
     form_class = ChallengeForm
     template_name = 'candidates/portal.html'
-    candidate = None
     current_term = None
 
     @method_decorator(login_required)
@@ -627,26 +698,28 @@ class CandidatePortalView(CreateView, CandidateContextMixin):
         return super(CandidatePortalView, self).dispatch(
             *args, **kwargs)
 
+    def get_candidate_progress(self):
+        """Return the candidate's stored progress, which is read with one
+        query.
+        """
+        if self.candidate_progress is None:
+            self.candidate_progress = StoredCandidateProgress(self.candidate)
+        return self.candidate_progress
+
     def get_context_data(self, **kwargs):
         kwargs['candidate'] = self.candidate
         context = super(CandidatePortalView, self).get_context_data(**kwargs)
-        requirements = CandidateRequirement.objects.filter(
-            term=self.current_term).select_related(
-            'eventcandidaterequirement',
-            'eventcandidaterequirement__event_type',
-            'challengecandidaterequirement',
-            'challengecandidaterequirement__challenge_type',
-            'examfilecandidaterequirement')
+        candidate_progress = self.get_candidate_progress()
 
         # Initialize req_types to contain lists for every requirement type
         req_types = {}
         for req in CandidateRequirement.REQUIREMENT_TYPE_CHOICES:
             req_types[req[0]] = []
 
-        electives_required = Candidate.are_electives_required(self.candidate)
+        electives_required = candidate_progress.are_electives_required()
 
-        for req in requirements:
-            req_progress = req.get_progress(self.candidate)
+        for req in candidate_progress.requirements:
+            req_progress = candidate_progress.get(req)
             completed = req_progress['completed']
             credits_needed = req_progress['required']
             if electives_required and completed > credits_needed:
@@ -710,8 +783,8 @@ def update_candidate_initiation_status(request):
 
     candidate.initiated = initiated
     candidate.save(update_fields=['initiated'])
-    # TODO(sjdemartini): Update LDAP-related information, like removal from
-    # or addition to relevant groups.
+    if settings.USE_LDAP:
+        mail_sync_errors(sync_user_ldap_groups(candidate.user))
     # TODO(sjdemartini): Update relevant mailing lists, moving initiated
     # candidates off of the candidates list and onto the members list.
     return json_response()
@@ -130,11 +130,13 @@ class EventSignUpForm(forms.ModelForm):
             self.fields['driving'].widget = forms.HiddenInput()
 
     def clean(self):
-        """Check the signup limit has not been exceeded."""
+        """Use the previous signup of the user if it exists.
+
+        The signup limit is checked when the signup is saved (see
+        EventSignUp.save), since checking it here would be racy.
+        """
         # pylint: disable=w0201
         cleaned_data = super(EventSignUpForm, self).clean()
-        num_guests = cleaned_data.get('num_guests')
-        num_rsvps = self.event.get_num_rsvps()
 
         # Get the previous signup if it exists
         if self.user.is_authenticated():
@@ -144,18 +146,6 @@ class EventSignUpForm(forms.ModelForm):
             signup = get_object_or_none(
                 EventSignUp, event=self.event, email=cleaned_data.get('email'))
 
-        # If the user has signed up previously and not unsigned up, subtract
-        # the user and the number of guests from the total number of rsvps
-        if signup and not signup.unsignup:
-            num_rsvps -= (1 + signup.num_guests)
-
-        # Add the user and the number of guests to the total number of rsvps
-        # and check that it is less than the signup limit if the limit is not
-        # zero (a limit of zero implies unlimited signups)
-        if self.event.signup_limit != 0:
-            if (1 + num_guests + num_rsvps) > self.event.signup_limit:
-                raise forms.ValidationError('There are not enough spots left.')
-
         # Only save a new object if a signup does not already exist for this
         # user. Otherwise, just update the existing object.
         if signup:
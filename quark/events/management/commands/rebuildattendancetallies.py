@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from quark.base.models import Term
+from quark.events.models import EventAttendanceTally
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the attendance tallies shown on the events leaderboard '
+            'from event attendance. These are kept up to date when attendance '
+            'and events change, so this is only needed to build them for '
+            'historical terms or to repair them.')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-t', '--term', dest='term', default='',
+            help='Only rebuild the given term (e.g., sp2012) instead of all '
+                 'terms with events'),
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs.get('term'):
+            term = Term.objects.get_by_url_name(kwargs['term'])
+            if term is None:
+                raise CommandError('Unknown term {}'.format(kwargs['term']))
+            terms = [term]
+        else:
+            terms = Term.objects.filter(event__isnull=False).distinct()
+
+        for term in terms:
+            num_tallies = EventAttendanceTally.objects.rebuild_term(term.pk)
+            if int(kwargs.get('verbosity')) > 0:
+                self.stdout.write('Stored {} attendance tallies for {}'.format(
+                    num_tallies, term))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from quark.events.models import Event
+
+
+class Command(BaseCommand):
+    help = ('Recount the signups, guests and driver seats of all events from '
+            'their signups, and fix the stored counts that are wrong. These '
+            'are kept up to date when signups change, so this is only needed '
+            'to repair them.')
+
+    def handle(self, *args, **kwargs):
+        fixed = rebuild_signup_counts()
+        if int(kwargs.get('verbosity')) > 0:
+            for event in fixed:
+                self.stdout.write(u'Fixed the signup counts of {}'.format(
+                    event))
+            self.stdout.write(
+                'Fixed the signup counts of {} events'.format(len(fixed)))
+
+
+def rebuild_signup_counts():
+    """Recount the signup counts of all events, and save the ones that differ
+    from the stored counts.
+
+    Returns a list of the events whose counts were fixed.
+    """
+    fixed = []
+    with transaction.atomic():
+        # Lock the events so that their counts do not change while they are
+        # recounted
+        stored = dict(
+            (event.pk, event.get_signup_counts())
+            for event in Event.objects.select_for_update())
+        for event in Event.objects.all().with_signup_counts():
+            counts = event.get_signup_counts()
+            if stored.get(event.pk) != counts:
+                Event.objects.filter(pk=event.pk).update(
+                    **dict(zip(Event.SIGNUP_COUNT_FIELDS, counts)))
+                fixed.append(event)
+    return fixed
@@ -0,0 +1,75 @@
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+
+from quark.base.models import Term
+from quark.events.management.commands.rebuildsignupcounts import \
+    rebuild_signup_counts
+from quark.events.models import Event
+from quark.events.models import EventAttendance
+from quark.events.models import EventAttendanceTally
+from quark.events.models import EventSignUp
+from quark.events.models import EventType
+
+
+class RebuildAttendanceTalliesTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='luser',
+            email='test@tbp.berkeley.edu',
+            password='password',
+            first_name='Random',
+            last_name='User')
+        self.term = Term.objects.create(term=Term.SPRING, year=2012,
+                                        current=True)
+        event = Event.objects.create(
+            name='Fun Event', event_type=EventType.objects.create(name='Fun'),
+            start_datetime=timezone.now(), end_datetime=timezone.now(),
+            term=self.term, location='Here', contact=self.user)
+        EventAttendance.objects.create(event=event, user=self.user)
+
+    def test_rebuild(self):
+        EventAttendanceTally.objects.all().delete()
+        call_command('rebuildattendancetallies', verbosity=0)
+        tally = EventAttendanceTally.objects.get()
+        self.assertEqual((tally.user, tally.term, tally.count, tally.rank),
+                         (self.user, self.term, 1, 1))
+
+        EventAttendanceTally.objects.all().delete()
+        call_command('rebuildattendancetallies', term='sp2012', verbosity=0)
+        self.assertEqual(EventAttendanceTally.objects.get().count, 1)
+
+    def test_unknown_term(self):
+        self.assertRaises(CommandError, call_command,
+                          'rebuildattendancetallies', term='xx2012',
+                          verbosity=0)
+
+
+class RebuildSignUpCountsTest(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            username='luser',
+            email='test@tbp.berkeley.edu',
+            password='password',
+            first_name='Random',
+            last_name='User')
+        self.event = Event.objects.create(
+            name='Fun Event', event_type=EventType.objects.create(name='Fun'),
+            start_datetime=timezone.now(), end_datetime=timezone.now(),
+            term=Term.objects.create(term=Term.SPRING, year=2012),
+            location='Here', contact=user)
+        EventSignUp.objects.create(
+            event=self.event, user=user, num_guests=2, driving=4)
+
+    def test_rebuild(self):
+        Event.objects.update(num_signups=0, num_guests=0, driver_seats=0)
+        self.assertEqual(rebuild_signup_counts(), [self.event])
+        self.assertEqual(
+            Event.objects.get(pk=self.event.pk).get_signup_counts(),
+            (1, 2, 4))
+
+        # Correct counts are left alone
+        call_command('rebuildsignupcounts', verbosity=0)
+        self.assertEqual(rebuild_signup_counts(), [])
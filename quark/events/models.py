@@ -1,6 +1,14 @@
+
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.db import models
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import F
+from django.db.models import Max
 from django.db.models import Sum
 from django.db.models.query import QuerySet
 from django.template import defaultfilters
@@ -8,7 +16,12 @@ from django.utils import timezone
 
 from quark.base.models import OfficerPosition
 from quark.base.models import Term
+from quark.base.registry import get_cached_version
+from quark.base.registry import set_new_version
 from quark.project_reports.models import ProjectReport
+from quark.shortcuts import DeferredBatch
+from quark.shortcuts import disable_for_loaddata
+from quark.shortcuts import get_object_or_none
 
 
 class EventTypeManager(models.Manager):
@@ -54,8 +67,12 @@ class EventQuerySetMixin(object):
 
         Viewability is based on the "restriction" level for the events.
         """
-        user_level = Event.get_user_restriction_level(user)
+        return self.get_level_viewable(Event.get_user_restriction_level(user))
 
+    def get_level_viewable(self, user_level):
+        """Return events that users with the given restriction level (see
+        Event.get_user_restriction_level) can view.
+        """
         # Initialize visible_levels to those that are visible to everyone
         visible_levels = list(Event.VISIBLE_TO_EVERYONE)
         if user_level >= Event.MEMBER:
@@ -64,6 +81,29 @@ class EventQuerySetMixin(object):
             visible_levels.append(Event.OFFICER)
         return self.filter(restriction__in=visible_levels)
 
+    def with_signup_counts(self):
+        """Return a list of these events, where the num_signups, num_guests
+        and driver_seats of each event are counted from its signups (not
+        including unsignups) for all of the events with one grouped query.
+
+        The counts are not saved (see the rebuildsignupcounts management
+        command).
+        """
+        events = list(self)
+        counts = dict(
+            (signups['event'], (signups['num_signups'],
+                                signups['num_guests'],
+                                signups['driver_seats']))
+            for signups in EventSignUp.objects.filter(
+                event__in=[event.pk for event in events],
+                unsignup=False).order_by().values('event').annotate(
+                num_signups=Count('pk'), num_guests=Sum('num_guests'),
+                driver_seats=Sum('driving')))
+        for event in events:
+            event.num_signups, event.num_guests, event.driver_seats = (
+                counts.get(event.pk, (0, 0, 0)))
+        return events
+
 
 class EventQuerySet(QuerySet, EventQuerySetMixin):
     """Used in order to allow chaining of manager methods."""
@@ -97,6 +137,13 @@ class Event(models.Model):
 
     VISIBLE_TO_EVERYONE = (OPEN, PUBLIC, CANDIDATE)
 
+    SIGNUP_COUNT_FIELDS = ('num_signups', 'num_guests', 'driver_seats')
+
+    # The fields whose values before each save are remembered in old_fields
+    # (see event_pre_save), for the handlers of the attendance tallies,
+    # attendance counters and candidate progress that depend on them
+    TRACKED_FIELDS = ('term', 'event_type', 'name', 'cancelled')
+
     name = models.CharField(max_length=80, verbose_name='event name')
     event_type = models.ForeignKey(EventType)
 
@@ -129,6 +176,12 @@ class Event(models.Model):
     needs_drivers = models.BooleanField(default=False)
     cancelled = models.BooleanField(default=False)
 
+    # The counts of the event's signups (not including unsignups), which are
+    # kept up to date by EventSignUp.save and the signup delete handler
+    num_signups = models.PositiveIntegerField(default=0, editable=False)
+    num_guests = models.PositiveIntegerField(default=0, editable=False)
+    driver_seats = models.PositiveIntegerField(default=0, editable=False)
+
     # Some events can be worth more than 1 credit for candidates:
     requirements_credit = models.IntegerField(
         default=1,
@@ -156,9 +209,31 @@ class Event(models.Model):
     def __unicode__(self):
         return u'{} - {}'.format(self.name, unicode(self.term))
 
+    def save(self, *args, **kwargs):
+        """Save the event without its signup counts, which are only changed
+        with F() expressions, so that the (possibly stale) counts of this
+        instance never overwrite them.
+        """
+        if (self.pk is not None and not kwargs.get('force_insert') and
+                kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.fields
+                if not field.primary_key and
+                field.name not in Event.SIGNUP_COUNT_FIELDS]
+        super(Event, self).save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('events:detail', args=(self.pk,))
 
+    def get_tracked_fields(self):
+        """Return a dictionary of the current values of the TRACKED_FIELDS,
+        like old_fields.
+        """
+        return {'term': self.term_id,
+                'event_type': self.event_type_id,
+                'name': self.name,
+                'cancelled': self.cancelled}
+
     def is_upcoming(self):
         """Return True if the event is not canceled and has not yet ended."""
         return (not self.cancelled) and (self.end_datetime > timezone.now())
@@ -172,14 +247,20 @@ class Event(models.Model):
         end_date = timezone.localtime(self.end_datetime).date()
         return start_date != end_date
 
+    def get_signup_counts(self):
+        """Return a tuple of the number of signups (not including unsignups),
+        the number of guests they are bringing along and the number of seats
+        in their cars.
+        """
+        return self.num_signups, self.num_guests, self.driver_seats
+
     def get_num_guests(self):
         """Return the number of guests signed-up users are bringing along.
 
         This number does not include the signed-up users, themselves; only
         their guests are counted here.
         """
-        return (self.eventsignup_set.filter(unsignup=False).aggregate(
-                Sum('num_guests'))['num_guests__sum'] or 0)
+        return self.get_signup_counts()[1]
 
     def get_num_rsvps(self, include_guests=True):
         """Return the expected number of attendees based on signups.
@@ -188,10 +269,10 @@ class Event(models.Model):
         include_guests is True (as default), this count also includes the
         number of guests for each signup.
         """
-        count = self.eventsignup_set.filter(unsignup=False).count()
+        num_signups, num_guests, _ = self.get_signup_counts()
         if include_guests:
-            count += self.get_num_guests()
-        return count
+            return num_signups + num_guests
+        return num_signups
 
     def can_user_sign_up(self, user):
         """Return true if the given user is allowed to sign up for this event.
@@ -209,7 +290,14 @@ class Event(models.Model):
         """
         if self.restriction in Event.VISIBLE_TO_EVERYONE:
             return True
-        return Event.get_user_restriction_level(user) >= self.restriction
+        return self.can_level_view(Event.get_user_restriction_level(user))
+
+    def can_level_view(self, user_level):
+        """Return true if users with the given restriction level (see
+        get_user_restriction_level) are allowed to view this event.
+        """
+        return (self.restriction in Event.VISIBLE_TO_EVERYONE or
+                user_level >= self.restriction)
 
     def attendance_submitted(self):
         """Return True if there are any attendance records for this event."""
@@ -296,13 +384,20 @@ class Event(models.Model):
     def get_user_restriction_level(user):
         """Return the maximum event restriction level this user can access, or
         the public restriction level if no user is provided.
+
+        The user's roles are read from the request-scoped UserRoles when the
+        user is a request's user, so repeated checks are free.
         """
+        # Avoid circular dependency by importing here:
+        from quark.user_profiles.roles import get_user_roles
+
         if user and user.is_authenticated():
-            if user.userprofile.is_officer():
+            roles = get_user_roles(user)
+            if roles.is_officer():
                 return Event.OFFICER
-            elif user.userprofile.is_member():
+            elif roles.is_member():
                 return Event.MEMBER
-            elif user.userprofile.is_candidate():
+            elif roles.is_candidate():
                 return Event.CANDIDATE
         return Event.PUBLIC
 
@@ -341,6 +436,52 @@ class EventSignUp(models.Model):
             ('view_comments', 'Can view sign-up comments'),
         )
 
+    def get_counts(self):
+        """Return a tuple of the amounts that this signup adds to the
+        num_signups, num_guests and driver_seats of its event.
+        """
+        if self.unsignup:
+            return 0, 0, 0
+        return 1, self.num_guests, self.driving
+
+    def save(self, *args, **kwargs):
+        """Save the signup and update the signup counts of its event.
+
+        The event is locked until the end of the transaction, so signups for
+        the same event are counted one at a time. If the enforce_limits
+        keyword argument is True, raise a ValidationError without saving
+        anything if the signup would bring more guests than allowed or exceed
+        the signup limit of the event.
+        """
+        enforce_limits = kwargs.pop('enforce_limits', False)
+        with transaction.atomic():
+            event = Event.objects.select_for_update().get(pk=self.event_id)
+            old_counts = (0, 0, 0)
+            if self.pk is not None:
+                old_signup = get_object_or_none(EventSignUp, pk=self.pk)
+                if old_signup is not None:
+                    old_counts = old_signup.get_counts()
+            new_counts = self.get_counts()
+            deltas = [new - old for new, old in zip(new_counts, old_counts)]
+
+            if enforce_limits and not self.unsignup:
+                if self.num_guests > event.max_guests_per_person:
+                    raise ValidationError(
+                        'You cannot bring more than {} guest{}.'.format(
+                            event.max_guests_per_person,
+                            's' if event.max_guests_per_person != 1 else ''))
+                num_rsvps = event.num_signups + event.num_guests
+                if event.signup_limit != 0 and deltas[0] + deltas[1] > 0 and (
+                        num_rsvps + deltas[0] + deltas[1] > event.signup_limit):
+                    raise ValidationError('There are not enough spots left.')
+
+            super(EventSignUp, self).save(*args, **kwargs)
+            if any(deltas):
+                Event.objects.filter(pk=event.pk).update(
+                    num_signups=F('num_signups') + deltas[0],
+                    num_guests=F('num_guests') + deltas[1],
+                    driver_seats=F('driver_seats') + deltas[2])
+
     def __unicode__(self):
         action = 'unsigned' if self.unsignup else 'signed'
         if self.user is None:
@@ -356,10 +497,56 @@ class EventSignUp(models.Model):
             event_name=self.event.name)
 
 
+class EventAttendanceManager(models.Manager):
+    def record_attendance(self, event, user_pks):
+        """Record attendance at the given event for each of the given users who
+        is not yet recorded as attending, and return the new EventAttendance
+        objects. User pks that do not belong to any user are ignored.
+
+        The new objects are created with a single bulk insert. Since
+        bulk_create does not send post_save signals, they are sent afterwards
+        for each new object (i.e., once for each user whose attendance was
+        recorded), so that the post_save handlers for EventAttendance (such as
+        those for achievements and candidate progress) still run. The signals
+        are sent within the same transaction as the insert, so that the
+        attendance is not saved if any of the handlers fail. The tallies of the
+        event's term are ranked once, after all of the signals are sent.
+        """
+        with transaction.atomic(), batch_tally_ranking():
+            new_user_pks = get_user_model().objects.filter(
+                pk__in=user_pks).exclude(
+                eventattendance__event=event).values_list('pk', flat=True)
+            new_attendances = [
+                EventAttendance(event=event, user_id=user_pk)
+                for user_pk in sorted(new_user_pks)]
+            self.bulk_create(new_attendances)
+            for attendance in new_attendances:
+                models.signals.post_save.send(
+                    sender=EventAttendance, instance=attendance, created=True,
+                    raw=False, using=self.db, update_fields=None)
+        return new_attendances
+
+    def remove_attendance(self, event, user_pks):
+        """Remove the attendance of the given users at the given event, and
+        return the deleted EventAttendance objects.
+
+        The tallies of the event's term are ranked once, after all of the
+        attendance is deleted.
+        """
+        with transaction.atomic(), batch_tally_ranking():
+            attendances = list(self.filter(
+                event=event, user__in=user_pks).select_related('event'))
+            self.filter(pk__in=[attendance.pk for attendance in attendances]
+                        ).delete()
+        return attendances
+
+
 class EventAttendance(models.Model):
     event = models.ForeignKey(Event)
     user = models.ForeignKey(settings.AUTH_USER_MODEL)
 
+    objects = EventAttendanceManager()
+
     # TODO(sjdemartini): Deal with the pre-noiro attendance importing? Note
     # that noiro added a separate field here to handle pre-noiro attendance
     # imports, as well as ImportedAttendance objects
@@ -370,3 +557,202 @@ class EventAttendance(models.Model):
 
     class Meta(object):
         unique_together = ('event', 'user')
+
+
+def rank_tally_terms(term_pks):
+    """Rank the attendance tallies of the terms with the given pks."""
+    for term_pk in term_pks:
+        EventAttendanceTally.objects.rank_term(term_pk)
+
+
+# The pks of the terms whose tallies are to be ranked at the end of the
+# current batch of each thread (see batch_tally_ranking)
+_tally_batch = DeferredBatch(rank_tally_terms)
+
+
+def batch_tally_ranking():
+    """Return a context manager that defers ranking the tallies of the terms
+    changed by EventAttendanceTally.objects.update_tally within it, and ranks
+    each of those terms once at the end instead.
+
+    Nested batches are merged into the outermost one.
+    """
+    return _tally_batch.collect()
+
+
+class EventAttendanceTallyManager(models.Manager):
+    def update_tally(self, user_pk, term_pk, delta):
+        """Add delta (1 for recorded attendance or -1 for removed attendance)
+        to the tally of the given user in the given term, and rank the term's
+        tallies again (or at the end of the current batch, if there is one;
+        see batch_tally_ranking).
+        """
+        with transaction.atomic():
+            tallies = self.filter(user=user_pk, term=term_pk)
+            if delta > 0:
+                if not tallies.update(count=F('count') + delta):
+                    self.create(user_id=user_pk, term_id=term_pk, count=delta)
+            else:
+                tallies.update(count=F('count') + delta)
+                tallies.filter(count__lte=0).delete()
+            _tally_batch.add(term_pk)
+
+    def rebuild_term(self, term_pk):
+        """Replace the tallies of all users in the given term with ones counted
+        from their attendance, and rank them.
+
+        Returns the number of tallies stored.
+        """
+        counts = EventAttendance.objects.filter(
+            event__term=term_pk, event__cancelled=False).order_by(
+            ).values_list('user').annotate(count=Count('pk'))
+        with transaction.atomic():
+            self.filter(term=term_pk).delete()
+            self.bulk_create([
+                EventAttendanceTally(user_id=user_pk, term_id=term_pk,
+                                     count=count)
+                for user_pk, count in counts])
+            self.rank_term(term_pk)
+        return len(counts)
+
+    def rank_term(self, term_pk):
+        """Set the leaderboard rank and width factor of every tally in the
+        given term with a single update.
+
+        Users with equal counts have the same rank, and the next rank skips
+        the users ranked above (e.g., 1, 1, 3).
+        """
+        max_count = self.filter(term=term_pk).aggregate(
+            max_count=Max('count'))['max_count']
+        if not max_count:
+            return
+        quote_name = connection.ops.quote_name
+        # The counts are grouped in a derived table, since MySQL does not
+        # allow selecting directly from the table being updated. The factor
+        # is used for the CSS width property (percentage). Use 70 as the max
+        # width (i.e. the user who attended the most events has width 70%),
+        # including adding 2.5 to every factor to make sure that there is
+        # enough room for text to be displayed.
+        connection.cursor().execute(
+            'UPDATE {table} SET '
+            '{rank} = 1 + COALESCE(('
+            'SELECT SUM(counts.num) FROM ('
+            'SELECT {count}, COUNT(*) AS num FROM {table} '
+            'WHERE {term} = %s GROUP BY {count}) counts '
+            'WHERE counts.{count} > {table}.{count}), 0), '
+            '{factor} = 2.5 + {count} * 67.5 / %s '
+            'WHERE {term} = %s'.format(
+                table=quote_name(self.model._meta.db_table),
+                rank=quote_name('rank'), count=quote_name('count'),
+                factor=quote_name('factor'), term=quote_name('term_id')),
+            [term_pk, float(max_count), term_pk])
+
+
+class EventAttendanceTally(models.Model):
+    """The number of non-cancelled events that a user attended in a term, and
+    the user's rank and width factor on the events leaderboard for the term.
+
+    Tallies are kept up to date when attendance is recorded or removed and
+    when events are cancelled or moved to other terms, and only exist for
+    users who attended events in the term.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+    term = models.ForeignKey(Term)
+    count = models.PositiveIntegerField(default=0)
+    rank = models.PositiveIntegerField(default=0, db_index=True)
+    factor = models.FloatField(
+        default=0,
+        help_text='The width of the user\'s bar on the leaderboard, as a '
+                  'percentage.')
+
+    objects = EventAttendanceTallyManager()
+
+    class Meta(object):
+        ordering = ('rank', 'pk')
+        unique_together = ('term', 'user')
+
+    def __unicode__(self):
+        return '{} attended {} events in {}'.format(
+            self.user.get_full_name(), self.count, self.term)
+
+
+def signup_delete(sender, instance, **kwargs):
+    """Remove a deleted signup from the signup counts of its event."""
+    num_signups, num_guests, driver_seats = instance.get_counts()
+    if num_signups:
+        Event.objects.filter(pk=instance.event_id).update(
+            num_signups=F('num_signups') - num_signups,
+            num_guests=F('num_guests') - num_guests,
+            driver_seats=F('driver_seats') - driver_seats)
+
+
+def attendance_tally_save(sender, instance, created, **kwargs):
+    """Count newly recorded attendance in the user's tally for the term."""
+    event = instance.event
+    if created and not event.cancelled:
+        EventAttendanceTally.objects.update_tally(
+            instance.user_id, event.term_id, 1)
+
+
+def attendance_tally_delete(sender, instance, **kwargs):
+    """Remove deleted attendance from the user's tally for the term."""
+    event = instance.event
+    if not event.cancelled:
+        EventAttendanceTally.objects.update_tally(
+            instance.user_id, event.term_id, -1)
+
+
+@disable_for_loaddata
+def event_pre_save(sender, instance, **kwargs):
+    """Remember the Event.TRACKED_FIELDS of an event before it is changed in
+    its old_fields, as a dictionary (or None if the event is new), with one
+    query for all of the post_save handlers that need them.
+    """
+    instance.old_fields = None
+    if instance.pk is not None:
+        instance.old_fields = Event.objects.filter(pk=instance.pk).values(
+            *Event.TRACKED_FIELDS).first()
+
+
+@disable_for_loaddata
+def event_tally_post_save(sender, instance, created, **kwargs):
+    """Rebuild the attendance tallies of the event's old and new terms if the
+    event was cancelled, restored or moved to another term.
+    """
+    old_fields = getattr(instance, 'old_fields', None)
+    if created or old_fields is None:
+        return
+    if (old_fields['term'] == instance.term_id and
+            old_fields['cancelled'] == instance.cancelled):
+        return
+    if not EventAttendance.objects.filter(event=instance).exists():
+        return
+    for term_pk in set([old_fields['term'], instance.term_id]):
+        EventAttendanceTally.objects.rebuild_term(term_pk)
+
+
+# The key in the shared cache of the current version of the ICS feeds of
+# events, which is changed whenever an event is saved or deleted
+ICAL_VERSION_CACHE_KEY = 'events_ical_version'
+
+
+def get_ical_version():
+    """Return the current version of the ICS feeds of events, which the cache
+    keys of the feeds include so that changing it invalidates all of them.
+    """
+    return get_cached_version(ICAL_VERSION_CACHE_KEY)
+
+
+def invalidate_ical_feeds(sender, **kwargs):
+    """Invalidate the cached ICS feeds when an event is saved or deleted."""
+    set_new_version(ICAL_VERSION_CACHE_KEY)
+
+
+models.signals.post_save.connect(invalidate_ical_feeds, sender=Event)
+models.signals.post_delete.connect(invalidate_ical_feeds, sender=Event)
+models.signals.post_delete.connect(signup_delete, sender=EventSignUp)
+models.signals.post_save.connect(attendance_tally_save, sender=EventAttendance)
+models.signals.post_delete.connect(
+    attendance_tally_delete, sender=EventAttendance)
+models.signals.pre_save.connect(event_pre_save, sender=Event)
+models.signals.post_save.connect(event_tally_post_save, sender=Event)
@@ -1,11 +1,25 @@
 import datetime
+import json
+import threading
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.contrib.auth.models import Permission
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import F
+from django.db.models import signals
+from django.db.models.query import QuerySet
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import skipUnlessDBFeature
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.test.utils import override_settings
 from django.utils import timezone
+from mock import patch
 
 from quark.base.models import Officer
 from quark.base.models import OfficerPosition
@@ -13,8 +27,14 @@ from quark.base.models import Term
 from quark.candidates.models import Candidate
 from quark.events.forms import EventForm
 from quark.events.models import Event
+from quark.events.models import EventAttendance
+from quark.events.models import EventAttendanceTally
 from quark.events.models import EventSignUp
 from quark.events.models import EventType
+from quark.events.views import EventDetailView
+from quark.events.views import attendance_update
+from quark.events.views import get_api_key_restriction_level
+from quark.events.views import ical
 from quark.project_reports.models import ProjectReport
 from quark.shortcuts import get_object_or_none
 
@@ -124,6 +144,27 @@ class EventTest(EventTesting):
         self.assertNotIn(
             event, Event.objects.get_upcoming(current_term_only=True))
 
+    def test_old_fields(self):
+        """The tracked fields of an event are read once before each save,
+        for all of the handlers that need them.
+        """
+        start_time = timezone.now() + datetime.timedelta(hours=2)
+        end_time = start_time + datetime.timedelta(hours=3)
+        event = self.create_event(start_time, end_time)
+        self.assertIsNone(event.old_fields)
+        old_fields = event.get_tracked_fields()
+
+        event.name = 'Renamed Event'
+        event.cancelled = True
+        with CaptureQueriesContext(connection) as queries:
+            event.save()
+        self.assertEqual(event.old_fields, old_fields)
+        table = connection.ops.quote_name(Event._meta.db_table)
+        self.assertEqual(len([
+            query for query in queries
+            if 'SELECT' in query['sql'] and
+            'FROM {} '.format(table) in query['sql']]), 1)
+
     def test_is_upcoming(self):
         # Create an event that hasn't started yet:
         start_time = timezone.now() + datetime.timedelta(hours=2)
@@ -460,6 +501,611 @@ class EventTest(EventTesting):
         self.assertEqual(expected_str, unicode(signup))
 
 
+class EventSignUpCountsTest(EventTesting):
+    def setUp(self):
+        super(EventSignUpCountsTest, self).setUp()
+        start_time = timezone.now() + datetime.timedelta(days=1)
+        end_time = start_time + datetime.timedelta(hours=2)
+        self.event = self.create_event(start_time, end_time,
+                                       restriction=Event.PUBLIC)
+        self.other_event = self.create_event(start_time, end_time)
+        EventSignUp.objects.create(
+            event=self.event, name='Zed', num_guests=2, driving=4)
+        EventSignUp.objects.create(
+            event=self.event, user=self.user, num_guests=1, driving=0)
+        EventSignUp.objects.create(
+            event=self.event, name='Alice', num_guests=3, driving=5,
+            unsignup=True)
+
+    def test_signup_counts(self):
+        event = Event.objects.get(pk=self.event.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(event.get_signup_counts(), (2, 3, 4))
+        self.assertEqual(event.get_num_guests(), 3)
+        self.assertEqual(event.get_num_rsvps(), 5)
+        self.assertEqual(event.get_num_rsvps(include_guests=False), 2)
+        self.assertEqual(self.other_event.get_signup_counts(), (0, 0, 0))
+
+    def test_update_signup_counts(self):
+        signup = EventSignUp.objects.get(event=self.event, user=self.user)
+        signup.num_guests = 0
+        signup.driving = 3
+        signup.save()
+        self.assertEqual(
+            Event.objects.get(pk=self.event.pk).get_signup_counts(), (2, 2, 7))
+
+        signup.unsignup = True
+        signup.save()
+        self.assertEqual(
+            Event.objects.get(pk=self.event.pk).get_signup_counts(), (1, 2, 4))
+
+        # Deleting an unsignup does not change the counts
+        signup.delete()
+        self.assertEqual(
+            Event.objects.get(pk=self.event.pk).get_signup_counts(), (1, 2, 4))
+        EventSignUp.objects.get(name='Zed').delete()
+        self.assertEqual(
+            Event.objects.get(pk=self.event.pk).get_signup_counts(), (0, 0, 0))
+
+    def test_event_save(self):
+        # Saving a stale event does not overwrite its signup counts
+        self.event.name = 'Renamed Event'
+        self.event.save()
+        event = Event.objects.get(pk=self.event.pk)
+        self.assertEqual(event.name, 'Renamed Event')
+        self.assertEqual(event.get_signup_counts(), (2, 3, 4))
+
+    def test_with_signup_counts(self):
+        with self.assertNumQueries(2):
+            events = Event.objects.filter(
+                pk__in=[self.event.pk, self.other_event.pk]).order_by(
+                'pk').with_signup_counts()
+            self.assertEqual(
+                [event.get_signup_counts() for event in events],
+                [(2, 3, 4), (0, 0, 0)])
+            self.assertEqual(events[0].get_num_rsvps(), 5)
+
+    def test_detail_view(self):
+        request = RequestFactory().get(
+            reverse('events:detail', args=(self.event.pk,)))
+        request.user = self.user
+        response = EventDetailView.as_view()(request, event_pk=self.event.pk)
+        context = response.context_data
+        # Signups are sorted by common name (Bentley Bent) or signup name
+        self.assertEqual(
+            [signup.name for signup in context['signup_list']], ['', 'Zed'])
+        self.assertEqual(context['num_signups'], 2)
+        self.assertEqual(context['num_guests'], 3)
+        self.assertEqual(context['total_seats'], 4)
+        self.assertEqual(context['available_seats'], -1)
+        self.assertTrue(context['user_signed_up'])
+
+    def test_detail_view_order(self):
+        """Anonymous signups are sorted among the others by name."""
+        for name in ['Bert', 'Alan', 'Bentley Apple']:
+            EventSignUp.objects.create(event=self.event, name=name)
+        request = RequestFactory().get(
+            reverse('events:detail', args=(self.event.pk,)))
+        request.user = self.user
+        response = EventDetailView.as_view()(request, event_pk=self.event.pk)
+        self.assertEqual(
+            [signup.name for signup in response.context_data['signup_list']],
+            ['Alan', 'Bentley Apple', '', 'Bert', 'Zed'])
+
+
+class EventSignUpLimitTest(EventTesting):
+    def setUp(self):
+        super(EventSignUpLimitTest, self).setUp()
+        start_time = timezone.now() + datetime.timedelta(days=1)
+        end_time = start_time + datetime.timedelta(hours=2)
+        self.event = self.create_event(start_time, end_time,
+                                       restriction=Event.PUBLIC)
+        self.event.signup_limit = 3
+        self.event.max_guests_per_person = 1
+        self.event.save()
+
+    def test_signup_limit(self):
+        signup = EventSignUp(event=self.event, name='Alice', num_guests=1)
+        signup.save(enforce_limits=True)
+
+        # Two more spots would exceed the limit
+        signup = EventSignUp(event=self.event, name='Bob', num_guests=1)
+        self.assertRaisesMessage(
+            ValidationError, 'There are not enough spots left.',
+            signup.save, enforce_limits=True)
+        self.assertFalse(EventSignUp.objects.filter(name='Bob').exists())
+
+        signup.num_guests = 0
+        signup.save(enforce_limits=True)
+        self.assertEqual(
+            Event.objects.get(pk=self.event.pk).get_num_rsvps(), 3)
+
+        # Updating a signup without taking more spots is allowed when full
+        signup.comments = 'Running late'
+        signup.save(enforce_limits=True)
+
+        # Limits are only enforced when asked to
+        EventSignUp.objects.create(event=self.event, name='Carol')
+        self.assertEqual(
+            Event.objects.get(pk=self.event.pk).get_num_rsvps(), 4)
+
+    def test_max_guests(self):
+        signup = EventSignUp(event=self.event, name='Alice', num_guests=2)
+        self.assertRaisesMessage(
+            ValidationError, 'You cannot bring more than 1 guest.',
+            signup.save, enforce_limits=True)
+        self.assertEqual(
+            Event.objects.get(pk=self.event.pk).get_signup_counts(),
+            (0, 0, 0))
+
+    def test_signup_view(self):
+        EventSignUp.objects.create(event=self.event, name='Alice',
+                                   num_guests=1)
+        self.assertTrue(self.client.login(username=self.user.username,
+                                          password='testofficerpw'))
+        response = self.client.post(
+            reverse('events:signup', args=(self.event.pk,)),
+            {'num_guests': 1, 'driving': 0, 'comments': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.content)['data'],  # pylint: disable=E1103
+            {'__all__': ['There are not enough spots left.']})
+        self.assertFalse(
+            EventSignUp.objects.filter(user=self.user).exists())
+
+
+@override_settings(USE_TZ=True)
+class EventSignUpConcurrencyTest(TransactionTestCase):
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_signups(self):
+        user = get_user_model().objects.create_user(
+            username='bentleythebent',
+            email='it@tbp.berkeley.edu',
+            password='testofficerpw',
+            first_name='Bentley',
+            last_name='Bent')
+        event = Event.objects.create(
+            name='Popular Event',
+            event_type=EventType.objects.create(name='Fun'),
+            start_datetime=timezone.now(), end_datetime=timezone.now(),
+            term=Term.objects.create(term=Term.SPRING, year=2012),
+            location='Here', contact=user, signup_limit=5)
+
+        successes = []
+
+        def sign_up(i):
+            try:
+                EventSignUp(event=event, name='Person {}'.format(i)).save(
+                    enforce_limits=True)
+                successes.append(i)
+            except ValidationError:
+                pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=sign_up, args=(i,))
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(successes), 5)
+        self.assertEqual(Event.objects.get(pk=event.pk).num_signups, 5)
+        self.assertEqual(EventSignUp.objects.filter(event=event).count(), 5)
+
+    def test_interleaved_signups(self):
+        """Test the interleaving that the lock allows on any database: a
+        signup that is kept waiting for the lock while another signup takes
+        the last spot must count the other signup once it gets the lock.
+        """
+        user = get_user_model().objects.create_user(
+            username='bentleythebent',
+            email='it@tbp.berkeley.edu',
+            password='testofficerpw',
+            first_name='Bentley',
+            last_name='Bent')
+        event = Event.objects.create(
+            name='Popular Event',
+            event_type=EventType.objects.create(name='Fun'),
+            start_datetime=timezone.now(), end_datetime=timezone.now(),
+            term=Term.objects.create(term=Term.SPRING, year=2012),
+            location='Here', contact=user, signup_limit=1)
+
+        select_for_update = QuerySet.select_for_update
+
+        def take_last_spot(queryset, *args, **kwargs):
+            # Another signup updates the counts while this one waits for the
+            # lock. Since the test runs on a single connection, that update
+            # is part of this signup's transaction and is rolled back with it
+            Event.objects.filter(pk=event.pk).update(
+                num_signups=F('num_signups') + 1)
+            return select_for_update(queryset, *args, **kwargs)
+
+        signup = EventSignUp(event=event, name='Late')
+        with patch.object(QuerySet, 'select_for_update', autospec=True,
+                          side_effect=take_last_spot) as mock_lock:
+            self.assertRaises(ValidationError, signup.save,
+                              enforce_limits=True)
+        self.assertEqual(mock_lock.call_count, 1)
+        self.assertIsNone(signup.pk)
+        self.assertFalse(EventSignUp.objects.filter(event=event).exists())
+
+
+class AttendanceSearchTest(EventTesting):
+    def setUp(self):
+        super(AttendanceSearchTest, self).setUp()
+        self.event = self.create_event(timezone.now(), timezone.now())
+        self.other_user = get_user_model().objects.create_user(
+            username='bentleyfan',
+            email='fan@tbp.berkeley.edu',
+            password='password',
+            first_name='Benjamin',
+            last_name='Bent')
+
+    def search(self, query):
+        response = self.client.get(reverse('events:attendance-search'), {
+            'searchTerm': query, 'eventPK': self.event.pk})
+        return json.loads(response.content)  # pylint: disable=E1103
+
+    def test_attendance_search(self):
+        results = self.search('ben bent')
+        self.assertEqual([result['value'] for result in results],
+                         [self.other_user.pk, self.user.pk])
+        self.assertEqual(results[1]['label'], 'Bentley Bent')
+        self.assertIn('default-avatar', results[1]['picture'])
+
+        # Attendees are not included
+        EventAttendance.objects.create(event=self.event, user=self.user)
+        results = self.search('ben bent')
+        self.assertEqual([result['value'] for result in results],
+                         [self.other_user.pk])
+
+    def test_max_results(self):
+        for i in range(25):
+            get_user_model().objects.create_user(
+                username='bentley{}'.format(i),
+                email='bentley{}@tbp.berkeley.edu'.format(i),
+                password='password',
+                first_name='Bentley',
+                last_name='Number{}'.format(i))
+        self.assertEqual(len(self.search('bentley')), 20)
+
+
+class AttendanceUpdateTest(EventTesting):
+    def setUp(self):
+        super(AttendanceUpdateTest, self).setUp()
+        self.event = self.create_event(timezone.now(), timezone.now())
+        self.users = [get_user_model().objects.create_user(
+            username='attendee{}'.format(i),
+            email='attendee{}@tbp.berkeley.edu'.format(i),
+            password='password',
+            first_name='Attendee',
+            last_name=str(i)) for i in range(5)]
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='add_eventattendance'),
+            Permission.objects.get(codename='delete_eventattendance'))
+        self.client.login(username='bentleythebent',
+                          password='testofficerpw')
+
+        # Record the attendances sent with post_save
+        self.saved = []
+        signals.post_save.connect(self.attendance_saved,
+                                  sender=EventAttendance)
+
+    def tearDown(self):
+        signals.post_save.disconnect(self.attendance_saved,
+                                     sender=EventAttendance)
+
+    def attendance_saved(self, sender, instance, created, **kwargs):
+        self.saved.append((instance.user_id, created))
+
+    def update(self, attending=(), not_attending=()):
+        response = self.client.post(reverse('events:attendance-update'), {
+            'eventPK': self.event.pk,
+            'attendingPK': [user.pk for user in attending],
+            'notAttendingPK': [user.pk for user in not_attending]})
+        # pylint: disable=E1103
+        return response.status_code, json.loads(response.content)
+
+    def get_attendee_pks(self):
+        return set(EventAttendance.objects.filter(
+            event=self.event).values_list('user', flat=True))
+
+    def test_record_attendance(self):
+        EventAttendance.objects.create(event=self.event, user=self.users[0])
+        self.saved = []
+
+        status, data = self.update(attending=self.users)
+        self.assertEqual(status, 200)
+        pks = [user.pk for user in self.users]
+        self.assertEqual(data['recorded'], pks[1:])
+        self.assertEqual(data['removed'], [])
+        self.assertEqual(self.get_attendee_pks(), set(pks))
+        # post_save is sent once for each new attendee
+        self.assertEqual(self.saved, [(pk, True) for pk in pks[1:]])
+
+    def test_record_attendance_queries(self):
+        """Test that attendance is recorded with one query for the users who
+        are not yet attending and one insert, regardless of the number of
+        attendees.
+        """
+        signals.post_save.disconnect(self.attendance_saved,
+                                     sender=EventAttendance)
+        receivers = signals.post_save.receivers
+        # Ignore the post_save handlers, which are not run by bulk_create
+        signals.post_save.receivers = []
+        try:
+            # The transaction adds a savepoint and its release
+            with self.assertNumQueries(4):
+                EventAttendance.objects.record_attendance(
+                    self.event, [user.pk for user in self.users])
+        finally:
+            signals.post_save.receivers = receivers
+        self.assertEqual(len(self.get_attendee_pks()), len(self.users))
+
+    def test_record_attendance_nonexistent_user(self):
+        response = self.client.post(reverse('events:attendance-update'), {
+            'eventPK': self.event.pk,
+            'attendingPK': [self.users[1].pk, 0]})
+        self.assertEqual(response.status_code, 200)
+        # pylint: disable=E1103
+        self.assertEqual(json.loads(response.content)['recorded'],
+                         [self.users[1].pk])
+        self.assertEqual(self.get_attendee_pks(), set([self.users[1].pk]))
+
+    def test_record_attendance_handler_failure(self):
+        """Test that no attendance is recorded if a post_save handler fails,
+        so that the tables kept up to date by the handlers stay consistent.
+        """
+        def fail(sender, instance, **kwargs):
+            if instance.user_id == self.users[2].pk:
+                raise ValueError('Handler failed')
+        signals.post_save.connect(fail, sender=EventAttendance)
+        try:
+            self.assertRaises(
+                ValueError, EventAttendance.objects.record_attendance,
+                self.event, [user.pk for user in self.users])
+        finally:
+            signals.post_save.disconnect(fail, sender=EventAttendance)
+        self.assertEqual(self.get_attendee_pks(), set())
+        self.assertFalse(EventAttendanceTally.objects.exists())
+
+    def test_remove_attendance(self):
+        for user in self.users[:3]:
+            EventAttendance.objects.create(event=self.event, user=user)
+
+        status, data = self.update(attending=[self.users[3]],
+                                   not_attending=self.users[1:3])
+        self.assertEqual(status, 200)
+        self.assertEqual(data['recorded'], [self.users[3].pk])
+        self.assertEqual(data['removed'],
+                         [self.users[1].pk, self.users[2].pk])
+        self.assertEqual(self.get_attendee_pks(),
+                         set([self.users[0].pk, self.users[3].pk]))
+
+    def test_invalid_update(self):
+        status, _ = self.update(attending=self.users[:2],
+                                not_attending=self.users[1:3])
+        self.assertEqual(status, 400)
+        self.assertEqual(self.get_attendee_pks(), set())
+
+        response = self.client.post(reverse('events:attendance-update'), {
+            'eventPK': self.event.pk, 'attendingPK': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_event(self):
+        url = reverse('events:attendance-update')
+        attending = {'attendingPK': [self.users[0].pk]}
+        self.assertEqual(self.client.post(url, attending).status_code, 400)
+        attending['eventPK'] = 'x'
+        self.assertEqual(self.client.post(url, attending).status_code, 400)
+        self.assertFalse(EventAttendance.objects.exists())
+
+    def test_update_failure(self):
+        """Test that no attendance is recorded if removing attendance fails
+        in the same update.
+        """
+        EventAttendance.objects.create(event=self.event, user=self.users[0])
+        request = RequestFactory().post(reverse('events:attendance-update'), {
+            'eventPK': self.event.pk,
+            'attendingPK': [user.pk for user in self.users[1:3]],
+            'notAttendingPK': [self.users[0].pk]})
+        request.user = self.user
+        with patch(
+                'quark.events.models.EventAttendanceManager.remove_attendance',
+                side_effect=ValueError('Removal failed')):
+            self.assertRaises(ValueError, attendance_update, request)
+        self.assertEqual(self.get_attendee_pks(), set([self.users[0].pk]))
+
+
+class EventAttendanceTallyTest(EventTesting):
+    def setUp(self):
+        super(EventAttendanceTallyTest, self).setUp()
+        self.events = [self.create_event(timezone.now(), timezone.now())
+                       for _ in range(3)]
+        self.users = [get_user_model().objects.create_user(
+            username='attendee{}'.format(i),
+            email='attendee{}@tbp.berkeley.edu'.format(i),
+            password='password',
+            first_name='Attendee',
+            last_name=str(i)) for i in range(3)]
+
+    def assert_tallies(self, expected):
+        """Assert that the tallies in the term are the given list of (user
+        index, count, rank, factor), in order of rank.
+        """
+        self.assertEqual(
+            list(EventAttendanceTally.objects.filter(
+                term=self.term).values_list('user', 'count', 'rank',
+                                            'factor')),
+            [(self.users[i].pk, count, rank, factor)
+             for i, count, rank, factor in expected])
+
+    def test_tallies(self):
+        EventAttendance.objects.record_attendance(
+            self.events[0], [user.pk for user in self.users])
+        EventAttendance.objects.record_attendance(
+            self.events[1], [self.users[0].pk, self.users[1].pk])
+        EventAttendance.objects.create(event=self.events[2],
+                                       user=self.users[0])
+        self.assert_tallies([(0, 3, 1, 70.0),
+                             (1, 2, 2, 47.5),
+                             (2, 1, 3, 25.0)])
+
+        EventAttendance.objects.remove_attendance(
+            self.events[2], [self.users[0].pk])
+        EventAttendance.objects.get(
+            event=self.events[0], user=self.users[2]).delete()
+        self.assert_tallies([(0, 2, 1, 70.0), (1, 2, 1, 70.0)])
+
+        # cancelling an event removes its attendance from the tallies
+        self.events[1].cancelled = True
+        self.events[1].save()
+        self.assert_tallies([(0, 1, 1, 70.0), (1, 1, 1, 70.0)])
+
+        # and moving an event to another term moves its attendance
+        other_term = Term.objects.create(term=Term.FALL, year=2012)
+        self.events[0].term = other_term
+        self.events[0].save()
+        self.assertFalse(EventAttendanceTally.objects.filter(
+            term=self.term).exists())
+        self.assertEqual(EventAttendanceTally.objects.filter(
+            term=other_term).count(), 2)
+
+    def test_ranked_once_per_batch(self):
+        user_pks = [user.pk for user in self.users]
+        with patch.object(EventAttendanceTally.objects, 'rank_term',
+                          wraps=EventAttendanceTally.objects.rank_term
+                          ) as mock_rank:
+            EventAttendance.objects.record_attendance(self.events[0], user_pks)
+            self.assertEqual(mock_rank.call_count, 1)
+            EventAttendance.objects.remove_attendance(
+                self.events[0], user_pks[1:])
+            self.assertEqual(mock_rank.call_count, 2)
+        self.assert_tallies([(0, 1, 1, 70.0)])
+
+    def test_rebuild_term(self):
+        for event in self.events[:2]:
+            EventAttendance.objects.record_attendance(
+                event, [user.pk for user in self.users[:2]])
+        EventAttendanceTally.objects.all().delete()
+        self.assertEqual(
+            EventAttendanceTally.objects.rebuild_term(self.term.pk), 2)
+        self.assert_tallies([(0, 2, 1, 70.0), (1, 2, 1, 70.0)])
+
+
+@override_settings(ICAL_CACHE_TIMEOUT=60)
+class IcalTest(EventTesting):
+    def setUp(self):
+        super(IcalTest, self).setUp()
+        # Use a real cache, since the tests use a dummy cache
+        test_cache = LocMemCache('events', {})
+        for module in ('quark.accounts.models', 'quark.base.registry',
+                       'quark.events.views'):
+            cache_patcher = patch('{}.cache'.format(module), test_cache)
+            cache_patcher.start()
+            self.addCleanup(cache_patcher.stop)
+
+        start_time = timezone.now()
+        end_time = start_time + datetime.timedelta(hours=2)
+        self.event = self.create_event(
+            start_time, end_time, name='Public Event',
+            restriction=Event.PUBLIC)
+        self.create_event(start_time, end_time, name='Officer Event')
+        self.params = {'user': self.user.pk, 'key': self.user.api_key.key}
+
+    def get_feed(self, params=None, **headers):
+        request = RequestFactory().get(
+            reverse('events:ical'), params or self.params, **headers)
+        return ical(request)
+
+    def test_feed_cached(self):
+        response = self.get_feed()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Public Event', response.content)
+        self.assertNotIn('Officer Event', response.content)
+
+        # Polls of an unchanged feed do not query the database
+        with self.assertNumQueries(0):
+            cached_response = self.get_feed()
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+        self.assertEqual(cached_response['Last-Modified'],
+                         response['Last-Modified'])
+
+        # The feed of each term is cached separately
+        response = self.get_feed({'term': 'fa2012'})
+        self.assertNotIn('Public Event', response.content)
+        response = self.get_feed({'term': self.term.get_url_name()})
+        self.assertIn('Public Event', response.content)
+
+    def test_api_key(self):
+        key = self.user.api_key.key
+        self.assertEqual(
+            get_api_key_restriction_level(str(self.user.pk), str(key)),
+            Event.PUBLIC)
+        with self.assertNumQueries(0):
+            get_api_key_restriction_level(str(self.user.pk), str(key))
+
+        # Malformed keys are not looked up
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                get_api_key_restriction_level(str(self.user.pk), 'not a key'),
+                Event.PUBLIC)
+            self.assertEqual(get_api_key_restriction_level('me', str(key)),
+                             Event.PUBLIC)
+
+        # Deleting the key removes it from the cache
+        self.user.api_key.delete()
+        with self.assertNumQueries(1):
+            get_api_key_restriction_level(str(self.user.pk), str(key))
+
+    def test_conditional_get(self):
+        response = self.get_feed()
+        response = self.get_feed(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, '')
+        response = self.get_feed(
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.get_feed(
+            HTTP_IF_NONE_MATCH='"outdated"',
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        response = self.get_feed(
+            HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2000 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalidation(self):
+        etag = self.get_feed()['ETag']
+        self.event.name = 'Renamed Event'
+        self.event.save()
+        response = self.get_feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Renamed Event', response.content)
+
+        etag = response['ETag']
+        self.event.delete()
+        response = self.get_feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Renamed Event', response.content)
+
+    def test_event_feed(self):
+        request = RequestFactory().get(
+            reverse('events:event-ical', args=(self.event.pk,)))
+        response = ical(request, event_pk=self.event.pk)
+        self.assertIn('Public Event', response.content)
+        self.assertEqual(response['Filename'], 'event.ics')
+
+        request = RequestFactory().get(
+            reverse('events:event-ical', args=(self.event.pk,)),
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(
+            ical(request, event_pk=self.event.pk).status_code, 304)
+
+
 class EventFormsTest(EventTesting):
     def setUp(self):
         # Call superclass setUp first:
@@ -1,6 +1,9 @@
 from pytz import timezone as tz
 from datetime import datetime
 from datetime import timedelta
+import calendar
+import hashlib
+import re
 import vobject
 
 from django.conf import settings
@@ -9,17 +12,24 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
+from django.core.exceptions import NON_FIELD_ERRORS
 from django.core.exceptions import PermissionDenied
+from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db import transaction
 from django.db.models import Q
-from django.db.models import Count
-from django.db.models import Sum
 from django.http import HttpResponse
+from django.http import HttpResponseNotModified
 from django.shortcuts import get_object_or_404
-from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.utils.html import format_html
+from django.utils.http import http_date
+from django.utils.http import parse_etags
+from django.utils.http import parse_http_date_safe
+from django.utils.http import quote_etag
 from django.views.decorators.http import require_GET
 from django.views.decorators.http import require_POST
 from django.views.generic import CreateView
@@ -30,6 +40,7 @@ from django.views.generic import TemplateView
 from django.views.generic import UpdateView
 
 from quark.accounts.models import APIKey
+from quark.accounts.models import api_key_cache_key
 from quark.base.models import Term
 from quark.base.views import TermParameterMixin
 from quark.events.forms import EventForm
@@ -37,7 +48,10 @@ from quark.events.forms import EventSignUpAnonymousForm
 from quark.events.forms import EventSignUpForm
 from quark.events.models import Event
 from quark.events.models import EventAttendance
+from quark.events.models import EventAttendanceTally
 from quark.events.models import EventSignUp
+from quark.events.models import get_ical_version
+from quark.user_profiles.models import UserProfile
 from quark.utils.ajax import AjaxFormResponseMixin
 from quark.utils.ajax import json_response
 
@@ -171,8 +185,43 @@ class EventDetailView(DetailView):
     def get_context_data(self, **kwargs):
         context = super(EventDetailView, self).get_context_data(**kwargs)
 
-        context['signup_list'] = self.object.eventsignup_set.filter(
-            unsignup=False).select_related('user', 'user__userprofile')
+        # Go through all signups for the event once, keeping the viewer's own
+        # signup and counting the guests and seats of the other signups. The
+        # signups are sorted using the user's common name or the name used in
+        # signup (if anonymous signup), as a single key so that anonymous
+        # signups are sorted among the others
+        quote_name = connection.ops.quote_name
+        if connection.vendor == 'mysql':
+            common_name = "CONCAT({preferred_name}, ' ', {last_name})"
+        else:
+            common_name = "{preferred_name} || ' ' || {last_name}"
+        common_name = common_name.format(
+            preferred_name='{}.{}'.format(
+                quote_name(UserProfile._meta.db_table),
+                quote_name('preferred_name')),
+            last_name='{}.{}'.format(
+                quote_name(get_user_model()._meta.db_table),
+                quote_name('last_name')))
+        sort_name = 'COALESCE({}, {}.{})'.format(
+            common_name, quote_name(EventSignUp._meta.db_table),
+            quote_name('name'))
+        signups = self.object.eventsignup_set.select_related(
+            'user', 'user__userprofile').extra(
+            select={'sort_name': sort_name}).order_by('sort_name')
+        signup_list = []
+        user_pk = self.request.user.pk
+        user_signup = None
+        num_guests = 0
+        total_seats = 0
+        for event_signup in signups:
+            if (user_pk is not None and event_signup.user_id == user_pk and
+                    user_signup is None):
+                user_signup = event_signup
+            if not event_signup.unsignup:
+                signup_list.append(event_signup)
+                num_guests += event_signup.num_guests
+                total_seats += event_signup.driving
+        context['signup_list'] = signup_list
 
         signup = None
 
@@ -183,52 +232,34 @@ class EventDetailView(DetailView):
             context['form'] = None
         else:
             if self.request.user.is_authenticated():
-                try:
-                    signup = EventSignUp.objects.get(
-                        event=self.object, user=self.request.user)
-                    if signup.unsignup:
-                        # If the user has unsigned up, provide a new signup
-                        # form
-                        context['form'] = EventSignUpForm(self.object)
-                    else:
-                        context['form'] = EventSignUpForm(
-                            self.object, instance=signup)
-                except EventSignUp.DoesNotExist:
+                signup = user_signup
+                if signup is None:
                     context['form'] = EventSignUpForm(
                         self.object,
                         initial={'name': self.request.user.get_full_name()})
+                elif signup.unsignup:
+                    # If the user has unsigned up, provide a new signup form
+                    context['form'] = EventSignUpForm(self.object)
+                else:
+                    context['form'] = EventSignUpForm(
+                        self.object, instance=signup)
             else:
                 context['form'] = EventSignUpAnonymousForm(self.object)
 
         context['user_signed_up'] = signup is not None and not signup.unsignup
 
-        context['num_signups'] = len(context['signup_list'])
-        context['num_guests'] = self.object.get_num_guests()
+        context['num_signups'] = len(signup_list)
+        context['num_guests'] = num_guests
         total_rsvps = context['num_signups'] + context['num_guests']
 
-        context['total_seats'] = context['signup_list'].aggregate(
-            Sum('driving'))['driving__sum'] or 0
+        context['total_seats'] = total_seats
 
         context['available_seats'] = context['total_seats'] - total_rsvps
-
-        def signup_sort_key(signup):
-            if signup.user:
-                return signup.user.userprofile.get_common_name()
-            else:
-                return signup.name
-
-        # Sort the signup list using the user's common name or the name used
-        # in signup (if anonymous signup)
-        context['signup_list'] = sorted(context['signup_list'],
-                                        key=signup_sort_key)
         return context
 
 
 class EventSignUpView(AjaxFormResponseMixin, FormView):
     """Handles the form action for signing up for events (POST requests)."""
-    # TODO(sjdemartini): Handle various scenarios for failed signups. For
-    # instance, no more spots left, not allowed to bring x number of guests,
-    # etc.
     event = None  # The event that this sign-up corresponds to
     object = None  # The event signup object
 
@@ -257,7 +288,14 @@ class EventSignUpView(AjaxFormResponseMixin, FormView):
         """Check whether the signup was created or updated."""
         self.object = form.save(commit=False)
         created = self.object.pk is None
-        self.object.save()
+        try:
+            # Check the signup limit and the number of guests allowed while
+            # the event is locked, so that concurrent signups cannot exceed
+            # them
+            self.object.save(enforce_limits=True)
+        except ValidationError as error:
+            form._errors[NON_FIELD_ERRORS] = form.error_class(error.messages)
+            return self.form_invalid(form)
 
         if created:
             msg = 'Signup successful!'
@@ -399,49 +437,91 @@ def attendance_delete(request):
     return json_response()
 
 
+@require_POST
+@permission_required('events.add_eventattendance', raise_exception=True)
+@permission_required('events.delete_eventattendance', raise_exception=True)
+def attendance_update(request):
+    """Record and remove attendance for many users at a given event at once.
+
+    The event is specified by an eventPK post parameter. The users to record
+    as attending are specified by any number of attendingPK post parameters,
+    and the users whose attendance should be removed by any number of
+    notAttendingPK post parameters.
+
+    Return a JSON response with the lists of user pks whose attendance was
+    recorded ("recorded") and removed ("removed").
+    """
+    try:
+        event_pk = int(request.POST.get('eventPK'))
+        attending_pks = set([
+            int(pk) for pk in request.POST.getlist('attendingPK')])
+        not_attending_pks = set([
+            int(pk) for pk in request.POST.getlist('notAttendingPK')])
+    except (TypeError, ValueError):
+        return json_response(status=400)
+    if attending_pks & not_attending_pks:
+        return json_response(
+            status=400,
+            message='Users cannot be both attending and not attending.')
+    event = get_object_or_404(Event, pk=event_pk)
+
+    # Record and remove the attendance together, so that a failure in either
+    # leaves the event's attendance unchanged
+    with transaction.atomic():
+        recorded = EventAttendance.objects.record_attendance(
+            event, attending_pks)
+        removed = EventAttendance.objects.remove_attendance(
+            event, not_attending_pks)
+    return json_response(data={
+        'recorded': sorted([attendance.user_id for attendance in recorded]),
+        'removed': sorted([attendance.user_id for attendance in removed])
+    })
+
+
 def attendance_search(request, max_results=20):
     """Return a JSON response of members based on search for name.
 
     The search uses the "searchTerm" post parameter. Return up to max_results
     number of results. The results only include people who have not attended
     the event specified by the post parameter eventPK.
+
+    Names are matched by the indexed prefix search of
+    UserProfile.objects.search_by_name, and the pictures use the stored avatar
+    URLs, so the cost does not grow with the number of users.
     """
     search_query = request.GET['searchTerm']
     event_pk = request.GET['eventPK']
-    event = Event.objects.get(pk=event_pk)
 
-    # Get all users who did not attend this event:
+    # Get users who did not attend this event:
     # TODO(sjdemartini): Properly filter for members, instead of just getting
     # all users who are not officers or candidates (as these other users may
     # include company users, etc.)
-    members = user_model.objects.exclude(
-        eventattendance__event=event).select_related(
-        'userprofile')
+    profiles = UserProfile.objects.search_by_name(search_query).exclude(
+        user__eventattendance__event=event_pk).select_related(
+        'user')[:max_results]
 
     # A list of entries for each member that matches the search query:
-    member_matches = []
-
-    # Parse the search query into separate pieces if the query includes
-    # whitespace
-    search_terms = search_query.lower().split()
-    for member in members:
-        name = member.userprofile.get_verbose_full_name()
-        name_lower = name.lower()
-        if all(search_term in name_lower for search_term in search_terms):
-            pic_html = render_to_string(
-                '_user_thumbnail.html',
-                {'user_profile': member.userprofile})
-            entry = {
-                'label': name,
-                'value': member.pk,
-                'picture': pic_html
-            }
-            member_matches.append(entry)
-        if len(member_matches) >= max_results:
-            break
+    member_matches = [{
+        'label': profile.get_verbose_full_name(),
+        'value': profile.user_id,
+        'picture': get_user_thumbnail_html(profile)
+    } for profile in profiles]
     return json_response(data=member_matches)
 
 
+def get_user_thumbnail_html(user_profile):
+    """Return the same HTML as the _user_thumbnail.html template for the
+    given UserProfile, using its stored avatar URL instead of rendering the
+    template.
+    """
+    if user_profile.avatar_url:
+        return format_html(
+            '<img class="user-avatar user-picture" src="{}" alt="{}">',
+            user_profile.avatar_url, user_profile.get_common_name())
+    return ('<div class="user-avatar default-avatar">'
+            '<i class="fa fa-user"></i></div>')
+
+
 class IndividualAttendanceListView(TermParameterMixin, TemplateView):
     template_name = 'events/individual_attendance.html'
     attendance_user = None
@@ -512,43 +592,10 @@ class LeaderboardListView(TermParameterMixin, ListView):
         return super(LeaderboardListView, self).dispatch(*args, **kwargs)
 
     def get_queryset(self):
-        leaders = get_user_model().objects.filter(
-            eventattendance__event__term=self.display_term,
-            eventattendance__event__cancelled=False).select_related(
-            'userprofile').annotate(count=Count('eventattendance')).order_by(
-            '-count')
-
-        if len(leaders) > 0:
-            max_events = leaders[0].count or 0
-        else:
-            max_events = 0
-
-        # Create a list of "leader" entries, where each entry is a dictionary
-        # that includes the user, their rank on the leaderboard (1st, 2nd,
-        # etc.), and their leaderboard width "factor" (see below for details).
-        leader_list = []
-        if max_events > 0:  # make sure there's no divide by zero
-            prev_value = -1
-            prev_rank = 1
-
-            for i, leader in enumerate(leaders, start=prev_rank):
-                # factor used for CSS width property (percentage). Use 70 as
-                # the max width (i.e. the user who attended the most events has
-                # width 70%), including adding 2.5 to every factor to make sure
-                # that there is enough room for text to be displayed.
-                factor = 2.5 + leader.count * 67.5 / max_events
-                if leader.count == prev_value:
-                    rank = prev_rank
-                else:
-                    rank = i
-                prev_rank = rank
-                prev_value = leader.count
-
-                # Add the leader entry to the list
-                leader_list.append({'user': leader,
-                                    'factor': factor,
-                                    'rank': rank})
-        return leader_list
+        # The ranks and width factors of the leaders are stored with their
+        # tallies (see EventAttendanceTally.objects.rank_term)
+        return EventAttendanceTally.objects.filter(
+            term=self.display_term).select_related('user__userprofile')
 
 
 def ical(request, event_pk=None):
@@ -562,6 +609,124 @@ def ical(request, event_pk=None):
     "user" and "key" URL parameters (which correspond to the user's PK and API
     key, respectively). If the "user" and "key" parameters are not valid or are
     not provided, only publicly visible events are included.
+
+    Responses have ETag and Last-Modified headers, so calendar clients polling
+    a feed that has not changed get a 304 (Not Modified) response.
+    """
+    user_level = get_api_key_restriction_level(
+        request.GET.get('user', None), request.GET.get('key', None))
+
+    if event_pk is None:
+        # We want multiple events
+        filename = 'events.ics'
+        feed = get_ical_feed(user_level, request.GET.get('term', ''))
+    else:
+        # We want a specific event
+        event = get_object_or_404(Event, pk=event_pk)
+        if not event.can_level_view(user_level):
+            raise PermissionDenied
+        filename = 'event.ics'
+        feed = build_ical_feed([event])
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    if if_none_match:
+        # The ETag takes precedence over the modification time, which does not
+        # change when an event is deleted
+        etags = parse_etags(if_none_match)
+        not_modified = feed['etag'] in etags or '*' in etags
+    else:
+        not_modified = (if_modified_since is not None and
+                        feed['last_modified'] is not None and
+                        feed['last_modified'] <= if_modified_since)
+
+    if not_modified:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(feed['content'], content_type='text/calendar')
+        response['Filename'] = filename  # IE needs this
+        response['Content-Disposition'] = 'attachment; filename={}'.format(
+            filename)
+    response['ETag'] = quote_etag(feed['etag'])
+    if feed['last_modified'] is not None:
+        response['Last-Modified'] = http_date(feed['last_modified'])
+    return response
+
+
+def get_api_key_restriction_level(user_pk, key):
+    """Return the event restriction level (see
+    Event.get_user_restriction_level) of the user with the given pk and API
+    key, or the public restriction level if they do not belong to a user.
+
+    The level is cached for settings.ICAL_CACHE_TIMEOUT seconds, or until the
+    API key is changed.
+    """
+    if not user_pk or not key:
+        return Event.PUBLIC
+    # API keys are stored as hexadecimal strings without hyphens, so anything
+    # else cannot match one (and could not be used in a cache key)
+    key = key.replace('-', '')
+    if not user_pk.isdigit() or not key.isalnum():
+        return Event.PUBLIC
+
+    timeout = settings.ICAL_CACHE_TIMEOUT
+    cache_key = api_key_cache_key(user_pk, key)
+    if timeout:
+        user_level = cache.get(cache_key)
+        if user_level is not None:
+            return user_level
+
+    try:
+        api_key = APIKey.objects.select_related('user').get(
+            user__pk=user_pk, key=key)
+        user_level = Event.get_user_restriction_level(api_key.user)
+    except APIKey.DoesNotExist:
+        user_level = Event.PUBLIC
+
+    if timeout:
+        cache.set(cache_key, user_level, timeout)
+    return user_level
+
+
+def get_ical_feed(user_level, term_name):
+    """Return the ICS feed (see build_ical_feed) of the events that are not
+    cancelled and that users with the given restriction level can view, in
+    the term with the given URL name (or in all terms if the name is empty).
+
+    The feed is cached for settings.ICAL_CACHE_TIMEOUT seconds, or until any
+    event is saved or deleted.
+    """
+    timeout = settings.ICAL_CACHE_TIMEOUT
+    if timeout and re.match(r'^\w{0,10}$', term_name):
+        cache_key = 'events_ical_{}_{}_{}'.format(
+            get_ical_version(), user_level, term_name)
+    else:
+        cache_key = None
+    if cache_key:
+        feed = cache.get(cache_key)
+        if feed is not None:
+            return feed
+
+    events = Event.objects.get_level_viewable(user_level).filter(
+        cancelled=False)
+    if term_name:
+        # Filter by the given term
+        term = Term.objects.get_by_url_name(term_name)
+        events = events.filter(term=term)
+    feed = build_ical_feed(events)
+
+    if cache_key:
+        cache.set(cache_key, feed, timeout)
+    return feed
+
+
+def build_ical_feed(events):
+    """Return an ICS feed of the given events, as a dictionary of:
+    content: the serialized ICS calendar
+    etag: a hash of the content
+    last_modified: the time the events were last updated (as seconds since
+        the epoch), or None if there are no events
     """
     cal = vobject.iCalendar()
 
@@ -589,39 +754,20 @@ def ical(request, event_pk=None):
         1970, 11, 1, 2, 0, 0, 0, tz('US/Pacific'))  # '19701101T020000'
     std.add('rrule').value = 'FREQ=YEARLY;BYMONTH=11;BYDAY=1SU'
 
-    user = None
-    user_pk = request.GET.get('user', None)
-    key = request.GET.get('key', None)
-    if user_pk and key:
-        try:
-            api_key = APIKey.objects.get(user__pk=user_pk, key=key)
-            user = api_key.user
-        except APIKey.DoesNotExist:
-            pass
-
-    if event_pk is None:
-        # We want multiple events
-        filename = 'events.ics'
-        term = request.GET.get('term', '')
-        events = Event.objects.get_user_viewable(user).filter(cancelled=False)
-        if term:
-            # Filter by the given term
-            term_obj = Term.objects.get_by_url_name(term)
-            events = events.filter(term=term_obj)
-        for event in events:
-            add_event_to_ical(event, cal)
-    else:
-        # We want a specific event
-        event = get_object_or_404(Event, pk=event_pk)
-        if not event.can_user_view(user):
-            raise PermissionDenied
-        filename = 'event.ics'
+    last_modified = None
+    for event in events:
         add_event_to_ical(event, cal)
-
-    response = HttpResponse(cal.serialize(), content_type='text/calendar')
-    response['Filename'] = filename  # IE needs this
-    response['Content-Disposition'] = 'attachment; filename={}'.format(filename)
-    return response
+        if last_modified is None or event.updated > last_modified:
+            last_modified = event.updated
+
+    content = cal.serialize()
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    if last_modified is not None:
+        last_modified = calendar.timegm(last_modified.utctimetuple())
+    return {'content': content,
+            'etag': hashlib.md5(content).hexdigest(),
+            'last_modified': last_modified}
 
 
 def add_event_to_ical(event, cal):
@@ -52,6 +52,9 @@ class Notification(models.Model):
         help_text='Whether the user has closed this notification.')
 
     class Meta(object):
+        # Index for looking up a user's uncleared notifications, which is done
+        # on every page view
+        index_together = (('user', 'cleared'),)
         unique_together = ('user', 'content_type', 'object_pk')
 
     def __unicode__(self):
@@ -0,0 +1,81 @@
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.utils import timesince
+from django.utils import timezone
+
+from quark.notifications.models import Notification
+from quark.project_reports.models import ProjectReport
+
+
+class Command(BaseCommand):
+    help = ('Create or update the notifications for all overdue project '
+            'reports. Meant to be run periodically (e.g., daily by cron).')
+
+    def handle(self, *args, **kwargs):
+        created, updated = notify_overdue_project_reports()
+        if int(kwargs.get('verbosity')) > 0:
+            self.stdout.write(
+                'Created {} and updated {} overdue project report '
+                'notifications'.format(created, updated))
+
+
+def notify_overdue_project_reports():
+    """Create or update a notification for each project report (from all
+    terms) that is incomplete and past its date.
+
+    Each notification says how long its project report is overdue, and it is
+    shown to the author again (un-cleared) every time this is run, until the
+    project report is completed.
+
+    Returns a tuple of the number of notifications created and the number
+    updated.
+    """
+    project_reports = ProjectReport.objects.filter(
+        complete=False, date__lt=timezone.now().date()).values_list(
+        'pk', 'author', 'title', 'date')
+    content_type = ContentType.objects.get_for_model(ProjectReport)
+
+    with transaction.atomic():
+        existing = dict(
+            ((user_id, object_pk), (pk, description, cleared))
+            for pk, user_id, object_pk, description, cleared in
+            Notification.objects.filter(
+                content_type=content_type,
+                object_pk__in=[report[0] for report in project_reports]
+            ).values_list('pk', 'user', 'object_pk', 'description',
+                          'cleared'))
+
+        new_notifications = []
+        # Map from new description to the pks of the notifications to update
+        updates = defaultdict(list)
+        for pk, author_id, title, date in project_reports:
+            # Description must be unicode because timesince generates a
+            # unicode string
+            description = u'{} overdue'.format(timesince.timesince(date))
+            notification = existing.get((author_id, pk))
+            if notification is None:
+                new_notifications.append(Notification(
+                    user_id=author_id,
+                    status=Notification.NEGATIVE,
+                    content_type=content_type,
+                    object_pk=pk,
+                    title='Missing Project Report',
+                    subtitle=title,
+                    description=description,
+                    url=reverse('project-reports:edit', args=(pk,))))
+            elif notification[1] != description or notification[2]:
+                updates[description].append(notification[0])
+
+        Notification.objects.bulk_create(new_notifications)
+        # One update for each distinct description, rather than one for each
+        # notification
+        for description, pks in updates.iteritems():
+            Notification.objects.filter(pk__in=pks).update(
+                description=description, cleared=False)
+
+    return (len(new_notifications),
+            sum([len(pks) for pks in updates.itervalues()]))
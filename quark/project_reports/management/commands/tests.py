@@ -0,0 +1,90 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import timesince
+from django.utils import timezone
+
+from quark.base.models import OfficerPosition
+from quark.base.models import Term
+from quark.notifications.context_processors import notifications
+from quark.notifications.models import Notification
+from quark.project_reports.management.commands.notifyoverdue import \
+    notify_overdue_project_reports
+from quark.project_reports.models import ProjectReport
+
+
+class NotifyOverdueTest(TestCase):
+    fixtures = ['officer_position.yaml']
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='user',
+            email='user@tbp.berkeley.edu',
+            password='pwpwpwpwpw',
+            first_name='Bentley',
+            last_name='Bent')
+        self.committee = OfficerPosition.objects.get(short_name='it')
+        self.term = Term(term=Term.SPRING, year=2012, current=True)
+        self.term.save()
+        today = timezone.now().date()
+        self.overdue_report = self.create_report(
+            'Overdue', today - datetime.timedelta(days=3))
+        self.overdue_description = u'{} overdue'.format(
+            timesince.timesince(self.overdue_report.date))
+        self.create_report('Upcoming', today + datetime.timedelta(days=3))
+        self.create_report(
+            'Complete', today - datetime.timedelta(days=3), complete=True)
+
+    def create_report(self, title, date, complete=False):
+        return ProjectReport.objects.create(
+            term=self.term, author=self.user, committee=self.committee,
+            title=title, date=date, complete=complete)
+
+    def test_notifications_created(self):
+        self.assertEqual(notify_overdue_project_reports(), (1, 0))
+        notification = Notification.objects.get()
+        self.assertEqual(notification.user, self.user)
+        self.assertEqual(notification.content_object, self.overdue_report)
+        self.assertEqual(notification.subtitle, 'Overdue')
+        self.assertEqual(notification.description, self.overdue_description)
+        self.assertFalse(notification.cleared)
+
+    def test_notifications_updated(self):
+        notify_overdue_project_reports()
+
+        # Cleared notifications are shown again, with a new description
+        Notification.objects.update(cleared=True, description='Stale')
+        self.create_report(
+            'Also overdue', timezone.now().date() - datetime.timedelta(days=1))
+        with self.assertNumQueries(6):
+            # Select the reports, the existing notifications, the content type
+            # and the savepoint, then insert and update
+            self.assertEqual(notify_overdue_project_reports(), (1, 1))
+        notification = Notification.objects.get(
+            object_pk=self.overdue_report.pk)
+        self.assertEqual(notification.description, self.overdue_description)
+        self.assertFalse(notification.cleared)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_completed_report_cleared(self):
+        notify_overdue_project_reports()
+        self.overdue_report.complete = True
+        self.overdue_report.save()
+        self.assertTrue(Notification.objects.get().cleared)
+        self.assertEqual(notify_overdue_project_reports(), (0, 0))
+
+    def test_context_processor_read_only(self):
+        """The context processor never writes, and only reads the
+        notifications if they are used.
+        """
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            context = notifications(request)
+        self.assertFalse(context['notifications'])
+
+        notify_overdue_project_reports()
+        with self.assertNumQueries(1):
+            self.assertEqual(len(notifications(request)['notifications']), 1)
@@ -32,13 +32,17 @@ class LDAPBackend(ModelBackend):
         if username is None or password is None:
             return None
 
-        if not utils.check_password(username, password):
+        # The attributes needed to create a Django user are read along with
+        # verifying the password, so first logins need no other searches
+        attributes = utils.authenticate_user(
+            username, password, attrlist=['uid', 'givenName', 'sn', 'mail'])
+        if attributes is None:
             return None
 
         try:
             return User.objects.get(username=username)
         except User.DoesNotExist:
-            return self.__create_user(username)
+            return self.__create_user(attributes)
 
     def get_user(self, user_id):
         if not getattr(settings, 'USE_LDAP', False):
@@ -50,29 +54,14 @@ class LDAPBackend(ModelBackend):
         except User.DoesNotExist:
             return None
 
-    def __create_user(self, username):
+    def __create_user(self, attr):
         """
-        Helper function for creating Django users out of existing LDAP users
+        Helper function for creating Django users out of existing LDAP users,
+        given the attributes of their LDAP entries
         Migrates username, first and last name, and email
         If this is a dev session (DEBUG == True), also make tbp/pie-it members
         superusers.
         """
-        filter_pattern = '(&(objectClass=inetOrgPerson)(uid=%s))' % username
-        keys = ['uid', 'givenName', 'sn', 'mail']
-
-        ldap_handle = utils.initialize()
-        if ldap_handle is None:
-            return None
-        result = ldap_handle.search_s(
-            settings.LDAP['BASE'],
-            settings.LDAP['SCOPE'],
-            filter_pattern, keys)
-        # Result list should have exactly one element,
-        # which is a 2-tuple of DN and dictionary of attributes
-        if len(result) != 1 or len(result[0]) != 2:
-            return None
-
-        attr = result[0][1]
         uid = utils.get_property(attr, 'uid')
         if uid is None:
             return None
@@ -0,0 +1,44 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from quark.qldap.sync import sync_ldap_groups
+
+
+class Command(BaseCommand):
+    args = '[group ...]'
+    help = ('Make the members of the LDAP officer, member and candidate groups '
+            '(or only the groups given) match the officers, members and '
+            'candidates in the database.')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-n', '--dry-run', action='store_true', dest='dry_run',
+            default=False,
+            help='Show the changes that would be made without making them'),
+        )
+
+    def handle(self, *args, **kwargs):
+        dry_run = kwargs.get('dry_run', False)
+        changes, errors = sync_ldap_groups(
+            groups=list(args) or None, dry_run=dry_run)
+
+        if int(kwargs.get('verbosity')) > 0 or dry_run:
+            for group, (added, removed) in sorted(changes.iteritems()):
+                for username in added:
+                    self.stdout.write('+ {} {}'.format(group, username))
+                for username in removed:
+                    self.stdout.write('- {} {}'.format(group, username))
+            if dry_run:
+                self.stdout.write(
+                    '{} LDAP groups would be changed'.format(len(changes)))
+            else:
+                self.stdout.write(
+                    'Changed {} LDAP groups'.format(len(changes)))
+        if errors:
+            for error in errors:
+                self.stderr.write(error)
+            raise CommandError(
+                '{} errors while synchronizing LDAP groups'.format(
+                    len(errors)))
@@ -0,0 +1,53 @@
+from StringIO import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from mock import patch
+
+from quark.base.models import Term
+from quark.candidates.models import Candidate
+from quark.qldap.pool import LDAPConnectionPool
+from quark.qldap.tests import StubLDAPObject
+
+
+class SyncLDAPGroupsTest(TestCase):
+    def setUp(self):
+        term = Term.objects.create(term=Term.SPRING, year=2012, current=True)
+        user = get_user_model().objects.create_user(
+            username='candidate',
+            email='candidate@tbp.berkeley.edu',
+            password='password',
+            first_name='Random',
+            last_name='Candidate')
+        Candidate.objects.create(user=user, term=term)
+
+        self.handle = StubLDAPObject(entries=[
+            ('cn=tbp-candidates,ou=Group',
+             {'cn': ['tbp-candidates'], 'objectClass': ['posixGroup'],
+              'memberUid': ['formercandidate']})])
+        pool = LDAPConnectionPool('uid=test', 'password')
+        for patcher in [
+                patch('ldap.initialize', return_value=self.handle),
+                patch('quark.qldap.utils.get_pool', return_value=pool)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_dry_run(self):
+        stdout = StringIO()
+        call_command('syncldapgroups', 'tbp-candidates', dry_run=True,
+                     verbosity=0, stdout=stdout)
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            '+ tbp-candidates candidate',
+            '- tbp-candidates formercandidate',
+            '1 LDAP groups would be changed'])
+        self.assertEqual(self.handle.modifications, [])
+
+    def test_sync(self):
+        call_command('syncldapgroups', 'tbp-candidates', verbosity=0)
+        self.assertEqual(len(self.handle.modifications), 1)
+
+        # The other groups do not exist in LDAP
+        self.assertRaises(CommandError, call_command, 'syncldapgroups',
+                          verbosity=0, stderr=StringIO())
@@ -0,0 +1,247 @@
+import base64
+import copy
+import fnmatch
+import hashlib
+import ldap
+import threading
+import time
+
+from django.utils.encoding import smart_bytes
+from ldap.controls import SimplePagedResultsControl
+
+from quark.qldap.utils import LDAP_HASH_PREFIX
+
+
+class InMemoryLDAPServer(object):
+    """An in-memory stand-in for an LDAP server, for tests and benchmarks.
+
+    Entries are kept in a dictionary mapping DNs to dictionaries of their
+    attributes (lists of values, as in python-ldap search results). Passwords
+    are checked on binds against userPassword, which can be plain text or
+    hashed like quark.qldap.utils.obfuscate ({SSHA}) or with MD5 ({MD5}).
+    There is no access control.
+
+    Connections to the server are made with initialize, which can be patched
+    in for ldap.initialize. Every operation on a connection that waits for the
+    server takes latency seconds, so that login latency and the like can be
+    measured without a real server, and is counted in round_trips.
+    """
+    def __init__(self, latency=0, entries=None):
+        self.latency = latency
+        self.entries = {}
+        self.round_trips = 0
+        self._lock = threading.Lock()
+        for entry_dn, attributes in (entries or {}).iteritems():
+            self.add_entry(entry_dn, attributes)
+
+    def add_entry(self, entry_dn, attributes):
+        with self._lock:
+            self.entries[_normalize_dn(entry_dn)] = (entry_dn, dict(
+                [(attr, list(values))
+                 for attr, values in attributes.iteritems()]))
+
+    def initialize(self, uri=None):
+        return InMemoryLDAPObject(self)
+
+    def round_trip(self):
+        time.sleep(self.latency)
+        with self._lock:
+            self.round_trips += 1
+
+    def check_password(self, entry_dn, password):
+        """Return True if the entry with the given DN has the given
+        password.
+        """
+        with self._lock:
+            entry = self.entries.get(_normalize_dn(entry_dn))
+        if entry is None:
+            return False
+        password = smart_bytes(password)
+        for pw_hash in entry[1].get('userPassword', []):
+            if pw_hash.startswith(LDAP_HASH_PREFIX):
+                try:
+                    raw = base64.b64decode(pw_hash[len(LDAP_HASH_PREFIX):])
+                except TypeError:
+                    continue
+                digest, salt = raw[:20], raw[20:]
+                if hashlib.sha1(password + salt).digest() == digest:
+                    return True
+            elif pw_hash.startswith('{MD5}'):
+                if base64.b64encode(
+                        hashlib.md5(password).digest()) == pw_hash[5:]:
+                    return True
+            elif pw_hash == password:
+                return True
+        return False
+
+    def search(self, base, scope, filterstr=None, attrlist=None):
+        """Return the entries found like search_s would."""
+        base = _normalize_dn(base)
+        matcher = _parse_filter(filterstr or '(objectClass=*)')
+        with self._lock:
+            entries = self.entries.values()
+            if scope == ldap.SCOPE_BASE and base not in self.entries:
+                raise ldap.NO_SUCH_OBJECT()
+
+        results = []
+        for entry_dn, attributes in sorted(entries):
+            normalized_dn = _normalize_dn(entry_dn)
+            if scope == ldap.SCOPE_BASE:
+                in_scope = normalized_dn == base
+            elif scope == ldap.SCOPE_ONELEVEL:
+                in_scope = normalized_dn.split(',', 1)[-1] == base
+            else:
+                in_scope = (normalized_dn == base or
+                            normalized_dn.endswith(',' + base))
+            if not in_scope or not matcher(attributes):
+                continue
+            if attrlist is not None:
+                attributes = dict([(attr, values)
+                                   for attr, values in attributes.iteritems()
+                                   if attr in attrlist])
+            results.append((entry_dn, copy.deepcopy(attributes)))
+        return results
+
+    def modify(self, entry_dn, modlist):
+        with self._lock:
+            entry = self.entries.get(_normalize_dn(entry_dn))
+            if entry is None:
+                raise ldap.NO_SUCH_OBJECT()
+            attributes = entry[1]
+            for action, attr, values in modlist:
+                if isinstance(values, basestring):
+                    values = [values]
+                values = values or []
+                if action == ldap.MOD_ADD:
+                    attributes.setdefault(attr, []).extend(values)
+                elif action == ldap.MOD_REPLACE:
+                    attributes[attr] = list(values)
+                elif values:
+                    attributes[attr] = [
+                        value for value in attributes.get(attr, [])
+                        if value not in values]
+                else:
+                    attributes.pop(attr, None)
+                if not attributes.get(attr):
+                    attributes.pop(attr, None)
+
+    def delete(self, entry_dn):
+        with self._lock:
+            if self.entries.pop(_normalize_dn(entry_dn), None) is None:
+                raise ldap.NO_SUCH_OBJECT()
+
+
+class InMemoryLDAPObject(object):
+    """A connection to an InMemoryLDAPServer, with the methods of a
+    python-ldap connection that quark.qldap uses.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.protocol_version = None
+        self.bound_dn = ''
+        self._results = []
+
+    def simple_bind_s(self, who='', cred=''):
+        self.server.round_trip()
+        self.bound_dn = ''
+        if who and not self.server.check_password(who, cred):
+            raise ldap.INVALID_CREDENTIALS()
+        self.bound_dn = who
+
+    def whoami_s(self):
+        self.server.round_trip()
+        return 'dn:' + self.bound_dn if self.bound_dn else ''
+
+    def search_s(self, base, scope, filterstr=None, attrlist=None):
+        self.server.round_trip()
+        return self.server.search(base, scope, filterstr, attrlist)
+
+    def search_ext(self, base, scope, filterstr=None, attrlist=None,
+                   serverctrls=None):
+        # The round trip is made in result3, which waits for the results
+        results = self.server.search(base, scope, filterstr, attrlist)
+        controls = []
+        for control in serverctrls or []:
+            if control.controlType == SimplePagedResultsControl.controlType:
+                start = int(control.cookie or 0)
+                end = start + control.size
+                controls.append(SimplePagedResultsControl(
+                    True, size=0,
+                    cookie=str(end) if end < len(results) else ''))
+                results = results[start:end]
+        self._results.append((results, controls))
+        return len(self._results) - 1
+
+    def result3(self, msgid):
+        self.server.round_trip()
+        results, controls = self._results[msgid]
+        return (ldap.RES_SEARCH_RESULT, results, msgid, controls)
+
+    def add_s(self, entry_dn, modlist):
+        self.server.round_trip()
+        if _normalize_dn(entry_dn) in self.server.entries:
+            raise ldap.ALREADY_EXISTS()
+        self.server.add_entry(entry_dn, dict(modlist))
+
+    def modify_s(self, entry_dn, modlist):
+        self.server.round_trip()
+        self.server.modify(entry_dn, modlist)
+
+    def delete_s(self, entry_dn):
+        self.server.round_trip()
+        self.server.delete(entry_dn)
+
+    def unbind_s(self):
+        # Unbinding does not wait for the server
+        self.bound_dn = ''
+
+    unbind = unbind_s
+
+
+def _normalize_dn(entry_dn):
+    return ','.join([part.strip() for part in entry_dn.lower().split(',')])
+
+
+def _parse_filter(filterstr):
+    """Return a function that returns True for the attributes of the entries
+    that match the given search filter. Only the &, |, ! and equality
+    (including wildcards) filters are supported.
+    """
+    matcher, rest = _parse_filter_part(filterstr.strip())
+    if rest:
+        raise ldap.FILTER_ERROR(filterstr)
+    return matcher
+
+
+def _parse_filter_part(filterstr):
+    if not filterstr.startswith('('):
+        raise ldap.FILTER_ERROR(filterstr)
+    operator = filterstr[1]
+    if operator in '&|!':
+        matchers = []
+        rest = filterstr[2:]
+        while rest.startswith('('):
+            matcher, rest = _parse_filter_part(rest)
+            matchers.append(matcher)
+        if not rest.startswith(')'):
+            raise ldap.FILTER_ERROR(filterstr)
+        if operator == '&':
+            return (lambda attrs: all([m(attrs) for m in matchers]),
+                    rest[1:])
+        elif operator == '|':
+            return (lambda attrs: any([m(attrs) for m in matchers]),
+                    rest[1:])
+        return (lambda attrs: not matchers[0](attrs)), rest[1:]
+
+    end = filterstr.index(')')
+    attr, pattern = filterstr[1:end].split('=', 1)
+    pattern = pattern.lower()
+
+    def match(attrs):
+        values = [smart_bytes(value).lower()
+                  for key, values in attrs.iteritems()
+                  if key.lower() == attr.lower() for value in values]
+        if pattern == '*':
+            return bool(values)
+        return any([fnmatch.fnmatchcase(value, pattern) for value in values])
+    return match, filterstr[end + 1:]
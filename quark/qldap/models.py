@@ -1 +1,21 @@
 # LDAP does not require any models
+from django.conf import settings
+
+from quark.base.models import term_became_current
+
+
+def term_rollover(sender, instance, **kwargs):
+    """Synchronize the LDAP groups with the new current term's officers and
+    candidates when a term becomes the current term (i.e., at term rollover).
+
+    This is run after the term's transaction is over, so that no transaction
+    is held open while waiting on LDAP.
+    """
+    if settings.USE_LDAP:
+        # Avoid circular dependency by importing here:
+        from quark.qldap.sync import mail_sync_errors
+        from quark.qldap.sync import sync_ldap_groups
+        mail_sync_errors(sync_ldap_groups()[1])
+
+
+term_became_current.connect(term_rollover)
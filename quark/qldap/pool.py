@@ -0,0 +1,246 @@
+import threading
+import time
+
+import ldap
+from django.conf import settings
+
+
+# Errors after which a connection is assumed to be broken, so that it should be
+# re-established. A timeout is not among them, since the server may still be
+# carrying out the operation that timed out.
+RECONNECT_ERRORS = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR)
+
+# Methods that are safe to retry on a new connection, since running them twice
+# has the same effect as running them once. A write (modify_s, add_s, etc.) is
+# never retried, since the server may have applied it before the connection
+# was lost.
+RETRY_METHODS = frozenset([
+    'search_s', 'search_ext', 'search_ext_s', 'simple_bind_s', 'whoami_s',
+    'compare_s'])
+
+
+class PooledConnection(object):
+    """A bound LDAP connection owned by an LDAPConnectionPool.
+
+    Method calls are passed through to the underlying python-ldap handle. If a
+    call fails because the connection was lost, the connection is re-bound,
+    and the call is retried once if it is a read or a bind (see
+    RETRY_METHODS). Other calls re-raise the error, and the connection is
+    re-bound on its next use.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.handle = None
+        self.last_used = 0
+
+    def connect(self):
+        """Open and bind a new handle, replacing any existing one.
+
+        The handle is left unbound (anonymous) if the pool has no bind DN.
+        """
+        self.close()
+        handle = ldap.initialize(settings.LDAP['HOST'])
+        handle.protocol_version = ldap.VERSION3
+        if self.pool.bind_dn is not None:
+            handle.simple_bind_s(self.pool.bind_dn, self.pool.bind_pw)
+            self.pool.count('binds')
+        self.handle = handle
+
+    def close(self):
+        """Unbind and forget the underlying handle, ignoring any errors."""
+        if self.handle is not None:
+            try:
+                self.handle.unbind_s()
+            except ldap.LDAPError:
+                pass
+            self.handle = None
+
+    def is_healthy(self):
+        """Return True if the server still answers on this connection."""
+        try:
+            self.handle.whoami_s()
+            return True
+        except ldap.LDAPError:
+            return False
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the PooledConnection itself,
+        # i.e. the python-ldap methods (search_s, modify_s, etc.)
+        def call(*args, **kwargs):
+            if self.handle is None:
+                self.connect()
+            try:
+                return getattr(self.handle, name)(*args, **kwargs)
+            except RECONNECT_ERRORS:
+                self.pool.count('reconnects')
+                if name not in RETRY_METHODS:
+                    self.close()
+                    raise
+                self.connect()
+                return getattr(self.handle, name)(*args, **kwargs)
+        return call
+
+
+class LDAPConnectionPool(object):
+    """A bounded, thread-safe pool of LDAP connections bound as one DN (or
+    left unbound, if bind_dn is None).
+
+    Each thread checks out at most one connection at a time: nested checkouts
+    in the same thread (for instance, a utility function calling another one)
+    share the thread's connection, so nesting cannot exhaust the pool.
+
+    Idle connections are health-checked before reuse if they have been idle
+    for longer than health_check_interval seconds.
+
+    The stats dictionary counts pool hits (an idle connection was reused),
+    misses (a new connection was needed), binds, reconnects and checkout
+    timeouts.
+    """
+    def __init__(self, bind_dn, bind_pw, size=4, checkout_timeout=5,
+                 health_check_interval=60):
+        self.bind_dn = bind_dn
+        self.bind_pw = bind_pw
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+
+        self._condition = threading.Condition()
+        self._idle = []
+        self._num_connections = 0
+        self._local = threading.local()
+        self.stats = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._condition:
+            self.stats = {'hits': 0, 'misses': 0, 'binds': 0,
+                          'reconnects': 0, 'timeouts': 0}
+
+    def count(self, stat):
+        with self._condition:
+            self.stats[stat] += 1
+
+    def checkout(self):
+        """Return a bound PooledConnection for the calling thread.
+
+        Returns None if no connection became free within checkout_timeout
+        seconds. Raises ldap.LDAPError if a new connection cannot be bound.
+        Every connection returned must be given back with release().
+        """
+        local = self._local
+        if getattr(local, 'connection', None) is not None:
+            local.depth += 1
+            return local.connection
+
+        connection = None
+        with self._condition:
+            deadline = time.time() + self.checkout_timeout
+            while not self._idle and self._num_connections >= self.size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    return None
+                self._condition.wait(remaining)
+            if self._idle:
+                connection = self._idle.pop()
+                self.stats['hits'] += 1
+            else:
+                # Reserve a slot for the new connection
+                self._num_connections += 1
+                self.stats['misses'] += 1
+
+        # Bind outside of the lock, since it requires a network round trip
+        try:
+            if connection is None:
+                connection = PooledConnection(self)
+                connection.connect()
+            elif (time.time() - connection.last_used >
+                  self.health_check_interval and
+                  not connection.is_healthy()):
+                connection.connect()
+        except ldap.LDAPError:
+            if connection is not None:
+                connection.close()
+            self._discard()
+            raise
+
+        local.connection = connection
+        local.depth = 1
+        return connection
+
+    def release(self, connection):
+        """Give back a connection obtained from checkout()."""
+        local = self._local
+        local.depth -= 1
+        if local.depth > 0:
+            return
+        local.connection = None
+
+        connection.last_used = time.time()
+        if connection.handle is None:
+            # The connection broke and could not be re-established
+            self._discard()
+            return
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._condition:
+            idle = self._idle
+            self._idle = []
+            self._num_connections -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            connection.close()
+
+    def _discard(self):
+        with self._condition:
+            self._num_connections -= 1
+            self._condition.notify()
+
+
+_pool = None
+_auth_pool = None
+_pool_lock = threading.Lock()
+
+
+def _create_pool(bind_dn, bind_pw, options):
+    return LDAPConnectionPool(
+        bind_dn, bind_pw,
+        size=options.get('SIZE', 4),
+        checkout_timeout=options.get('CHECKOUT_TIMEOUT', 5),
+        health_check_interval=options.get('HEALTH_CHECK_INTERVAL', 60))
+
+
+def get_pool():
+    """Return the process-wide pool of connections bound as the LDAP service
+    DN (settings.LDAP_BASE['DN']), configured from settings.LDAP_POOL.
+    """
+    global _pool  # pylint: disable=W0603
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _create_pool(
+                    settings.LDAP_BASE['DN'],
+                    settings.LDAP_BASE['PASSWORD'],
+                    getattr(settings, 'LDAP_POOL', {}))
+    return _pool
+
+
+def get_auth_pool():
+    """Return the process-wide pool of connections used to bind as users to
+    verify their passwords, configured from settings.LDAP_AUTH_POOL.
+
+    The connections are not bound when they are created. Whoever checks one
+    out must bind it as a user before using it, since it is still bound as
+    the user who last checked it out.
+    """
+    global _auth_pool  # pylint: disable=W0603
+    if _auth_pool is None:
+        with _pool_lock:
+            if _auth_pool is None:
+                _auth_pool = _create_pool(
+                    None, None, getattr(settings, 'LDAP_AUTH_POOL', {}))
+    return _auth_pool
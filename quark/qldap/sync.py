@@ -0,0 +1,254 @@
+import ldap
+from django.conf import settings
+from django.core.mail import mail_admins
+from django.utils.encoding import smart_bytes
+
+from quark.base.models import Officer
+from quark.base.models import Term
+from quark.candidates.models import Candidate
+from quark.qldap import utils
+from quark.user_profiles.models import StudentOrgUserProfile
+
+
+# Groups whose extra members are never removed by sync_ldap_groups. LDAP is
+# also a source of officer and member status (see
+# StudentOrgUserProfile.is_officer and is_member), for people who were
+# officers or initiated before the database kept track of them, so these
+# groups have members who cannot be found in the database.
+ADDITIVE_GROUPS = frozenset(['tbp-officers', 'tbp-members'])
+
+
+def get_desired_group_members():
+    """Return a dictionary mapping each LDAP group synchronized by
+    sync_ldap_groups to the set of usernames that belong in the group.
+
+    Everyone who has held an officer position belongs in tbp-officers (which is
+    used to tell whether someone has ever been an officer), and everyone who
+    has initiated or been an officer belongs in tbp-members. The candidates of
+    the current term who have not initiated belong in tbp-candidates.
+    """
+    officers = set(Officer.objects.values_list('user__username', flat=True))
+    initiated = set(StudentOrgUserProfile.objects.filter(
+        initiation_term__isnull=False).values_list(
+        'user__username', flat=True))
+    candidates = set(Candidate.objects.filter(
+        term=Term.objects.get_current_term(), initiated=False).values_list(
+        'user__username', flat=True))
+    group_members = {
+        'tbp-officers': officers,
+        'tbp-members': officers | initiated,
+        'tbp-candidates': candidates - initiated,
+    }
+    return dict(
+        (group, set([smart_bytes(username) for username in usernames]))
+        for group, usernames in group_members.iteritems())
+
+
+def get_group_modlist(group, entry_properties, usernames):
+    """Return a tuple of the modlist that changes the members of the given
+    group to the given usernames, and sorted lists of the usernames that it
+    adds and removes, given the group's LDAP entry.
+
+    Members of ADDITIVE_GROUPS and the default user are never removed, and the
+    default user is added to a groupOfNames group that would otherwise be left
+    without members. Raises ValueError if the group is neither a posixGroup
+    nor a groupOfNames.
+    """
+    group_classes = entry_properties.get('objectClass', [])
+    if 'posixGroup' in group_classes:
+        member_attribute = 'memberUid'
+        member_format = '%s'
+    elif 'groupOfNames' in group_classes:
+        member_attribute = 'member'
+        member_format = 'uid=%s,' + settings.LDAP_BASE['PEOPLE']
+    else:
+        raise ValueError('%s is not a posixGroup or groupOfNames' % group)
+
+    values = entry_properties.get(member_attribute, [])
+    current = dict([(utils._member_username(value), value)
+                    for value in values
+                    if value != settings.LDAP_DEFAULT_USER])
+    added = sorted(usernames.difference(current))
+    if group in ADDITIVE_GROUPS:
+        removed = []
+    else:
+        removed = sorted(set(current).difference(usernames))
+
+    add_values = [member_format % username for username in added]
+    if (member_attribute == 'member' and
+            settings.LDAP_DEFAULT_USER not in values and
+            len(current) + len(added) == len(removed)):
+        add_values.append(settings.LDAP_DEFAULT_USER)
+
+    modlist = []
+    if add_values:
+        modlist.append((ldap.MOD_ADD, member_attribute, add_values))
+    if removed:
+        modlist.append((ldap.MOD_DELETE, member_attribute,
+                        [current[username] for username in removed]))
+    return modlist, added, removed
+
+
+def sync_ldap_groups(groups=None, dry_run=False):
+    """Make the members of the given LDAP groups (by default, all of the groups
+    in get_desired_group_members) match the officers, candidates and members
+    in the database.
+
+    All of the groups are read with one paged search, and each group that
+    needs changes is changed with one modify. If dry_run is True, nothing is
+    changed.
+
+    Returns a tuple of a dictionary mapping each group that was (or, for a dry
+    run, would be) changed to a tuple of the lists of usernames added and
+    removed, and a list of descriptions of the errors encountered.
+    """
+    desired = get_desired_group_members()
+    if groups is None:
+        groups = sorted(desired)
+
+    errors = []
+    for group in groups:
+        if group not in desired:
+            errors.append('Cannot synchronize LDAP group {}'.format(group))
+    groups = [group for group in groups if group in desired]
+    if not groups:
+        return {}, errors
+
+    changes = {}
+    with utils.service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return changes, errors + ['Could not connect to LDAP']
+
+        searchstr = '(|%s)' % ''.join(['(cn=%s)' % group for group in groups])
+        try:
+            entries = utils.paged_search_s(
+                ldap_handle, settings.LDAP_BASE['GROUP'],
+                settings.LDAP['SCOPE'], searchstr,
+                ['cn', 'objectClass', 'member', 'memberUid'])
+        except ldap.LDAPError as e:
+            return changes, errors + [
+                'Failed to search LDAP groups: {}'.format(e)]
+        group_entries = dict(
+            [(utils.get_property(entry_properties, 'cn'),
+              (group_dn, entry_properties))
+             for group_dn, entry_properties in entries if group_dn])
+
+        for group in groups:
+            if group not in group_entries:
+                errors.append('LDAP group {} does not exist'.format(group))
+                continue
+            group_dn, entry_properties = group_entries[group]
+            try:
+                modlist, added, removed = get_group_modlist(
+                    group, entry_properties, desired[group])
+            except ValueError as e:
+                errors.append(str(e))
+                continue
+            if not modlist:
+                continue
+            if not dry_run:
+                try:
+                    ldap_handle.modify_s(group_dn, modlist)
+                except ldap.LDAPError as e:
+                    errors.append('Failed to update LDAP group {}: {}'.format(
+                        group, e))
+                    continue
+                utils.invalidate_group_membership(group, added + removed)
+            changes[group] = (added, removed)
+    return changes, errors
+
+
+def get_desired_user_groups(user):
+    """Return the set of the groups out of tbp-candidates and tbp-members that
+    the given user belongs in, as in get_desired_group_members.
+    """
+    initiated = StudentOrgUserProfile.objects.filter(
+        user=user, initiation_term__isnull=False).exists()
+    desired = set()
+    if initiated or Officer.objects.filter(user=user).exists():
+        desired.add('tbp-members')
+    if not initiated and Candidate.objects.filter(
+            user=user, term=Term.objects.get_current_term(),
+            initiated=False).exists():
+        desired.add('tbp-candidates')
+    return desired
+
+
+def sync_user_ldap_groups(user):
+    """Add the given user to or remove them from tbp-candidates and
+    tbp-members to match their candidate, initiation and officer status in
+    the database.
+
+    Only the user's own memberships are read (with two searches) and changed
+    (with at most one modify per group). Unlike sync_ldap_groups, this removes
+    a user who is neither initiated nor an officer from tbp-members, so that
+    undoing a candidate's initiation takes them out of the group again.
+
+    Returns a list of descriptions of the errors encountered.
+    """
+    desired = get_desired_user_groups(user)
+    username = smart_bytes(user.username)
+    user_dn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
+    groups = ['tbp-candidates', 'tbp-members']
+    groupstr = ''.join(['(cn=%s)' % group for group in groups])
+    errors = []
+    with utils.service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return ['Could not connect to LDAP']
+
+        try:
+            entries = ldap_handle.search_s(
+                settings.LDAP_BASE['GROUP'], settings.LDAP['SCOPE'],
+                '(|%s)' % groupstr, ['cn', 'objectClass'])
+            member_entries = ldap_handle.search_s(
+                settings.LDAP_BASE['GROUP'], settings.LDAP['SCOPE'],
+                '(&(|%s)(|(memberUid=%s)(member=%s)))' % (
+                    groupstr, username, user_dn), ['cn'])
+        except ldap.LDAPError as e:
+            return ['Failed to search LDAP groups: {}'.format(e)]
+        group_entries = dict(
+            [(utils.get_property(entry_properties, 'cn'),
+              (group_dn, entry_properties))
+             for group_dn, entry_properties in entries if group_dn])
+        current = set([utils.get_property(entry_properties, 'cn')
+                       for group_dn, entry_properties in member_entries
+                       if group_dn])
+
+        for group in groups:
+            if group not in group_entries:
+                errors.append('LDAP group {} does not exist'.format(group))
+                continue
+            if group in desired and group not in current:
+                action = ldap.MOD_ADD
+            elif group in current and group not in desired:
+                action = ldap.MOD_DELETE
+            else:
+                continue
+            group_dn, entry_properties = group_entries[group]
+            group_classes = entry_properties.get('objectClass', [])
+            if 'posixGroup' in group_classes:
+                modlist = [(action, 'memberUid', [username])]
+            elif 'groupOfNames' in group_classes:
+                modlist = [(action, 'member', [user_dn])]
+            else:
+                errors.append(
+                    '{} is not a posixGroup or groupOfNames'.format(group))
+                continue
+            try:
+                ldap_handle.modify_s(group_dn, modlist)
+            except ldap.LDAPError as e:
+                errors.append('Failed to update LDAP group {}: {}'.format(
+                    group, e))
+                continue
+            utils.invalidate_group_membership(group, [username])
+    return errors
+
+
+def mail_sync_errors(errors):
+    """Email the admins the given errors returned by sync_ldap_groups, if
+    there are any.
+    """
+    if errors:
+        mail_admins('LDAP Anomaly Detected',
+                    'Problems occurred synchronizing LDAP groups:\n%s' % (
+                        '\n'.join(errors)))
@@ -1,13 +1,30 @@
 import os
+import threading
+import time
 
+import ldap
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import get_cache
 from django.test import TestCase
 from django.test.client import Client
 from django.test.utils import override_settings
 from ldap import MOD_ADD
+from ldap import MOD_DELETE
+from ldap.controls import SimplePagedResultsControl
+from mock import patch
 
+from quark.base.models import Officer
+from quark.base.models import OfficerPosition
+from quark.base.models import Term
+from quark.candidates.models import Candidate
 from quark.qldap import utils
+from quark.qldap.backends import LDAPBackend
+from quark.qldap.memory import InMemoryLDAPServer
+from quark.qldap.pool import LDAPConnectionPool
+from quark.qldap.sync import sync_ldap_groups
+from quark.qldap.sync import sync_user_ldap_groups
+from quark.user_profiles.models import StudentOrgUserProfile
 
 
 # TODO(flieee): Move tests over to test-only LDAP tree
@@ -198,3 +215,587 @@ class LDAPTestCase(TestCase):
         self.assertTrue(new_user.is_superuser)
         self.assertFalse(client.login(username=self.user, password=''))
         self.assertFalse(client.login(username='superfakeuser', password=''))
+
+
+class StubLDAPObject(object):
+    """A stand-in for a python-ldap connection that takes `latency` seconds
+    for each round trip to the server.
+
+    Every search finds the entries given (none by default), and modifications
+    are recorded instead of made. Errors appended to failures are raised by
+    the next operations instead.
+    """
+    def __init__(self, latency=0, entries=None):
+        self.latency = latency
+        self.entries = entries or []
+        self.protocol_version = None
+        self.failures = []
+        self.searches = []
+        self.results = []
+        self.modifications = []
+
+    def _round_trip(self):
+        time.sleep(self.latency)
+        if self.failures:
+            raise self.failures.pop(0)
+
+    def simple_bind_s(self, who, cred):
+        self._round_trip()
+
+    def whoami_s(self):
+        self._round_trip()
+        return ''
+
+    def search_s(self, base, scope, filterstr=None, attrlist=None):
+        self._round_trip()
+        self.searches.append(filterstr)
+        return self.entries
+
+    def search_ext(self, base, scope, filterstr=None, attrlist=None,
+                   serverctrls=None):
+        # Only the simple paged results control is supported, whose cookie
+        # is the index of the first entry of the page
+        self._round_trip()
+        self.searches.append(filterstr)
+        control = serverctrls[0]
+        start = int(control.cookie or 0)
+        end = start + control.size
+        cookie = str(end) if end < len(self.entries) else ''
+        self.results.append((self.entries[start:end], cookie))
+        return len(self.results) - 1
+
+    def result3(self, msgid):
+        entries, cookie = self.results[msgid]
+        return (ldap.RES_SEARCH_RESULT, entries, msgid,
+                [SimplePagedResultsControl(True, size=0, cookie=cookie)])
+
+    def rename_s(self, *args):
+        self._round_trip()
+
+    def modify_s(self, entry_dn, modlist):
+        self._round_trip()
+        self.modifications.append((entry_dn, modlist))
+
+    def unbind_s(self):
+        pass
+
+    unbind = unbind_s
+
+
+class LDAPConnectionPoolTest(TestCase):
+    def setUp(self):
+        self.pool = LDAPConnectionPool('uid=test', 'password', size=2,
+                                       checkout_timeout=0.1)
+        self.handles = []
+        patcher = patch('ldap.initialize', side_effect=self.stub_initialize)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stub_initialize(self, uri, latency=0):
+        handle = StubLDAPObject(latency)
+        self.handles.append(handle)
+        return handle
+
+    def test_connection_reused(self):
+        connection = self.pool.checkout()
+        connection.search_s('ou=People', ldap.SCOPE_SUBTREE)
+        self.pool.release(connection)
+        self.assertEqual(self.pool.checkout(), connection)
+        self.assertEqual(self.pool.stats['misses'], 1)
+        self.assertEqual(self.pool.stats['hits'], 1)
+        self.assertEqual(self.pool.stats['binds'], 1)
+        self.assertEqual(len(self.handles), 1)
+
+    def test_nested_checkout_shares_connection(self):
+        outer = self.pool.checkout()
+        inner = self.pool.checkout()
+        self.assertEqual(outer, inner)
+        self.pool.release(inner)
+        self.pool.release(outer)
+        self.assertEqual(self.pool.stats['misses'], 1)
+        self.assertEqual(self.pool.stats['binds'], 1)
+
+    def test_threads_get_separate_connections(self):
+        connection = self.pool.checkout()
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append(self.pool.checkout()))
+        thread.start()
+        thread.join()
+        self.assertNotEqual(other[0], connection)
+        self.assertEqual(self.pool.stats['misses'], 2)
+
+    def test_checkout_timeout(self):
+        """When every connection is held by another thread, checkout gives up
+        after checkout_timeout seconds."""
+        def hold_connection():
+            self.pool.checkout()
+        for _ in range(self.pool.size):
+            thread = threading.Thread(target=hold_connection)
+            thread.start()
+            thread.join()
+        self.assertIsNone(self.pool.checkout())
+        self.assertEqual(self.pool.stats['timeouts'], 1)
+
+    def test_reconnect_on_server_down(self):
+        connection = self.pool.checkout()
+        connection.handle.failures.append(ldap.SERVER_DOWN())
+        self.assertEqual(
+            connection.search_s('ou=People', ldap.SCOPE_SUBTREE), [])
+        self.assertEqual(self.pool.stats['reconnects'], 1)
+        self.assertEqual(self.pool.stats['binds'], 2)
+        self.assertEqual(len(self.handles), 2)
+
+    def test_no_retry_on_timeout(self):
+        connection = self.pool.checkout()
+        connection.handle.failures.append(ldap.TIMEOUT())
+        self.assertRaises(ldap.TIMEOUT, connection.search_s, 'ou=People',
+                          ldap.SCOPE_SUBTREE)
+        self.assertEqual(self.pool.stats['reconnects'], 0)
+        self.assertEqual(len(self.handles), 1)
+
+    def test_no_retry_for_writes(self):
+        """A write that fails because the connection was lost is not retried,
+        since the server may have applied it, but the connection is re-bound
+        before its next use.
+        """
+        connection = self.pool.checkout()
+        connection.handle.failures.append(ldap.SERVER_DOWN())
+        self.assertRaises(ldap.SERVER_DOWN, connection.modify_s,
+                          'uid=test', [])
+        self.assertEqual(self.handles[0].modifications, [])
+        self.assertEqual(self.pool.stats['reconnects'], 1)
+
+        connection.modify_s('uid=test', [])
+        self.assertEqual(len(self.handles), 2)
+        self.assertEqual(self.handles[1].modifications, [('uid=test', [])])
+        self.assertEqual(self.pool.stats['binds'], 2)
+
+    def test_health_check(self):
+        self.pool.health_check_interval = -1
+        connection = self.pool.checkout()
+        self.pool.release(connection)
+        connection.handle.failures.append(ldap.SERVER_DOWN())
+        connection = self.pool.checkout()
+        self.assertEqual(self.pool.stats['binds'], 2)
+        self.assertEqual(connection.handle, self.handles[-1])
+
+    def test_utils_use_pool(self):
+        """Nested utility calls bind once, and later calls bind no more."""
+        with patch('quark.qldap.utils.get_pool', return_value=self.pool):
+            # rename_user calls username_exists while holding a connection
+            self.assertEqual(utils.rename_user('oldname', 'newname'),
+                             (True, 'User oldname renamed to newname'))
+            self.assertFalse(utils.username_exists('user'))
+            self.assertFalse(utils.is_group_member('user', 'tbp-members'))
+        self.assertEqual(self.pool.stats['binds'], 1)
+        self.assertEqual(self.pool.stats['hits'], 2)
+
+    def test_pool_benchmark(self):
+        """Compare connecting for every lookup against pooled connections
+        on a server with 5ms round trips.
+        """
+        latency = 0.005
+        lookups = 40
+        with patch('ldap.initialize',
+                   side_effect=lambda uri: self.stub_initialize(uri, latency)):
+            start = time.time()
+            for _ in range(lookups):
+                ldap_handle = utils.initialize()
+                ldap_handle.search_s('ou=People', ldap.SCOPE_SUBTREE)
+                ldap_handle.unbind()
+            unpooled = time.time() - start
+
+            start = time.time()
+            with patch('quark.qldap.utils.get_pool', return_value=self.pool):
+                for _ in range(lookups):
+                    utils.username_exists('user')
+            pooled = time.time() - start
+
+        self.assertEqual(self.pool.stats['binds'], 1)
+        self.assertLess(pooled, unpooled,
+                        'pooled %.3fs, unpooled %.3fs for %d lookups' % (
+                            pooled, unpooled, lookups))
+
+
+class LDAPGroupCacheTest(TestCase):
+    def setUp(self):
+        self.pool = LDAPConnectionPool('uid=test', 'password')
+        self.handle = StubLDAPObject(entries=[
+            ('cn=tbp-members,ou=Group',
+             {'cn': ['tbp-members'],
+              'member': ['uid=member,ou=People', 'uid=officer,ou=People']}),
+            ('cn=tbp-officers,ou=Group',
+             {'cn': ['tbp-officers'], 'memberUid': ['officer']})])
+        # The test settings use a dummy cache, which caches nothing
+        self.cache = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache')
+        for patcher in [
+                patch('ldap.initialize', return_value=self.handle),
+                patch('quark.qldap.utils.get_pool', return_value=self.pool),
+                patch('quark.qldap.utils.cache', self.cache)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def test_lookup_cached(self):
+        self.handle.entries = [('cn=tbp-members,ou=Group', {})]
+        self.assertTrue(utils.is_in_tbp_group('member', 'members'))
+        self.assertTrue(utils.is_in_tbp_group('member', 'members'))
+        self.assertEqual(len(self.handle.searches), 1)
+
+        # Other users and groups are looked up separately
+        self.handle.entries = []
+        self.assertFalse(utils.is_in_tbp_group('member', 'officers'))
+        self.assertFalse(utils.is_in_tbp_group('other', 'members'))
+        self.assertFalse(utils.is_in_tbp_group('other', 'members'))
+        self.assertEqual(len(self.handle.searches), 3)
+
+    def test_uncached_group(self):
+        """Groups not in settings.LDAP_GROUPS are never cached."""
+        self.assertTrue(utils.is_group_member_cached('member', 'tbp-it'))
+        self.assertTrue(utils.is_group_member_cached('member', 'tbp-it'))
+        self.assertEqual(len(self.handle.searches), 2)
+
+    def test_errors_not_cached(self):
+        self.handle.failures.append(ldap.NO_SUCH_OBJECT())
+        self.assertFalse(utils.is_in_tbp_group('member', 'members'))
+        self.assertTrue(utils.is_in_tbp_group('member', 'members'))
+        self.assertEqual(len(self.handle.searches), 1)
+
+    def test_prefetch(self):
+        members = utils.prefetch_group_members()
+        self.assertEqual(members, {
+            'tbp-members': frozenset(['member', 'officer']),
+            'tbp-officers': frozenset(['officer'])})
+        self.assertEqual(len(self.handle.searches), 1)
+
+        self.assertTrue(utils.is_in_tbp_group('member', 'members'))
+        self.assertTrue(utils.is_in_tbp_group('officer', 'members'))
+        self.assertTrue(utils.is_in_tbp_group('officer', 'officers'))
+        self.assertFalse(utils.is_in_tbp_group('member', 'officers'))
+        self.assertFalse(utils.is_in_tbp_group('other', 'members'))
+        self.assertEqual(len(self.handle.searches), 1)
+
+    def test_mod_user_group_invalidates(self):
+        utils.prefetch_group_members()
+        self.assertFalse(utils.is_in_tbp_group('member', 'officers'))
+        self.handle.entries = [
+            ('cn=tbp-officers,ou=Group', {'objectClass': ['posixGroup']})]
+        self.assertTrue(utils.mod_user_group('member', 'tbp-officers'))
+        self.assertTrue(utils.is_in_tbp_group('member', 'officers'))
+        # The other cached group is unaffected
+        num_searches = len(self.handle.searches)
+        self.assertTrue(utils.is_in_tbp_group('member', 'members'))
+        self.assertEqual(len(self.handle.searches), num_searches)
+
+    def test_clear_group_members_invalidates(self):
+        self.handle.entries = [('cn=tbp-officers,ou=Group', {})]
+        self.assertTrue(utils.is_in_tbp_group('officer', 'officers'))
+        self.handle.entries = [
+            ('cn=tbp-officers,ou=Group',
+             {'objectClass': ['posixGroup'], 'memberUid': ['officer']})]
+        self.assertTrue(utils.clear_group_members('tbp-officers'))
+        self.handle.entries = []
+        self.assertFalse(utils.is_in_tbp_group('officer', 'officers'))
+
+    def test_rename_user_invalidates(self):
+        utils.prefetch_group_members()
+        self.handle.entries = []
+        self.assertTrue(utils.rename_user('officer', 'newofficer')[0])
+        self.assertFalse(utils.is_in_tbp_group('officer', 'officers'))
+        self.assertFalse(utils.is_in_tbp_group('officer', 'members'))
+
+
+class LDAPGroupSyncTest(TestCase):
+    def setUp(self):
+        self.term = Term.objects.create(term=Term.SPRING, year=2012,
+                                        current=True)
+        past_term = Term.objects.create(term=Term.FALL, year=2011)
+        position = OfficerPosition.objects.create(
+            short_name='it', long_name='Information Technology', rank=2,
+            mailing_list='it')
+        self.users = {}
+        for username in ['officer', 'member', 'candidate', 'initiate']:
+            self.users[username] = get_user_model().objects.create_user(
+                username=username,
+                email='{}@tbp.berkeley.edu'.format(username),
+                password='password',
+                first_name='Test',
+                last_name=username)
+        Officer.objects.create(user=self.users['officer'], position=position,
+                               term=past_term)
+        StudentOrgUserProfile.objects.create(
+            user=self.users['member'], initiation_term=past_term)
+        Candidate.objects.create(user=self.users['candidate'], term=self.term)
+        Candidate.objects.create(user=self.users['initiate'], term=self.term,
+                                 initiated=True)
+
+        self.people = settings.LDAP_BASE['PEOPLE']
+        self.pool = LDAPConnectionPool('uid=test', 'password')
+        self.handle = StubLDAPObject(entries=[
+            ('cn=tbp-candidates,ou=Group',
+             {'cn': ['tbp-candidates'], 'objectClass': ['posixGroup'],
+              'memberUid': ['candidate', 'formercandidate']}),
+            ('cn=tbp-members,ou=Group',
+             {'cn': ['tbp-members'], 'objectClass': ['groupOfNames'],
+              'member': [settings.LDAP_DEFAULT_USER,
+                         'uid=oldmember,' + self.people]}),
+            ('cn=tbp-officers,ou=Group',
+             {'cn': ['tbp-officers'], 'objectClass': ['posixGroup'],
+              'memberUid': ['officer', 'oldofficer']})])
+        for patcher in [
+                patch('ldap.initialize', return_value=self.handle),
+                patch('quark.qldap.utils.get_pool', return_value=self.pool)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_paged_search(self):
+        with utils.service_connection() as ldap_handle:
+            entries = utils.paged_search_s(
+                ldap_handle, settings.LDAP_BASE['GROUP'],
+                settings.LDAP['SCOPE'], '(cn=*)', page_size=2)
+        self.assertEqual(entries, self.handle.entries)
+        self.assertEqual(len(self.handle.searches), 2)
+
+    def test_sync(self):
+        changes, errors = sync_ldap_groups()
+        self.assertEqual(errors, [])
+        self.assertEqual(changes, {
+            'tbp-candidates': ([], ['formercandidate']),
+            'tbp-members': (['initiate', 'member', 'officer'], [])})
+        self.assertEqual(len(self.handle.searches), 1)
+        # Members of tbp-members and tbp-officers are never removed, and
+        # each group is changed with one modify
+        self.assertEqual(self.handle.modifications, [
+            ('cn=tbp-candidates,ou=Group',
+             [(MOD_DELETE, 'memberUid', ['formercandidate'])]),
+            ('cn=tbp-members,ou=Group',
+             [(MOD_ADD, 'member', ['uid=initiate,' + self.people,
+                                   'uid=member,' + self.people,
+                                   'uid=officer,' + self.people])])])
+
+    def test_dry_run(self):
+        changes, errors = sync_ldap_groups(dry_run=True)
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(changes), ['tbp-candidates', 'tbp-members'])
+        self.assertEqual(self.handle.modifications, [])
+
+    def test_default_user(self):
+        """The default user is added to a groupOfNames that would otherwise
+        be left empty, and is never removed.
+        """
+        Candidate.objects.filter(user=self.users['candidate']).update(
+            initiated=True)
+        self.handle.entries = [
+            ('cn=tbp-candidates,ou=Group',
+             {'cn': ['tbp-candidates'], 'objectClass': ['groupOfNames'],
+              'member': ['uid=candidate,' + self.people]})]
+        changes, errors = sync_ldap_groups(groups=['tbp-candidates'])
+        self.assertEqual(errors, [])
+        self.assertEqual(changes, {'tbp-candidates': ([], ['candidate'])})
+        self.assertEqual(self.handle.modifications, [
+            ('cn=tbp-candidates,ou=Group',
+             [(MOD_ADD, 'member', [settings.LDAP_DEFAULT_USER]),
+              (MOD_DELETE, 'member', ['uid=candidate,' + self.people])])])
+
+    def test_errors(self):
+        self.handle.entries = self.handle.entries[:1]
+        changes, errors = sync_ldap_groups(
+            groups=['tbp-candidates', 'tbp-members', 'tbp-it'])
+        self.assertEqual(changes, {'tbp-candidates': ([], ['formercandidate'])})
+        self.assertEqual(errors, ['Cannot synchronize LDAP group tbp-it',
+                                  'LDAP group tbp-members does not exist'])
+
+        self.handle.failures.append(ldap.NO_SUCH_OBJECT())
+        changes, errors = sync_ldap_groups(groups=['tbp-candidates'])
+        self.assertEqual(changes, {})
+        self.assertEqual(len(errors), 1)
+
+    def test_sync_user(self):
+        """Only the user's own memberships are changed, and undoing an
+        initiation removes the user from tbp-members again.
+        """
+        groups = settings.LDAP_BASE['GROUP']
+        server = InMemoryLDAPServer(entries={
+            'uid=test': {'userPassword': ['password']},
+            'cn=tbp-candidates,' + groups: {
+                'cn': ['tbp-candidates'], 'objectClass': ['posixGroup'],
+                'memberUid': ['candidate', 'formercandidate']},
+            'cn=tbp-members,' + groups: {
+                'cn': ['tbp-members'], 'objectClass': ['groupOfNames'],
+                'member': [settings.LDAP_DEFAULT_USER,
+                           'uid=oldmember,' + self.people,
+                           'uid=officer,' + self.people]}})
+        candidate_dn = 'uid=candidate,' + self.people
+
+        def get_members(group):
+            entry = server.search('cn={},{}'.format(group, groups),
+                                  ldap.SCOPE_BASE)[0][1]
+            return sorted(entry.get('memberUid', entry.get('member')))
+
+        with patch('ldap.initialize', side_effect=server.initialize):
+            candidate = Candidate.objects.get(user=self.users['candidate'])
+            candidate.initiated = True
+            candidate.save()
+            self.assertEqual(sync_user_ldap_groups(candidate.user), [])
+            self.assertEqual(get_members('tbp-candidates'),
+                             ['formercandidate'])
+            self.assertIn(candidate_dn, get_members('tbp-members'))
+            # The pooled connection's bind, two searches and a modify of
+            # each group
+            self.assertEqual(server.round_trips, 5)
+
+            candidate.initiated = False
+            candidate.save()
+            self.assertEqual(sync_user_ldap_groups(candidate.user), [])
+            self.assertEqual(get_members('tbp-candidates'),
+                             ['candidate', 'formercandidate'])
+            self.assertNotIn(candidate_dn, get_members('tbp-members'))
+
+            # Nothing is changed for users who are already in the right
+            # groups, and officers are not removed from tbp-members
+            server.round_trips = 0
+            self.assertEqual(sync_user_ldap_groups(self.users['officer']), [])
+            self.assertEqual(server.round_trips, 2)
+            self.assertIn('uid=officer,' + self.people,
+                          get_members('tbp-members'))
+
+    def test_term_rollover(self):
+        with override_settings(USE_LDAP=True):
+            Term.objects.create(term=Term.FALL, year=2012, current=True)
+        self.assertEqual(len(self.handle.searches), 1)
+        # The candidates of the old term are removed
+        self.assertEqual(self.handle.modifications[0], (
+            'cn=tbp-candidates,ou=Group',
+            [(MOD_DELETE, 'memberUid', ['candidate', 'formercandidate'])]))
+
+        # Saving the current term again, or a term that is not current, does
+        # not synchronize the groups
+        with override_settings(USE_LDAP=True):
+            Term.objects.get_current_term().save()
+            Term.objects.get(pk=self.term.pk).save()
+        self.assertEqual(len(self.handle.searches), 1)
+
+    def test_term_rollover_errors(self):
+        """Errors synchronizing the groups at term rollover are emailed to
+        the admins.
+        """
+        with override_settings(USE_LDAP=True):
+            with patch('quark.qldap.sync.mail_admins') as mock_mail_admins:
+                with patch('quark.qldap.utils.service_connection') as mock_cm:
+                    mock_cm.return_value.__enter__.return_value = None
+                    Term.objects.create(term=Term.FALL, year=2012,
+                                        current=True)
+        self.assertEqual(mock_mail_admins.call_count, 1)
+        self.assertIn('Could not connect to LDAP',
+                      mock_mail_admins.call_args[0][1])
+
+
+class LDAPAuthenticationTest(TestCase):
+    def setUp(self):
+        self.people = settings.LDAP_BASE['PEOPLE']
+        self.server = InMemoryLDAPServer(entries={
+            'uid=service,ou=System': {'userPassword': ['secret']},
+            'uid=user,' + self.people: {
+                'objectClass': ['inetOrgPerson'],
+                'uid': ['user'],
+                'givenName': ['Random'],
+                'sn': ['User'],
+                'mail': ['user@tbp.berkeley.edu'],
+                'userPassword': [utils.obfuscate('password')]}})
+        self.pool = LDAPConnectionPool('uid=service,ou=System', 'secret')
+        self.auth_pool = LDAPConnectionPool(None, None)
+        for patcher in [
+                patch('ldap.initialize', side_effect=self.server.initialize),
+                patch('quark.qldap.utils.get_pool', return_value=self.pool),
+                patch('quark.qldap.utils.get_auth_pool',
+                      return_value=self.auth_pool)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_check_password(self):
+        self.assertTrue(utils.check_password('user', 'password'))
+        self.assertFalse(utils.check_password('user', 'wrongpassword'))
+        self.assertFalse(utils.check_password('user', ''))
+        self.assertFalse(utils.check_password('nobody', 'password'))
+
+        # Checking a password takes a bind and a search on a pooled
+        # connection, and never uses the service connection
+        self.server.round_trips = 0
+        self.assertTrue(utils.check_password('user', 'password'))
+        self.assertEqual(self.server.round_trips, 2)
+        self.assertEqual(self.auth_pool.stats['misses'], 1)
+        self.assertEqual(self.pool.stats['misses'], 0)
+
+    def test_unusable_password(self):
+        self.server.add_entry('uid=unusable,' + self.people, {
+            'objectClass': ['inetOrgPerson'],
+            'userPassword': [utils.obfuscate(None)]})
+        self.assertFalse(utils.check_password('unusable', 'password'))
+
+    def test_password_upgraded(self):
+        """MD5 password hashes are replaced with SSHA hashes."""
+        self.server.add_entry('uid=legacy,' + self.people, {
+            'objectClass': ['inetOrgPerson'],
+            'userPassword': ['{MD5}X03MO1qnZdYdgyfeuILPmQ==']})
+        self.assertTrue(utils.check_password('legacy', 'password'))
+        pw_hash = self.server.search(
+            'uid=legacy,' + self.people, ldap.SCOPE_BASE)[0][1][
+            'userPassword'][0]
+        self.assertTrue(pw_hash.startswith(utils.LDAP_HASH_PREFIX))
+        self.assertTrue(utils.check_password('legacy', 'password'))
+
+    @override_settings(USE_LDAP=True)
+    def test_backend_creates_user(self):
+        self.server.round_trips = 0
+        user = LDAPBackend().authenticate('user', 'password')
+        self.assertEqual(self.server.round_trips, 2)
+        self.assertEqual(user.get_username(), 'user')
+        self.assertEqual(user.get_full_name(), 'Random User')
+        self.assertEqual(user.email, 'user@tbp.berkeley.edu')
+        self.assertFalse(user.has_usable_password())
+
+        self.assertEqual(LDAPBackend().authenticate('user', 'password'), user)
+        self.assertIsNone(LDAPBackend().authenticate('user', 'wrong'))
+
+    def test_login_benchmark(self):
+        """Compare binding on a new connection and searching on the service
+        connection (as check_password and the backend used to) against
+        authenticate_user on a server with 5ms round trips.
+        """
+        self.server.latency = 0.005
+        logins = 20
+        user_dn = 'uid=user,' + self.people
+        searchstr = '(&(objectClass=inetOrgPerson)(uid=user))'
+        attrlist = ['uid', 'givenName', 'sn', 'mail']
+        # Warm up the connection pools
+        utils.authenticate_user('user', 'password')
+        utils.username_exists('user')
+
+        self.server.round_trips = 0
+        start = time.time()
+        for _ in range(logins):
+            with utils.service_connection() as ldap_handle:
+                user_handle = utils.initialize(user_dn, 'password')
+                user_handle.unbind()
+                ldap_handle.search_s(self.people, ldap.SCOPE_SUBTREE,
+                                     searchstr, ['userPassword'])
+                ldap_handle.search_s(self.people, ldap.SCOPE_SUBTREE,
+                                     searchstr, attrlist)
+        separate = time.time() - start
+        separate_round_trips = self.server.round_trips
+
+        self.server.round_trips = 0
+        start = time.time()
+        for _ in range(logins):
+            utils.authenticate_user('user', 'password', attrlist=attrlist)
+        direct = time.time() - start
+
+        self.assertEqual(separate_round_trips, 3 * logins)
+        self.assertEqual(self.server.round_trips, 2 * logins)
+        self.assertLess(direct, separate,
+                        'direct bind %.3fs, separate %.3fs for %d logins' % (
+                            direct, separate, logins))
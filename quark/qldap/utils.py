@@ -8,14 +8,20 @@ import os
 import random
 import re
 import string
+from contextlib import contextmanager
+from ldap.controls import SimplePagedResultsControl
 
 from django.conf import settings
 from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
 from django.contrib.auth.hashers import UNUSABLE_PASSWORD_SUFFIX_LENGTH
+from django.core.cache import cache
 from django.core.mail import mail_admins
 from django.utils.crypto import get_random_string
 from django.utils.encoding import smart_bytes
 
+from quark.qldap.pool import get_auth_pool
+from quark.qldap.pool import get_pool
+
 
 # Compile username validator, or match all if not set.
 USERNAME_REGEX = re.compile(settings.VALID_USERNAME or '')
@@ -25,6 +31,13 @@ LDAP_HASH_PREFIX = '{SSHA}'
 # OpenLDAP salt must be 4 bytes
 LDAP_SALT_LENGTH = 4
 
+# The number of entries requested at a time by paged_search_s
+LDAP_PAGE_SIZE = 500
+
+# Groups whose memberships are cached (see is_group_member_cached)
+CACHED_GROUPS = frozenset(
+    group for groups in settings.LDAP_GROUPS.values() for group in groups)
+
 
 # smart_bytes is used to convert unicode to byte strings for python-ldap.
 # In the future, when python-ldap supports python3/unicode,
@@ -48,23 +61,47 @@ def initialize(base_dn=settings.LDAP_BASE['DN'],
         return None
 
 
+@contextmanager
+def service_connection():
+    """
+    Borrows a connection bound as the base DN from the connection pool, and
+    gives it back to the pool afterwards. Nested uses within the same thread
+    share one connection.
+    Yields None if no connection could be made.
+    """
+    pool = get_pool()
+    try:
+        ldap_handle = pool.checkout()
+    except ldap.INVALID_CREDENTIALS:
+        ldap_handle = None
+    except ldap.LDAPError as e:
+        mail_admins('LDAP Anomaly Detected',
+                    'LDAP problem occurred on initialization: %s' % e)
+        ldap_handle = None
+    try:
+        yield ldap_handle
+    finally:
+        if ldap_handle is not None:
+            pool.release(ldap_handle)
+
+
 def username_exists(username):
     """
     Checks if the username is in the People tree.
     Returns True/False, or None upon error.
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return None
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return None
 
-    searchstr = '(uid=%s)' % smart_bytes(username)
-    try:
-        entry = ldap_handle.search_s(settings.LDAP_BASE['PEOPLE'],
-                                     settings.LDAP['SCOPE'],
-                                     searchstr)
-        return bool(entry)
-    except ldap.LDAPError:
-        return None
+        searchstr = '(uid=%s)' % smart_bytes(username)
+        try:
+            entry = ldap_handle.search_s(settings.LDAP_BASE['PEOPLE'],
+                                         settings.LDAP['SCOPE'],
+                                         searchstr)
+            return bool(entry)
+        except ldap.LDAPError:
+            return None
 
 
 def create_user(username, password, email, first_name, last_name):
@@ -81,33 +118,32 @@ def create_user(username, password, email, first_name, last_name):
     if USERNAME_REGEX.match(username) is None:
         return False
 
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    user_uid = smart_bytes(username)
-    user_gn = smart_bytes(first_name)
-    user_sn = smart_bytes(last_name)
-    mail = smart_bytes(email)
-
-    user_dn = 'uid=%s,%s' % (user_uid, settings.LDAP_BASE['PEOPLE'])
-    attr = [
-        ('objectClass', ['top', 'inetOrgPerson']),
-        ('uid', user_uid),
-        ('userPassword', obfuscate(password)),
-        ('givenName', user_gn),
-        ('sn', user_sn),
-        ('cn', '%s %s' % (user_gn, user_sn)),
-        ('mail', mail)
-    ]
+        user_uid = smart_bytes(username)
+        user_gn = smart_bytes(first_name)
+        user_sn = smart_bytes(last_name)
+        mail = smart_bytes(email)
+
+        user_dn = 'uid=%s,%s' % (user_uid, settings.LDAP_BASE['PEOPLE'])
+        attr = [
+            ('objectClass', ['top', 'inetOrgPerson']),
+            ('uid', user_uid),
+            ('userPassword', obfuscate(password)),
+            ('givenName', user_gn),
+            ('sn', user_sn),
+            ('cn', '%s %s' % (user_gn, user_sn)),
+            ('mail', mail)
+        ]
 
-    try:
-        ldap_handle.add_s(user_dn, attr)
-    except ldap.ALREADY_EXISTS:
-        return False
+        try:
+            ldap_handle.add_s(user_dn, attr)
+        except ldap.ALREADY_EXISTS:
+            return False
 
-    ldap_handle.unbind()
-    return True
+        return True
 
 
 def delete_user(username):
@@ -118,20 +154,19 @@ def delete_user(username):
     if not username:
         return False
 
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    user_uid = smart_bytes(username)
-    user_dn = 'uid=%s,%s' % (user_uid, settings.LDAP_BASE['PEOPLE'])
+        user_uid = smart_bytes(username)
+        user_dn = 'uid=%s,%s' % (user_uid, settings.LDAP_BASE['PEOPLE'])
 
-    try:
-        ldap_handle.delete_s(user_dn)
-    except ldap.LDAPError:
-        return False
+        try:
+            ldap_handle.delete_s(user_dn)
+        except ldap.LDAPError:
+            return False
 
-    ldap_handle.unbind()
-    return True
+        return True
 
 
 def rename_user(username, new_username):
@@ -143,49 +178,53 @@ def rename_user(username, new_username):
     if not (username and new_username):
         return (False, 'Invalid username argument(s)')
 
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return (False, 'LDAP connection failed')
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return (False, 'LDAP connection failed')
 
-    username = smart_bytes(username)
-    new_username = smart_bytes(new_username)
+        username = smart_bytes(username)
+        new_username = smart_bytes(new_username)
 
-    # Validate new username
-    if USERNAME_REGEX.match(new_username) is None:
-        return (False, 'Invalid username. ' + settings.USERNAME_HELPTEXT)
+        # Validate new username
+        if USERNAME_REGEX.match(new_username) is None:
+            return (False, 'Invalid username. ' + settings.USERNAME_HELPTEXT)
 
-    # Make sure new username not yet taken
-    if username_exists(new_username):
-        return (False, 'Requested username is already taken')
+        # Make sure new username not yet taken
+        if username_exists(new_username):
+            return (False, 'Requested username is already taken')
 
-    old_dn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
-    new_rdn = 'uid=%s' % (new_username)
+        old_dn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
+        new_rdn = 'uid=%s' % (new_username)
 
-    try:
-        ldap_handle.rename_s(old_dn, new_rdn)
-    except ldap.LDAPError:
-        return (False, 'LDAP error while renaming user')
+        try:
+            ldap_handle.rename_s(old_dn, new_rdn)
+        except ldap.LDAPError:
+            return (False, 'LDAP error while renaming user')
 
-    # Search in posixGroups (i.e. cn=web) for old username and replace
-    # with new username. groupOfNames are automatically changed by rename_s
-    search_str = '(memberUid=%s)' % (username)
-    try:
-        group_results = ldap_handle.search_s(
-            settings.LDAP_BASE['GROUP'], settings.LDAP['SCOPE'], search_str)
-    except ldap.LDAPError:
-        return (False, 'LDAP error while searching for group memberships')
-
-    for (gdn, gattr) in group_results:
-        new_g = copy.copy(gattr)
-        new_g['memberUid'] = [member if member != username else new_username
-                              for member in gattr['memberUid']]
-        mod_g = ldap.modlist.modifyModlist(gattr, new_g)
+        # Group memberships follow the user to the new username
+        for group in CACHED_GROUPS:
+            invalidate_group_membership(group, [username, new_username])
+
+        # Search in posixGroups (i.e. cn=web) for old username and replace
+        # with new username. groupOfNames are automatically changed by rename_s
+        search_str = '(memberUid=%s)' % (username)
         try:
-            ldap_handle.modify_s(gdn, mod_g)
+            group_results = ldap_handle.search_s(
+                settings.LDAP_BASE['GROUP'], settings.LDAP['SCOPE'], search_str)
         except ldap.LDAPError:
-            return (False, 'LDAP error while migrating groups')
+            return (False, 'LDAP error while searching for group memberships')
+
+        for (gdn, gattr) in group_results:
+            new_g = copy.copy(gattr)
+            new_g['memberUid'] = [member if member != username else new_username
+                                  for member in gattr['memberUid']]
+            mod_g = ldap.modlist.modifyModlist(gattr, new_g)
+            try:
+                ldap_handle.modify_s(gdn, mod_g)
+            except ldap.LDAPError:
+                return (False, 'LDAP error while migrating groups')
 
-    return (True, 'User %s renamed to %s' % (username, new_username))
+        return (True, 'User %s renamed to %s' % (username, new_username))
 
 
 def mod_user_group(username, group, action=ldap.MOD_ADD):
@@ -196,25 +235,26 @@ def mod_user_group(username, group, action=ldap.MOD_ADD):
     if action not in [ldap.MOD_ADD, ldap.MOD_DELETE]:
         return False
 
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    username = smart_bytes(username)
-    group = smart_bytes(group)
+        username = smart_bytes(username)
+        group = smart_bytes(group)
 
-    gdn = 'cn=%s,%s' % (group, settings.LDAP_BASE['GROUP'])
-    if get_group_member_attr(group) == 'memberUid':
-        attr = [(action, 'memberUid', username)]
-    else:
-        udn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
-        attr = [(action, 'member', udn)]
+        gdn = 'cn=%s,%s' % (group, settings.LDAP_BASE['GROUP'])
+        if get_group_member_attr(group) == 'memberUid':
+            attr = [(action, 'memberUid', username)]
+        else:
+            udn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
+            attr = [(action, 'member', udn)]
 
-    try:
-        ldap_handle.modify_s(gdn, attr)
-    except ldap.LDAPError:
-        return False
-    return True
+        try:
+            ldap_handle.modify_s(gdn, attr)
+        except ldap.LDAPError:
+            return False
+        invalidate_group_membership(group, [username])
+        return True
 
 
 def set_password(username, password):
@@ -222,19 +262,19 @@ def set_password(username, password):
     Sets the user's password, overwriting the old one.
     Returns True on success, False otherwise (including errors)
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    username = smart_bytes(username)
-    udn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
-    attr = [(ldap.MOD_REPLACE, 'userPassword', obfuscate(password))]
+        username = smart_bytes(username)
+        udn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
+        attr = [(ldap.MOD_REPLACE, 'userPassword', obfuscate(password))]
 
-    try:
-        ldap_handle.modify_s(udn, attr)
-    except ldap.LDAPError:
-        return False
-    return True
+        try:
+            ldap_handle.modify_s(udn, attr)
+        except ldap.LDAPError:
+            return False
+        return True
 
 
 def set_email(username, email):
@@ -242,30 +282,30 @@ def set_email(username, email):
     Set the email attribute in LDAP. Used for Officer email forwarding.
     Although LDAP allows multiple email attributes, we only allow one.
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    username = smart_bytes(username)
-    email = smart_bytes(email)
+        username = smart_bytes(username)
+        email = smart_bytes(email)
 
-    udn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
-    try:
-        email_results = ldap_handle.search_s(
-            udn, settings.LDAP['SCOPE'], '(mail=*)')
-    except ldap.LDAPError:
-        return False
+        udn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
+        try:
+            email_results = ldap_handle.search_s(
+                udn, settings.LDAP['SCOPE'], '(mail=*)')
+        except ldap.LDAPError:
+            return False
 
-    if len(email_results) == 0:
-        attr = [(ldap.MOD_ADD, 'mail', email)]
-    else:
-        attr = [(ldap.MOD_REPLACE, 'mail', email)]
+        if len(email_results) == 0:
+            attr = [(ldap.MOD_ADD, 'mail', email)]
+        else:
+            attr = [(ldap.MOD_REPLACE, 'mail', email)]
 
-    try:
-        ldap_handle.modify_s(udn, attr)
-    except ldap.LDAPError:
-        return False
-    return True
+        try:
+            ldap_handle.modify_s(udn, attr)
+        except ldap.LDAPError:
+            return False
+        return True
 
 
 def get_email(username):
@@ -273,82 +313,103 @@ def get_email(username):
     Gets the user's email attribute from LDAP
     Returns the string (currently bytestring) or False if an error occurred.
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
+        username = smart_bytes(username)
+        udn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
+        try:
+            entry = ldap_handle.search_s(
+                udn, settings.LDAP['SCOPE'], '(mail=*)', ['mail'])
+        except ldap.LDAPError:
+            return False
+        entry_len = len(entry)
+        if entry_len == 0:
+            mail_admins(
+                'LDAP Anomaly Detected',
+                'No search results found for %s in "get_email"' % username)
+        elif entry_len > 1:
+            entries = []
+            for e in entry:
+                entries.append(e[0])
+            mail_admins('LDAP Anomaly Detected',
+                        'Multiple search results for %s in "get_email":\n%s' % (
+                            username, '\n'.join(entries)))
+            return False
+        # Invalid search result. Each search result must be a 2-tuple
+        if len(entry[0]) != 2:
+            return False
+        return get_property(entry[0][1], 'mail') or False
+
+
+def authenticate_user(username, password, attrlist=()):
+    """
+    Verifies the user's password by binding as the user on a connection
+    borrowed from the authentication pool, and then reads the user's own
+    entry on the same connection with one base search: its userPassword, so
+    that an MD5 hash can be upgraded to salted SHA1 (SSHA), along with the
+    attributes in attrlist (e.g., to create a Django user).
+    Returns a dictionary of the attributes read if the password is correct
+    (empty if the entry could not be read), or None otherwise (including
+    errors).
+    """
+    # don't allow blank username or password
+    # This is important because a binding with a blank password can be
+    # interpreted as an anonymous bind, which would succeed when it should
+    # not.
+    if not username or not password:
+        return None
     username = smart_bytes(username)
-    udn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
+    password = smart_bytes(password)
+    user_dn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
+
+    pool = get_auth_pool()
     try:
-        entry = ldap_handle.search_s(
-            udn, settings.LDAP['SCOPE'], '(mail=*)', ['mail'])
-    except ldap.LDAPError:
-        return False
-    entry_len = len(entry)
-    if entry_len == 0:
+        ldap_handle = pool.checkout()
+    except ldap.LDAPError as e:
         mail_admins('LDAP Anomaly Detected',
-                    'No search results found for %s in "get_email"' % username)
-    elif entry_len > 1:
-        entries = []
-        for e in entry:
-            entries.append(e[0])
+                    'LDAP problem occurred on initialization: %s' % e)
+        return None
+    if ldap_handle is None:
+        return None
+
+    try:
+        try:
+            ldap_handle.simple_bind_s(user_dn, password)
+        except ldap.LDAPError:
+            return None
+        try:
+            entry = ldap_handle.search_s(
+                user_dn, ldap.SCOPE_BASE, '(objectClass=inetOrgPerson)',
+                ['userPassword'] + list(attrlist))
+        except ldap.LDAPError:
+            entry = []
+    finally:
+        pool.release(ldap_handle)
+
+    # entry should be of the form:
+    # [(DN, {'userPassword': ['password',], ...}),]
+    if len(entry) != 1 or len(entry[0]) != 2:
         mail_admins('LDAP Anomaly Detected',
-                    'Multiple search results for %s in "get_email":\n%s' % (
-                        username, '\n'.join(entries)))
-        return False
-    # Invalid search result. Each search result must be a 2-tuple
-    if len(entry[0]) != 2:
-        return False
-    return get_property(entry[0][1], 'mail') or False
+                    ('Non-standard password results for %s in '
+                     'authenticate_user') % username)
+        return {}
+    attributes = entry[0][1]
+    # Automatically update password to new hash algorithm
+    pw_hash = get_property(attributes, 'userPassword')
+    if pw_hash and LDAP_HASH_PREFIX not in pw_hash:
+        set_password(username, password)
+    return attributes
 
 
 def check_password(username, password):
     """
     Returns True if (unhashed) password matches the user's password in LDAP.
-    This authenticates using LDAP bind. Upon a successful bind, it will
-    upgrade an MD5 hash to salted SHA1 (SSHA) if applicable.
+    This authenticates using LDAP bind (see authenticate_user), and upgrades
+    an MD5 hash to salted SHA1 (SSHA) if applicable.
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
-
-    # don't allow blank username or password
-    # This is important because a binding with a blank password can be
-    # interpreted as an anonymous bind, which would succeed when it should not.
-    if username and password:
-        username = smart_bytes(username)
-        password = smart_bytes(password)
-
-        # attempt to bind as user
-        user_dn = 'uid=%s,%s' % (username, settings.LDAP_BASE['PEOPLE'])
-        out = initialize(user_dn, password)
-        if out is None:
-            return False
-        else:
-            # Authentication successful; attempt to migrate password
-            # Then return success
-            searchstr = '(&(objectClass=inetOrgPerson)(uid=%s))' % username
-            try:
-                pw_result = ldap_handle.search_s(
-                    settings.LDAP_BASE['PEOPLE'],
-                    settings.LDAP['SCOPE'],
-                    searchstr,
-                    ['userPassword'])
-            except ldap.LDAPError:
-                return False
-            # pw_result must be of the form:
-            # [(DN, {'userPassword': ['password',],}),]
-            if len(pw_result) != 1 or len(pw_result[0]) != 2:
-                mail_admins('LDAP Anomaly Detected',
-                            ('Non-standard password results for %s in'
-                             'check_password') % username)
-            # Automatically update password to new hash algorithm
-            if LDAP_HASH_PREFIX not in pw_result[0][1]['userPassword'][0]:
-                set_password(username, password)
-            return True
-    else:
-        # Bad username or password
-        return False
+    return authenticate_user(username, password) is not None
 
 
 def has_usable_password(username):
@@ -356,30 +417,30 @@ def has_usable_password(username):
     Gets the user's password entry from LDAP.
     Returns False if it's an unusable password, or encounters LDAP errors
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    username = smart_bytes(username)
-    try:
-        entry = ldap_handle.search_s(
-            settings.LDAP_BASE['PEOPLE'],
-            settings.LDAP['SCOPE'],
-            '(uid=%s)' % username,
-            ['userPassword'])
-    except ldap.LDAPError:
-        return False
-    entry_len = len(entry)
-    if entry_len != 1:
-        mail_admins('LDAP Anomaly Detected',
-                    'Found %d userPassword attributes for %s ' % (
-                        entry_len,
-                        username))
-    # Invalid search result. Each search result must be a 2-tuple
-    if len(entry[0]) != 2:
-        return False
-    pw_hash = get_property(entry[0][1], 'userPassword')
-    return pw_hash and UNUSABLE_PASSWORD_PREFIX not in pw_hash
+        username = smart_bytes(username)
+        try:
+            entry = ldap_handle.search_s(
+                settings.LDAP_BASE['PEOPLE'],
+                settings.LDAP['SCOPE'],
+                '(uid=%s)' % username,
+                ['userPassword'])
+        except ldap.LDAPError:
+            return False
+        entry_len = len(entry)
+        if entry_len != 1:
+            mail_admins('LDAP Anomaly Detected',
+                        'Found %d userPassword attributes for %s ' % (
+                            entry_len,
+                            username))
+        # Invalid search result. Each search result must be a 2-tuple
+        if len(entry[0]) != 2:
+            return False
+        pw_hash = get_property(entry[0][1], 'userPassword')
+        return pw_hash and UNUSABLE_PASSWORD_PREFIX not in pw_hash
 
 
 def get_property(attributes, key, index=0):
@@ -435,26 +496,142 @@ def obfuscate(password):
 def is_group_member(username, group):
     """
     Checks if the user is a member of an LDAP Group.
-    Returns False if any errors are encountered
+    Returns True/False, or None upon error.
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return None
 
-    username = smart_bytes(username)
-    group = smart_bytes(group)
+        username = smart_bytes(username)
+        group = smart_bytes(group)
 
-    filter_pattern = '(&(cn=%s)(|(memberUid=%s)(member=uid=%s,%s)))' % (
-        group, username, username, settings.LDAP_BASE['PEOPLE'])
+        filter_pattern = '(&(cn=%s)(|(memberUid=%s)(member=uid=%s,%s)))' % (
+            group, username, username, settings.LDAP_BASE['PEOPLE'])
 
-    try:
-        result = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
-                                      settings.LDAP['SCOPE'],
-                                      filter_pattern)
-    except ldap.LDAPError:
+        try:
+            result = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
+                                          settings.LDAP['SCOPE'],
+                                          filter_pattern)
+        except ldap.LDAPError:
+            return None
+
+        return len(result) > 0
+
+
+def _member_cache_key(username, group):
+    return 'ldap_group_member:%s:%s' % (smart_bytes(group),
+                                        smart_bytes(username))
+
+
+def _members_cache_key(group):
+    return 'ldap_group_members:%s' % smart_bytes(group)
+
+
+def _member_username(member):
+    """
+    Returns the username for a group member entry, which is either a username
+    (memberUid) or a user DN (member).
+    """
+    if member.startswith('uid='):
+        return member.split(',', 1)[0][len('uid='):]
+    return member
+
+
+def is_group_member_cached(username, group):
+    """
+    Like is_group_member, but answers from the cache if possible. Lookups are
+    cached for settings.LDAP_GROUP_CACHE_TIMEOUT seconds, but only for the
+    groups in settings.LDAP_GROUPS (i.e., CACHED_GROUPS).
+    Both the (username, group) entries cached by this function and the whole
+    groups cached by prefetch_group_members are used.
+    Returns False if any errors are encountered, and errors are not cached.
+    """
+    if group not in CACHED_GROUPS:
+        return bool(is_group_member(username, group))
+
+    member_key = _member_cache_key(username, group)
+    members_key = _members_cache_key(group)
+    cached = cache.get_many([member_key, members_key])
+    if member_key in cached:
+        return cached[member_key]
+    if members_key in cached:
+        return smart_bytes(username) in cached[members_key]
+
+    is_member = is_group_member(username, group)
+    if is_member is None:
         return False
+    cache.set(member_key, is_member, settings.LDAP_GROUP_CACHE_TIMEOUT)
+    return is_member
 
-    return len(result) > 0
+
+def prefetch_group_members(groups=('tbp-members', 'tbp-officers')):
+    """
+    Fetches the members of all of the given groups with one LDAP search, and
+    caches them so that is_group_member_cached can answer for any user in
+    those groups without searching LDAP.
+    Returns a dictionary mapping each group found to a frozenset of its
+    members' usernames, or None upon error.
+    """
+    groups = [smart_bytes(group) for group in groups]
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return None
+
+        searchstr = '(|%s)' % ''.join(['(cn=%s)' % group for group in groups])
+        try:
+            entries = ldap_handle.search_s(
+                settings.LDAP_BASE['GROUP'], settings.LDAP['SCOPE'], searchstr,
+                ['cn', 'member', 'memberUid'])
+        except ldap.LDAPError:
+            return None
+
+    group_members = {}
+    for _, entry_properties in entries:
+        group = get_property(entry_properties, 'cn')
+        members = (entry_properties.get('member', []) +
+                   entry_properties.get('memberUid', []))
+        group_members[group] = frozenset(
+            [_member_username(member) for member in members])
+    cache.set_many(
+        dict([(_members_cache_key(group), members)
+              for group, members in group_members.iteritems()
+              if group in CACHED_GROUPS]),
+        settings.LDAP_GROUP_CACHE_TIMEOUT)
+    return group_members
+
+
+def paged_search_s(ldap_handle, base, scope, filterstr, attrlist=None,
+                   page_size=LDAP_PAGE_SIZE):
+    """
+    Like ldap_handle.search_s, but fetches the entries found page_size entries
+    at a time using the simple paged results control, so that searches are
+    not cut short by the server's size limit.
+    Returns the list of entries found. Raises ldap.LDAPError upon error.
+    """
+    control = SimplePagedResultsControl(True, size=page_size, cookie='')
+    entries = []
+    while True:
+        msgid = ldap_handle.search_ext(base, scope, filterstr, attrlist,
+                                       serverctrls=[control])
+        _, page, _, response_controls = ldap_handle.result3(msgid)
+        entries.extend(page)
+        cookies = [
+            response_control.cookie for response_control in response_controls
+            if response_control.controlType ==
+            SimplePagedResultsControl.controlType]
+        if not cookies or not cookies[0]:
+            return entries
+        control.cookie = cookies[0]
+
+
+def invalidate_group_membership(group, usernames=()):
+    """
+    Removes the cached members of a group, as well as the cached membership
+    of each of the given usernames in the group.
+    """
+    keys = [_members_cache_key(group)]
+    keys.extend([_member_cache_key(username, group) for username in usernames])
+    cache.delete_many(keys)
 
 
 def create_group(group, object_class='groupOfNames'):
@@ -470,32 +647,31 @@ def create_group(group, object_class='groupOfNames'):
     if object_class not in ['groupOfNames', 'posixGroup']:
         return False
 
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    group_dn = 'cn=%s,%s' % (group, settings.LDAP_BASE['GROUP'])
-    attr = [
-        ('objectClass', ['top', object_class]),
-        ('cn', group),
-    ]
-
-    if object_class == 'groupOfNames':
-        # groupOfNames objectClass requires at least one member in the group
-        # at all times, so add the default user to this new groupOfNames group
-        # initially. (Note that the default user can later be removed after
-        # other members have been added, if desired.)
-        attr.append(('member', settings.LDAP_DEFAULT_USER))
-    else:
-        attr.append(('gidNumber', str(generate_new_gidnumber())))
+        group_dn = 'cn=%s,%s' % (group, settings.LDAP_BASE['GROUP'])
+        attr = [
+            ('objectClass', ['top', object_class]),
+            ('cn', group),
+        ]
+
+        if object_class == 'groupOfNames':
+            # groupOfNames objectClass requires at least one member in the group
+            # at all times, so add the default user to this new groupOfNames
+            # group initially. (Note that the default user can later be removed
+            # after other members have been added, if desired.)
+            attr.append(('member', settings.LDAP_DEFAULT_USER))
+        else:
+            attr.append(('gidNumber', str(generate_new_gidnumber())))
 
-    try:
-        ldap_handle.add_s(group_dn, attr)
-    except ldap.LDAPError:
-        return False
+        try:
+            ldap_handle.add_s(group_dn, attr)
+        except ldap.LDAPError:
+            return False
 
-    ldap_handle.unbind()
-    return True
+        return True
 
 
 def generate_new_gidnumber():
@@ -504,49 +680,49 @@ def generate_new_gidnumber():
     the range [2001, 65533]. The function finds the current highest value gid
     in that range and adds 1 to it to create a new gid.
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    # Search for any group:
-    searchstr = '(cn=*)'
-    try:
-        entries = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
-                                       settings.LDAP['SCOPE'],
-                                       searchstr)
-    except ldap.LDAPError:
-        return False
+        # Search for any group:
+        searchstr = '(cn=*)'
+        try:
+            entries = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
+                                           settings.LDAP['SCOPE'],
+                                           searchstr)
+        except ldap.LDAPError:
+            return False
 
-    min_gid = 2001
-    max_gid = 65533
-    current_gids = []
-
-    # Find all current gidNumbers used by LDAP groups:
-    for entry in entries:
-        entry_properties = entry[1]
-        if 'gidNumber' in entry_properties:
-            # Note that entry_properties['gidNumber'] returns a list, but each
-            # entry can only have one gidNumber, so the list will be of length
-            # 1 and the gidNumber will be at index 0. Also note that the
-            # gidNumber will appear as a string instead of an int in that list,
-            # so it must be converted to an int:
-            current_gids.append(int(entry_properties['gidNumber'][0]))
-
-    # Find all current gidNumbers used by unix groups:
-    for group_struct in grp.getgrall():
-        # gid is stored as a number at the second index in the group structures
-        # returned by grp.getgrall()
-        current_gids.append(group_struct[2])
-
-    relevant_gids = [gid for gid in current_gids
-                     if min_gid <= gid <= max_gid]
-
-    if relevant_gids:
-        # if relevant_gids is non-empty (that is, there were gids currently in
-        # use within the [min_gid, max_gid] range)
-        return max(relevant_gids) + 1
-    else:
-        return min_gid
+        min_gid = 2001
+        max_gid = 65533
+        current_gids = []
+
+        # Find all current gidNumbers used by LDAP groups:
+        for entry in entries:
+            entry_properties = entry[1]
+            if 'gidNumber' in entry_properties:
+                # Note that entry_properties['gidNumber'] returns a list, but
+                # each entry can only have one gidNumber, so the list will be of
+                # length 1 and the gidNumber will be at index 0. Also note that
+                # the gidNumber will appear as a string instead of an int in
+                # that list, so it must be converted to an int:
+                current_gids.append(int(entry_properties['gidNumber'][0]))
+
+        # Find all current gidNumbers used by unix groups:
+        for group_struct in grp.getgrall():
+            # gid is stored as a number at the second index in the group
+            # structures returned by grp.getgrall()
+            current_gids.append(group_struct[2])
+
+        relevant_gids = [gid for gid in current_gids
+                         if min_gid <= gid <= max_gid]
+
+        if relevant_gids:
+            # if relevant_gids is non-empty (that is, there were gids currently
+            # in use within the [min_gid, max_gid] range)
+            return max(relevant_gids) + 1
+        else:
+            return min_gid
 
 
 def delete_group(group):
@@ -554,20 +730,19 @@ def delete_group(group):
     Deletes an LDAP group
     Returns False if any errors were encountered
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    group = smart_bytes(group)
-    group_dn = 'cn=%s,%s' % (group, settings.LDAP_BASE['GROUP'])
+        group = smart_bytes(group)
+        group_dn = 'cn=%s,%s' % (group, settings.LDAP_BASE['GROUP'])
 
-    try:
-        ldap_handle.delete_s(group_dn)
-    except ldap.LDAPError:
-        return False
+        try:
+            ldap_handle.delete_s(group_dn)
+        except ldap.LDAPError:
+            return False
 
-    ldap_handle.unbind()
-    return True
+        return True
 
 
 def group_exists(group):
@@ -575,19 +750,19 @@ def group_exists(group):
     Checks if the group is in the Group LDAP tree
     Returns True/False, or None upon error.
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return None
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return None
 
-    group = smart_bytes(group)
-    searchstr = '(cn=%s)' % group
-    try:
-        entry = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
-                                     settings.LDAP['SCOPE'],
-                                     searchstr)
-        return bool(entry)
-    except ldap.LDAPError:
-        return None
+        group = smart_bytes(group)
+        searchstr = '(cn=%s)' % group
+        try:
+            entry = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
+                                         settings.LDAP['SCOPE'],
+                                         searchstr)
+            return bool(entry)
+        except ldap.LDAPError:
+            return None
 
 
 def get_group_member_attr(group):
@@ -596,66 +771,66 @@ def get_group_member_attr(group):
     group is of the objectClass groupOfNames, or "memberUid" if it is of the
     objectClass posixGroup.
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    group = smart_bytes(group)
-    searchstr = '(cn=%s)' % group
-    try:
-        entry = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
-                                     settings.LDAP['SCOPE'],
-                                     searchstr)
-    except ldap.LDAPError:
-        return False
+        group = smart_bytes(group)
+        searchstr = '(cn=%s)' % group
+        try:
+            entry = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
+                                         settings.LDAP['SCOPE'],
+                                         searchstr)
+        except ldap.LDAPError:
+            return False
 
-    # Should only return one successful entry (since there should only be one
-    # group that matches the group parameter used with this function)
-    if len(entry) != 1 or len(entry[0]) != 2:
-        return False
+        # Should only return one successful entry (since there should only be
+        # one group that matches the group parameter used with this function)
+        if len(entry) != 1 or len(entry[0]) != 2:
+            return False
 
-    entry_properties = entry[0][1]
-    group_classes = entry_properties['objectClass']
-    if 'posixGroup' in group_classes:
-        member_attribute = 'memberUid'
-    elif 'groupOfNames' in group_classes:
-        member_attribute = 'member'
-    else:
-        return False
-    return member_attribute
+        entry_properties = entry[0][1]
+        group_classes = entry_properties['objectClass']
+        if 'posixGroup' in group_classes:
+            member_attribute = 'memberUid'
+        elif 'groupOfNames' in group_classes:
+            member_attribute = 'member'
+        else:
+            return False
+        return member_attribute
 
 
 def get_group_members(group):
     """
     Return a list of the members in the group.
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    group = smart_bytes(group)
-    searchstr = '(cn=%s)' % group
-    try:
-        entry = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
-                                     settings.LDAP['SCOPE'],
-                                     searchstr)
-    except ldap.LDAPError:
-        return False
+        group = smart_bytes(group)
+        searchstr = '(cn=%s)' % group
+        try:
+            entry = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
+                                         settings.LDAP['SCOPE'],
+                                         searchstr)
+        except ldap.LDAPError:
+            return False
 
-    # Should only return one successful entry (since there should only be one
-    # group that matches the group parameter used with this function)
-    if len(entry) != 1 or len(entry[0]) != 2:
-        return False
+        # Should only return one successful entry (since there should only be
+        # one group that matches the group parameter used with this function)
+        if len(entry) != 1 or len(entry[0]) != 2:
+            return False
 
-    member_attribute = get_group_member_attr(group)
-    entry_properties = entry[0][1]
-    if member_attribute in entry_properties:
-        return entry_properties[member_attribute]
-    else:
-        # It is possible for a posixGroup to have no members, in which case
-        # 'memberUid' will not be listed in the entry's properties, indicating
-        # that there are no members (so return an empty list):
-        return []
+        member_attribute = get_group_member_attr(group)
+        entry_properties = entry[0][1]
+        if member_attribute in entry_properties:
+            return entry_properties[member_attribute]
+        else:
+            # It is possible for a posixGroup to have no members, in which case
+            # 'memberUid' will not be listed in the entry's properties,
+            # indicating that there are no members (so return an empty list):
+            return []
 
 
 def clear_group_members(group):
@@ -664,51 +839,54 @@ def clear_group_members(group):
     member, then the function ensures that the default user remains in the
     group. Returns True upon successful completion, False otherwise.
     """
-    ldap_handle = initialize()
-    if ldap_handle is None:
-        return False
+    with service_connection() as ldap_handle:
+        if ldap_handle is None:
+            return False
 
-    group = smart_bytes(group)
-    searchstr = '(cn=%s)' % group
-    try:
-        entry = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
-                                     settings.LDAP['SCOPE'],
-                                     searchstr)
-    except ldap.LDAPError:
-        return False
+        group = smart_bytes(group)
+        searchstr = '(cn=%s)' % group
+        try:
+            entry = ldap_handle.search_s(settings.LDAP_BASE['GROUP'],
+                                         settings.LDAP['SCOPE'],
+                                         searchstr)
+        except ldap.LDAPError:
+            return False
 
-    # Should only return one successful entry (since there should only be one
-    # group that matches the group parameter used with this function)
-    if len(entry) != 1 or len(entry[0]) != 2:
-        return False
+        # Should only return one successful entry (since there should only be
+        # one group that matches the group parameter used with this function)
+        if len(entry) != 1 or len(entry[0]) != 2:
+            return False
 
-    group_dn = entry[0][0]
-    entry_properties = entry[0][1]
-    group_classes = entry_properties['objectClass']
-    members = get_group_members(group)
-    member_attribute = get_group_member_attr(group)
-
-    if settings.LDAP_DEFAULT_USER in members:
-        # Do not wish to remove the default user from the ldap group, so remove
-        # it from the members list
-        members.remove(settings.LDAP_DEFAULT_USER)
-    elif 'groupOfNames' in group_classes:
-        # If the default user is not in the list of members and the group is in
-        # the groupOfNames class (implying that the group requires at least 1
-        # member in the group), then add the default user to the ldap group,
-        # but not to the list "members" (to prevent the default user from being
-        # subsequently removed)
-        modlist = [(ldap.MOD_ADD, member_attribute, settings.LDAP_DEFAULT_USER)]
-        ldap_handle.modify_s(group_dn, modlist)
-
-    modlist = [(ldap.MOD_DELETE, member_attribute, member)
-               for member in members]
+        group_dn = entry[0][0]
+        entry_properties = entry[0][1]
+        group_classes = entry_properties['objectClass']
+        members = get_group_members(group)
+        member_attribute = get_group_member_attr(group)
+
+        if settings.LDAP_DEFAULT_USER in members:
+            # Do not wish to remove the default user from the ldap group, so
+            # remove it from the members list
+            members.remove(settings.LDAP_DEFAULT_USER)
+        elif 'groupOfNames' in group_classes:
+            # If the default user is not in the list of members and the group is
+            # in the groupOfNames class (implying that the group requires at
+            # least 1 member in the group), then add the default user to the
+            # ldap group, but not to the list "members" (to prevent the default
+            # user from being subsequently removed)
+            modlist = [(ldap.MOD_ADD, member_attribute,
+                        settings.LDAP_DEFAULT_USER)]
+            ldap_handle.modify_s(group_dn, modlist)
+
+        modlist = [(ldap.MOD_DELETE, member_attribute, member)
+                   for member in members]
 
-    try:
-        ldap_handle.modify_s(group_dn, modlist)
-    except ldap.LDAPError:
-        return False
-    return True
+        try:
+            ldap_handle.modify_s(group_dn, modlist)
+        except ldap.LDAPError:
+            return False
+        invalidate_group_membership(
+            group, [_member_username(member) for member in members])
+        return True
 
 
 # TODO(flieee): move else where or delete for quark tbp/pie repo split
@@ -723,8 +901,9 @@ def is_in_tbp_group(username, group):
     """
     Convenience method for checking if a username is part of a specified TBP
     LDAP group, entered as a string (e.g., 'members' or 'officers').
+    The result may come from the cache (see is_group_member_cached).
     """
-    return is_group_member(username, 'tbp-%s' % group)
+    return is_group_member_cached(username, 'tbp-%s' % group)
 
 
 def is_pie(username):
@@ -43,7 +43,8 @@ DATABASES = {
     }
 }
 
-# Use a default local memory cache
+# Use a default local memory cache. It is private to each process, so
+# production and staging use a shared cache instead.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
@@ -157,12 +158,14 @@ TEMPLATE_CONTEXT_PROCESSORS = (
     'django.core.context_processors.static',
     'quark.base.context_processors.local_env',
     'quark.notifications.context_processors.notifications',
+    'quark.user_profiles.context_processors.user_roles',
 )
 
 MIDDLEWARE_CLASSES = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'quark.user_profiles.middleware.UserRolesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.doc.XViewMiddleware',
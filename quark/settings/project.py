@@ -81,6 +81,27 @@ LDAP_GROUPS = {
     'TBP': ['tbp-officers', 'tbp-members', 'tbp-candidates'],
 }
 LDAP_DEFAULT_USER = 'uid=default,ou=System,' + LDAP['BASE']
+# Connections bound as LDAP_BASE['DN'] are kept open and shared between
+# requests. SIZE should be at least the number of threads per process (see
+# uwsgi/quark.ini). CHECKOUT_TIMEOUT is how many seconds to wait for a free
+# connection, and idle connections are checked before reuse if they have not
+# been used for HEALTH_CHECK_INTERVAL seconds.
+LDAP_POOL = {
+    'SIZE': 4,
+    'CHECKOUT_TIMEOUT': 5,
+    'HEALTH_CHECK_INTERVAL': 60,
+}
+# Connections used to verify passwords by binding as users, which are kept
+# open and rebound as the next user to log in
+LDAP_AUTH_POOL = {
+    'SIZE': 4,
+    'CHECKOUT_TIMEOUT': 5,
+    'HEALTH_CHECK_INTERVAL': 60,
+}
+# Number of seconds that LDAP group memberships of the groups in LDAP_GROUPS
+# are cached for. Changes made through quark.qldap.utils take effect
+# immediately regardless.
+LDAP_GROUP_CACHE_TIMEOUT = 5 * 60
 
 USE_LDAP = False
 
@@ -91,5 +112,32 @@ VALID_USERNAME = r'^[a-z][a-z0-9]{2,29}$'
 USERNAME_HELPTEXT = ('Username must be 3-30 characters, start with a letter, '
                      'and use only lowercase letters and numbers.')
 
+# Number of seconds after which the process-wide registries of terms, auth
+# groups and achievements are reloaded even if nothing changed. They are also
+# reloaded whenever a term, group or achievement is saved or deleted, but a
+# process that reloads a registry while such a change has not yet been
+# committed sees the old data, and keeps it for up to this long.
+REGISTRY_VERSION_TIMEOUT = 5 * 60
+
 # Valid types are 'semester' and 'quarter'.
 TERM_TYPE = 'semester'
+
+# Achievements are evaluated by the processachievementqueue management command
+# for the users whose event attendance, officer positions or project reports
+# changed. If ACHIEVEMENT_QUEUE_SYNC is True, they are instead evaluated
+# immediately whenever those change (which makes saving them slower).
+ACHIEVEMENT_QUEUE_SYNC = True
+
+# Number of seconds that the summary of a user's achievements shown on their
+# achievements page is cached for, or 0 to not cache it. The summary is removed
+# from the cache whenever the user's achievements change. It is never cached
+# in a local memory cache, which would not see the removals made by other
+# processes.
+USER_ACHIEVEMENTS_CACHE_TIMEOUT = 60 * 60
+
+# Number of seconds that the ICS feeds of events are cached for, or 0 to not
+# cache them. The feeds are removed from the cache whenever an event is saved
+# or deleted. The event restriction levels of the API keys used for the feeds
+# are cached for as long, so a change to a user's roles may take that long to
+# show up in the user's feed.
+ICAL_CACHE_TIMEOUT = 60 * 60
@@ -19,6 +19,26 @@ DATABASES = {
     }
 }
 
+# Use memcached for the default cache, since it must be shared between the
+# uWSGI workers and the management commands run by cron or in a shell: the
+# term, group and achievement registries, the ICS feeds, the achievements
+# summaries and the LDAP group memberships are cached by one process and
+# invalidated by whichever process changes them. A local memory cache (the
+# default) is private to each process, so invalidations would not reach the
+# others.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+        'KEY_PREFIX': 'quark_dev_staging',
+    },
+    # Django Compressor's cache (see third_party.py) is not shared
+    'compressor': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'compressor'
+    },
+}
+
 # Only use LDAP in production/staging
 USE_LDAP = True
 
@@ -26,6 +46,10 @@ USE_LDAP = True
 CSRF_COOKIE_SECURE = True
 SESSION_COOKIE_SECURE = True
 
+# Evaluate achievements with the processachievementqueue management command,
+# run periodically by cron
+ACHIEVEMENT_QUEUE_SYNC = False
+
 # Import any local settings custom for staging environment
 try:
     # pylint: disable=E0611,F0401,W0401,W0614
@@ -13,6 +13,9 @@ DATABASES = {
     },
 }
 
+# Evaluate achievements immediately, so that tests can check them right away
+ACHIEVEMENT_QUEUE_SYNC = True
+
 # Use a dummy cache for the default cache during testing
 CACHES['default'] = {
     'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
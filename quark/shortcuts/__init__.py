@@ -1,5 +1,7 @@
+from contextlib import contextmanager
 from functools import wraps
 import magic
+import threading
 
 from django.shortcuts import _get_queryset
 
@@ -53,3 +55,38 @@ def disable_for_loaddata(signal_handler):
             return
         signal_handler(*args, **kwargs)
     return wrapper
+
+
+class DeferredBatch(object):
+    """Per-thread batches of items (such as the pks of rows whose derived data
+    needs updating), whose processing is deferred to the end of the batch.
+
+    Within "with batch.collect():", add(item) adds the item to the thread's
+    batch, and process is called once with the set of all of the items added
+    when the block exits without an exception. Outside of a batch, add(item)
+    processes the item right away. Nested batches are merged into the
+    outermost one.
+    """
+    def __init__(self, process):
+        self.process = process
+        self._local = threading.local()
+
+    @contextmanager
+    def collect(self):
+        if getattr(self._local, 'items', None) is not None:
+            yield
+            return
+        self._local.items = set()
+        try:
+            yield
+            items = self._local.items
+        finally:
+            self._local.items = None
+        self.process(items)
+
+    def add(self, item):
+        items = getattr(self._local, 'items', None)
+        if items is not None:
+            items.add(item)
+        else:
+            self.process(set([item]))
@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from quark.user_profiles.roles import get_user_roles
+
+
+def user_roles(request):
+    """Add a user_roles context variable with the request user's roles.
+
+    The roles are only resolved if the template actually uses them.
+    """
+    roles = getattr(request, 'user_roles', None)
+    if roles is None:
+        roles = SimpleLazyObject(lambda: get_user_roles(request.user))
+    return {'user_roles': roles}
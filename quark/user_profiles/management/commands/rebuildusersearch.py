@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from quark.user_profiles.models import UserProfile
+from quark.user_profiles.models import UserProfileSearchToken
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the name search tokens and stored avatar URLs of all user '
+            'profiles. These are kept up to date when profiles are saved, so '
+            'this is only needed after they are changed in bulk.')
+
+    def handle(self, *args, **kwargs):
+        num_profiles, num_tokens = rebuild_user_search()
+        if int(kwargs.get('verbosity')) > 0:
+            self.stdout.write(
+                'Stored {} search tokens for {} user profiles'.format(
+                    num_tokens, num_profiles))
+
+
+def rebuild_user_search(batch_size=1000):
+    """Replace the UserProfileSearchTokens of all user profiles, and update
+    their avatar URLs.
+
+    Returns a tuple of the number of profiles and the number of tokens.
+    """
+    num_profiles = 0
+    num_tokens = 0
+    with transaction.atomic():
+        UserProfileSearchToken.objects.all().delete()
+        tokens = []
+        for profile in UserProfile.objects.select_related('user').iterator():
+            num_profiles += 1
+            tokens.extend([
+                UserProfileSearchToken(user_profile=profile, token=token)
+                for token in profile.get_search_tokens()])
+            avatar_url = profile.get_avatar_url()
+            if avatar_url != profile.avatar_url:
+                UserProfile.objects.filter(pk=profile.pk).update(
+                    avatar_url=avatar_url)
+            if len(tokens) >= batch_size:
+                UserProfileSearchToken.objects.bulk_create(tokens)
+                num_tokens += len(tokens)
+                tokens = []
+        UserProfileSearchToken.objects.bulk_create(tokens)
+        num_tokens += len(tokens)
+    return num_profiles, num_tokens
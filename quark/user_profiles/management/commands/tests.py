@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from quark.user_profiles.management.commands.rebuildusersearch import \
+    rebuild_user_search
+from quark.user_profiles.models import UserProfile
+from quark.user_profiles.models import UserProfileSearchToken
+
+
+class RebuildUserSearchTest(TestCase):
+    def test_rebuild_user_search(self):
+        user_model = get_user_model()
+        for i in range(3):
+            user_model.objects.create_user(
+                'user{}'.format(i), 'user{}@tbp.berkeley.edu'.format(i),
+                'password', first_name='First', last_name='Last{}'.format(i))
+        UserProfileSearchToken.objects.all().delete()
+        self.assertFalse(UserProfile.objects.search_by_name('last').exists())
+
+        self.assertEqual(rebuild_user_search(batch_size=2), (3, 6))
+        self.assertEqual(
+            UserProfile.objects.search_by_name('first last1').get().user,
+            user_model.objects.get(username='user1'))
+        self.assertEqual(
+            UserProfile.objects.search_by_name('last').count(), 3)
@@ -0,0 +1,29 @@
+from django.contrib.auth.middleware import get_user
+from django.utils.functional import SimpleLazyObject
+
+from quark.user_profiles.roles import UserRoles
+from quark.user_profiles.roles import get_user_roles
+
+
+class UserRolesMiddleware(object):
+    """Attach a request-scoped UserRoles object to the request's user.
+
+    The roles are resolved lazily, at most once per request, and are shared by
+    everything that checks the request user's roles (templates through the
+    user_roles context processor, Event restriction levels, etc.). The roles
+    are also available directly as request.user_roles.
+
+    Must be listed after AuthenticationMiddleware.
+    """
+    def process_request(self, request):
+        def get_user_with_roles():
+            # get_user caches the user on the request, so this is the same
+            # object that AuthenticationMiddleware loads
+            user = get_user(request)
+            if getattr(user, '_user_roles', None) is None:
+                user._user_roles = UserRoles(user)
+            return user
+
+        request.user = SimpleLazyObject(get_user_with_roles)
+        request.user_roles = SimpleLazyObject(
+            lambda: get_user_roles(request.user))
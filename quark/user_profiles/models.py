@@ -1,8 +1,11 @@
 import os
+import re
+import unicodedata
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import models
+from easy_thumbnails.templatetags.thumbnail import thumbnail_url
 from localflavor.us.models import PhoneNumberField
 from localflavor.us.models import USStateField
 
@@ -19,6 +22,39 @@ from quark.shortcuts import disable_for_loaddata
 USE_LDAP = getattr(settings, 'USE_LDAP', False)
 
 
+def normalize_name(name):
+    """Return the list of lowercase words in the given name, with accents and
+    punctuation removed, for searching by name.
+
+    For instance, u"Ren\u00e9e O'Neil" gives ['renee', 'o', 'neil'].
+    """
+    name = unicodedata.normalize('NFKD', unicode(name)).encode(
+        'ascii', 'ignore')
+    return re.findall(r'[a-z0-9]+', name.lower())
+
+
+class UserProfileManager(models.Manager):
+    def search_by_name(self, query):
+        """Return the profiles of users whose names match the given query.
+
+        A name matches if each word of the query is the beginning of a word in
+        the user's preferred, first, middle or last name (ignoring case,
+        accents and punctuation). The search uses the indexed
+        UserProfileSearchToken table, so it runs entirely in the database.
+        """
+        terms = normalize_name(query)
+        if not terms:
+            return self.none()
+        profiles = self.get_query_set()
+        for term in terms:
+            # Each filter joins the tokens separately, so that each term can
+            # match a different token
+            profiles = profiles.filter(
+                search_tokens__token__startswith=term[
+                    :UserProfileSearchToken.TOKEN_LENGTH])
+        return profiles.distinct()
+
+
 class UserProfile(models.Model):
     """Basic user information."""
     GENDER_CHOICES = (
@@ -58,6 +94,9 @@ class UserProfile(models.Model):
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES, blank=True)
 
     picture = models.ImageField(upload_to=rename_file, blank=True, null=True)
+    # The URL of the 'avatar' thumbnail of the picture, which is stored so that
+    # lists of users do not need to look up a thumbnail for each user
+    avatar_url = models.CharField(max_length=255, blank=True, editable=False)
 
     alt_email = models.EmailField(
         blank=True,
@@ -96,11 +135,14 @@ class UserProfile(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    objects = UserProfileManager()
+
     class Meta(object):
         ordering = ('preferred_name', 'user__last_name')
 
     def save(self, *args, **kwargs):
-        """Ensure that the user has a preferred name saved.
+        """Ensure that the user has a preferred name saved, and update the
+        avatar URL and name search tokens.
 
         Cache the user's first name as their preferred name if the preferred
         name is not specified. This helps to ensure that we can sort users
@@ -111,6 +153,45 @@ class UserProfile(models.Model):
             self.preferred_name = self.user.first_name
         super(UserProfile, self).save(*args, **kwargs)
 
+        # The picture file is only stored by the save above, so its thumbnail
+        # can only be created now
+        avatar_url = self.get_avatar_url()
+        if avatar_url != self.avatar_url:
+            self.avatar_url = avatar_url
+            UserProfile.objects.filter(pk=self.pk).update(
+                avatar_url=avatar_url)
+        self.update_search_tokens()
+
+    def get_avatar_url(self):
+        """Return the URL of the 'avatar' thumbnail of the user's picture,
+        creating the thumbnail if necessary, or an empty string if there is no
+        picture.
+        """
+        if not self.picture:
+            return ''
+        return thumbnail_url(self.picture, 'avatar')
+
+    def get_search_tokens(self):
+        """Return the set of normalized words in the user's names, which are
+        used for searching by name (see UserProfileManager.search_by_name).
+        """
+        names = u' '.join([self.preferred_name, self.user.first_name,
+                           self.middle_name, self.user.last_name])
+        return set([token[:UserProfileSearchToken.TOKEN_LENGTH]
+                    for token in normalize_name(names)])
+
+    def update_search_tokens(self):
+        """Update the user's UserProfileSearchTokens to match the user's
+        names, only writing if the names have changed.
+        """
+        tokens = self.get_search_tokens()
+        existing = set(self.search_tokens.values_list('token', flat=True))
+        if tokens != existing:
+            self.search_tokens.filter(token__in=existing - tokens).delete()
+            UserProfileSearchToken.objects.bulk_create([
+                UserProfileSearchToken(user_profile=self, token=token)
+                for token in tokens - existing])
+
     def __unicode__(self):
         return self.get_common_name()
 
@@ -223,6 +304,23 @@ class UserProfile(models.Model):
             return False
 
 
+class UserProfileSearchToken(models.Model):
+    """A normalized word of a user's names, used for searching users by name
+    with an index (see UserProfileManager.search_by_name).
+    """
+    TOKEN_LENGTH = 64
+
+    user_profile = models.ForeignKey(UserProfile, related_name='search_tokens')
+    token = models.CharField(max_length=TOKEN_LENGTH)
+
+    def __unicode__(self):
+        return self.token
+
+    class Meta(object):
+        # Searches look up tokens by prefix and then join the user profile
+        index_together = (('token', 'user_profile'),)
+
+
 class CollegeStudentInfo(IDCodeMixin):
     """Information about a college student user."""
     user = models.OneToOneField(settings.AUTH_USER_MODEL)
@@ -377,7 +475,14 @@ def user_profile_creation_post_save(sender, instance, created, **kwargs):
     Whenever a user is created, this callback performs a get_or_create()
     to ensure that there is a UserProfile for the saved User.
     """
-    profile, _ = UserProfile.objects.get_or_create(user=instance)
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not set(update_fields).intersection(
+            ['first_name', 'last_name']):
+        # For instance, only the last_login field changed
+        return
+
+    profile, profile_created = UserProfile.objects.get_or_create(
+        user=instance)
 
     # If the profile does not have the preferred_name set and the user's
     # first_name field is not empty, call the profile's save method to update
@@ -386,6 +491,10 @@ def user_profile_creation_post_save(sender, instance, created, **kwargs):
     # specified.
     if instance.first_name and not profile.preferred_name:
         profile.save()
+    elif not profile_created:
+        # The user's names may have changed
+        profile.user = instance
+        profile.update_search_tokens()
 
 
 def student_org_creation_post_save(sender, instance, created, **kwargs):
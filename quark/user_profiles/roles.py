@@ -0,0 +1,143 @@
+from django.conf import settings
+from django.utils import timezone
+
+from quark.base.models import Officer
+from quark.base.models import Term
+from quark.candidates.models import Candidate
+from quark.qldap import utils as ldap_utils
+from quark.user_profiles.models import StudentOrgUserProfile
+
+
+class UserRoles(object):
+    """The student organization roles held by a user.
+
+    All roles are resolved together the first time any of them is requested,
+    using one query for the user's StudentOrgUserProfile and (only if that
+    profile exists) one query each for the user's Officer and Candidate
+    objects. LDAP group lookups are only made when a role actually depends on
+    them, and each group is looked up at most once.
+
+    The methods mirror those of StudentOrgUserProfile (and UserProfile), so
+    they can be called from templates without arguments:
+        {% if user_roles.is_officer %}
+    """
+    def __init__(self, user):
+        self.user = user
+        self._resolved = False
+        self._has_profile = False
+        self._initiation_term_id = None
+        self._current_term_id = None
+        # List of (term id, position auxiliary) tuples for the user's Officer
+        # objects:
+        self._officerships = []
+        # Set of term ids for the user's Candidate objects:
+        self._candidate_term_ids = set()
+        # Map from LDAP group name (like 'members') to membership:
+        self._ldap_groups = {}
+
+    def _resolve(self):
+        if self._resolved:
+            return
+        self._resolved = True
+
+        if self.user is None or not self.user.is_authenticated():
+            return
+
+        initiation_terms = list(StudentOrgUserProfile.objects.filter(
+            user=self.user).values_list('initiation_term', flat=True))
+        if not initiation_terms:
+            # Users without a StudentOrgUserProfile hold no roles
+            return
+        self._has_profile = True
+        self._initiation_term_id = initiation_terms[0]
+
+        current_term = Term.objects.get_current_term()
+        if current_term:
+            self._current_term_id = current_term.id
+        else:
+            # Compare against the same stand-in term used by Term's comparison
+            # methods when there is no current term
+            self._current_term_id = Term(
+                term=Term.UNKNOWN, year=timezone.now().year)._calculate_pk()
+
+        self._officerships = list(Officer.objects.filter(
+            user=self.user).values_list('term', 'position__auxiliary'))
+        self._candidate_term_ids = set(Candidate.objects.filter(
+            user=self.user).values_list('term', flat=True))
+
+    def _is_in_ldap_group(self, group):
+        if group not in self._ldap_groups:
+            self._ldap_groups[group] = ldap_utils.is_in_tbp_group(
+                self.user.get_username(), group)
+        return self._ldap_groups[group]
+
+    def is_candidate(self, current=True):
+        """Return True if this user is a candidate, False if initiated.
+
+        See StudentOrgUserProfile.is_candidate.
+        """
+        self._resolve()
+        if not self._has_profile:
+            return False
+        if (self._initiation_term_id is not None and
+                self._initiation_term_id <= self._current_term_id):
+            return False
+        if current:
+            return self._current_term_id in self._candidate_term_ids
+        return len(self._candidate_term_ids) > 0
+
+    def is_member(self):
+        """Return True if this user is a current member of the organization.
+
+        See StudentOrgUserProfile.is_member.
+        """
+        self._resolve()
+        if not self._has_profile:
+            return False
+        if self._initiation_term_id is not None:
+            return True
+        is_officer = self.is_officer()
+        if getattr(settings, 'USE_LDAP', False):
+            return is_officer or self._is_in_ldap_group('members')
+        return is_officer
+
+    def is_officer(self, current=False, exclude_aux=False):
+        """Return True if this user is an officer in the organization.
+
+        See StudentOrgUserProfile.is_officer.
+        """
+        self._resolve()
+        if not self._has_profile:
+            return False
+        if (not current and not exclude_aux and
+                getattr(settings, 'USE_LDAP', False) and
+                self._is_in_ldap_group('officers')):
+            return True
+        for term_id, auxiliary in self._officerships:
+            if current and term_id != self._current_term_id:
+                continue
+            if exclude_aux and auxiliary:
+                continue
+            return True
+        return False
+
+    def is_current_officer(self):
+        """Return True if this user is an officer in the current term.
+
+        Useful in templates, where arguments cannot be passed to is_officer.
+        """
+        return self.is_officer(current=True)
+
+
+def get_user_roles(user):
+    """Return the UserRoles for the given user.
+
+    If the user is a request's user (see UserRolesMiddleware), the roles
+    resolved for that request are reused. Otherwise the roles are resolved
+    anew, so that callers holding a plain user object always see up-to-date
+    roles.
+    """
+    roles = getattr(user, '_user_roles', None)
+    if roles is None:
+        roles = UserRoles(user)
+    return roles
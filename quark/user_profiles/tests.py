@@ -8,11 +8,17 @@ from quark.base.models import OfficerPosition
 from quark.base.models import Term
 from quark.candidates.models import Candidate
 from quark.shortcuts import get_object_or_none
+from quark.user_profiles.management.commands.rebuildusersearch import \
+    rebuild_user_search
 from quark.user_profiles.fields import UserCommonNameChoiceField
 from quark.user_profiles.fields import UserCommonNameMultipleChoiceField
 from quark.user_profiles.models import CollegeStudentInfo
 from quark.user_profiles.models import StudentOrgUserProfile
 from quark.user_profiles.models import UserProfile
+from quark.user_profiles.models import UserProfileSearchToken
+from quark.user_profiles.models import normalize_name
+from quark.user_profiles.roles import UserRoles
+from quark.user_profiles.roles import get_user_roles
 
 
 # TODO(sjdemartini): Add tests for LDAP-specific testing in methods that use
@@ -192,6 +198,81 @@ class UserProfilesTest(UserInfoTestCase):
         self.assertTrue(self.profile.is_officer())
 
 
+class UserSearchTest(UserInfoTestCase):
+    def search(self, query):
+        return list(UserProfile.objects.search_by_name(query))
+
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name(u'Ren\u00e9e  O\'Neil-Smith'),
+                         ['renee', 'o', 'neil', 'smith'])
+        self.assertEqual(normalize_name(''), [])
+
+    def test_search_by_name(self):
+        profile = self.user.userprofile
+        self.assertEqual(self.search('edw'), [profile])
+        self.assertEqual(self.search('EDWARD will'), [profile])
+        self.assertEqual(self.search('will edw'), [profile])
+        self.assertEqual(self.search('ward'), [])
+        self.assertEqual(self.search('edward smith'), [])
+        self.assertEqual(self.search(''), [])
+
+        # Preferred and middle names are searchable
+        profile.preferred_name = 'Ted'
+        profile.middle_name = 'Tau'
+        profile.save()
+        self.assertEqual(self.search('ted tau'), [profile])
+        self.assertEqual(self.search('edward'), [profile])
+
+        # Changes to the user's names are reflected
+        self.user.last_name = 'Bent'
+        self.user.save()
+        self.assertEqual(self.search('bent'), [profile])
+        self.assertEqual(self.search('williams'), [])
+        self.assertItemsEqual(
+            UserProfileSearchToken.objects.filter(
+                user_profile=profile).values_list('token', flat=True),
+            ['ted', 'edward', 'tau', 'bent'])
+
+        # A profile matches only once, even if several tokens match a term
+        other_user = self.user_model.objects.create_user(
+            'other', 'other@tbp.berkeley.edu', 'testpw', first_name='Bob',
+            last_name='Bobson')
+        self.assertEqual(self.search('bob'), [other_user.userprofile])
+
+    def test_last_login_does_not_update_tokens(self):
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=['last_login'])
+
+    def test_search_many_users(self):
+        """Test that a search among many users takes a single query and
+        returns exactly the users whose names match.
+        """
+        num_users = 200
+        first_names = ['Alice', 'Bob', 'Carol', 'Dave', 'Erin', 'Frank',
+                       'Grace', 'Heidi', 'Ivan', 'Judy']
+        self.user_model.objects.bulk_create([
+            self.user_model(username='user{}'.format(i),
+                            first_name=first_names[i % len(first_names)],
+                            last_name='Last{}'.format(i))
+            for i in range(num_users)])
+        UserProfile.objects.bulk_create([
+            UserProfile(user_id=pk, preferred_name=first_name)
+            for pk, first_name in self.user_model.objects.filter(
+                username__startswith='user').values_list('pk', 'first_name')])
+        rebuild_user_search()
+
+        with self.assertNumQueries(1):
+            results = list(UserProfile.objects.search_by_name(
+                'grace last1').select_related('user')[:20])
+
+        expected = ['user{}'.format(i) for i in range(num_users)
+                    if first_names[i % len(first_names)] == 'Grace' and
+                    str(i).startswith('1')]
+        self.assertEqual(len(expected), 11)
+        self.assertItemsEqual(
+            [profile.user.username for profile in results], expected)
+
+
 class StudentOrgUserProfilesTest(UserInfoTestCase):
     def setUp(self):
         super(StudentOrgUserProfilesTest, self).setUp()
@@ -502,6 +583,94 @@ class StudentOrgUserProfilesTest(UserInfoTestCase):
                                                 user=self.user))
 
 
+class UserRolesTest(UserInfoTestCase):
+    def setUp(self):
+        super(UserRolesTest, self).setUp()
+        self.profile = StudentOrgUserProfile(user=self.user)
+        self.profile.save()
+
+        self.advisor_pos = OfficerPosition(
+            short_name='advisor',
+            long_name='Advisor (test)',
+            rank=4,
+            mailing_list='IT',
+            auxiliary=True)
+        self.advisor_pos.save()
+
+    def assert_roles_match_profile(self):
+        """Assert that newly resolved roles agree with the profile methods."""
+        profile = get_object_or_none(StudentOrgUserProfile, user=self.user)
+        roles = UserRoles(self.user)
+        self.assertEqual(roles.is_candidate(), profile.is_candidate())
+        self.assertEqual(roles.is_candidate(current=False),
+                         profile.is_candidate(current=False))
+        self.assertEqual(roles.is_member(), profile.is_member())
+        for current in (True, False):
+            for exclude_aux in (True, False):
+                self.assertEqual(
+                    roles.is_officer(current=current, exclude_aux=exclude_aux),
+                    profile.is_officer(current=current,
+                                       exclude_aux=exclude_aux))
+
+    def test_roles_match_profile(self):
+        self.assert_roles_match_profile()
+
+        candidate = Candidate(user=self.user, term=self.term_old)
+        candidate.save()
+        self.assert_roles_match_profile()
+
+        candidate.initiated = True
+        candidate.save()
+        self.assert_roles_match_profile()
+
+        Candidate(user=self.user, term=self.term).save()
+        self.assert_roles_match_profile()
+
+        officer = Officer(user=self.user, position=self.advisor_pos,
+                          term=self.term)
+        officer.save()
+        self.assert_roles_match_profile()
+
+        officer.term = self.term_old
+        officer.position = self.committee
+        officer.save()
+        self.assert_roles_match_profile()
+
+    def test_no_profile(self):
+        self.profile.delete()
+        roles = UserRoles(self.user)
+        with self.assertNumQueries(1):
+            self.assertFalse(roles.is_officer())
+            self.assertFalse(roles.is_member())
+            self.assertFalse(roles.is_candidate())
+
+    def test_bounded_queries(self):
+        Officer(user=self.user, position=self.committee, term=self.term).save()
+        Candidate(user=self.user, term=self.term_old).save()
+        roles = UserRoles(self.user)
+        # One query each for the profile, the current term (which is not
+        # cached, since tests use a dummy cache), officers and candidates:
+        with self.assertNumQueries(4):
+            roles.is_officer()
+            roles.is_officer(current=True, exclude_aux=True)
+            roles.is_member()
+            roles.is_candidate()
+            roles.is_candidate(current=False)
+        # Nothing is re-queried once resolved:
+        with self.assertNumQueries(0):
+            roles.is_current_officer()
+            roles.is_member()
+
+    def test_get_user_roles(self):
+        # Plain users get newly resolved roles on every call
+        self.assertIsNot(get_user_roles(self.user), get_user_roles(self.user))
+
+        # Users with attached roles (as done by UserRolesMiddleware) reuse
+        # them
+        self.user._user_roles = UserRoles(self.user)
+        self.assertIs(get_user_roles(self.user), self.user._user_roles)
+
+
 class FieldsTest(TestCase):
     def setUp(self):
         self.user_model = get_user_model()